@@ -0,0 +1,26 @@
+"""chat messages conversation index
+
+Revision ID: a3c6e1f8b2d4
+Revises: f1b8d3a6c2e9
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'a3c6e1f8b2d4'
+down_revision: Union[str, None] = 'f1b8d3a6c2e9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_chat_messages_user_conversation_created', 'chat_messages',
+        ['user_id', 'conversation_id', 'created_at'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chat_messages_user_conversation_created', table_name='chat_messages')
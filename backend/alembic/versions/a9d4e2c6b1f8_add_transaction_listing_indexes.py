@@ -0,0 +1,40 @@
+"""add transaction listing indexes
+
+Revision ID: a9d4e2c6b1f8
+Revises: e5c1d9f3a7b4
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+from alembic import op
+
+revision: str = 'a9d4e2c6b1f8'
+down_revision: Union[str, None] = 'e5c1d9f3a7b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keyset pagination walks (user_id, date, id) backwards; category filters get their own prefix
+    op.create_index('ix_transactions_user_date_id', 'transactions', ['user_id', 'date', 'id'])
+    op.create_index(
+        'ix_transactions_user_category_date_id', 'transactions', ['user_id', 'category', 'date', 'id']
+    )
+
+    # Trigram indexes back the ILIKE text search on description and invoice number
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index(
+        'ix_transactions_description_trgm', 'transactions', ['description'],
+        postgresql_using='gin', postgresql_ops={'description': 'gin_trgm_ops'}
+    )
+    op.create_index(
+        'ix_transactions_invoice_id_trgm', 'transactions', ['invoice_id'],
+        postgresql_using='gin', postgresql_ops={'invoice_id': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_transactions_invoice_id_trgm', table_name='transactions')
+    op.drop_index('ix_transactions_description_trgm', table_name='transactions')
+    op.drop_index('ix_transactions_user_category_date_id', table_name='transactions')
+    op.drop_index('ix_transactions_user_date_id', table_name='transactions')
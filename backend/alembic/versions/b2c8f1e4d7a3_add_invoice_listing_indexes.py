@@ -0,0 +1,26 @@
+"""add invoice listing indexes
+
+Revision ID: b2c8f1e4d7a3
+Revises: a9d4e2c6b1f8
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+from alembic import op
+
+revision: str = 'b2c8f1e4d7a3'
+down_revision: Union[str, None] = 'a9d4e2c6b1f8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keyset pagination of the invoice list walks (user_id, created_at, id) backwards
+    op.create_index('ix_invoices_user_created_id', 'invoices', ['user_id', 'created_at', 'id'])
+    # Date range filters and the bulk PDF export
+    op.create_index('ix_invoices_user_invoice_date', 'invoices', ['user_id', 'invoice_date'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_invoices_user_invoice_date', table_name='invoices')
+    op.drop_index('ix_invoices_user_created_id', table_name='invoices')
@@ -0,0 +1,88 @@
+"""add transaction fingerprint
+
+Revision ID: b7e2f4a91c3d
+Revises: c1136822551d
+Create Date: 2026-10-19
+
+"""
+import hashlib
+import re
+import unicodedata
+from collections import Counter
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'b7e2f4a91c3d'
+down_revision: Union[str, None] = 'c1136822551d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _normalize_description(description):
+    text = unicodedata.normalize('NFKD', description or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', text).strip().casefold()
+
+
+def _fingerprint(user_id, day, amount, txn_type, description, occurrence):
+    # Frozen copy of statement_import.row_fingerprint as of this revision, with no account
+    signed_amount = -abs(amount) if txn_type == "expense" else abs(amount)
+    key = "|".join([
+        str(user_id),
+        day.isoformat(),
+        f"{signed_amount:.2f}",
+        _normalize_description(description),
+        "",
+        str(occurrence),
+    ])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def upgrade() -> None:
+    op.add_column('transactions', sa.Column('fingerprint', sa.String(length=64), nullable=True))
+
+    # Backfill rows from earlier manual uploads so re-imports of the same statements are detected
+    bind = op.get_bind()
+    rows = bind.execute(sa.text(
+        "SELECT id, user_id, date, amount, type, description FROM transactions "
+        "WHERE provider = 'manual_upload' AND date IS NOT NULL ORDER BY user_id, date, id"
+    )).mappings()
+
+    update = sa.text("UPDATE transactions SET fingerprint = :fingerprint WHERE id = :id")
+    batch = []
+    current_day = None
+    seen = Counter()
+    for row in rows:
+        day = (row['user_id'], row['date'].date())
+        if day != current_day:
+            current_day = day
+            seen = Counter()
+        amount = float(row['amount'] or 0)
+        # Identical rows on the same day are numbered, as the importer does within one statement
+        base = _fingerprint(row['user_id'], day[1], amount, row['type'], row['description'], 0)
+        occurrence = seen[base]
+        seen[base] += 1
+        fingerprint = base if occurrence == 0 else _fingerprint(
+            row['user_id'], day[1], amount, row['type'], row['description'], occurrence
+        )
+
+        batch.append({"fingerprint": fingerprint, "id": row['id']})
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            bind.execute(update, batch)
+            batch = []
+    if batch:
+        bind.execute(update, batch)
+
+    op.create_index(
+        'ix_transactions_fingerprint', 'transactions', ['fingerprint'],
+        unique=True, postgresql_where=sa.text('fingerprint IS NOT NULL')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_transactions_fingerprint', table_name='transactions')
+    op.drop_column('transactions', 'fingerprint')
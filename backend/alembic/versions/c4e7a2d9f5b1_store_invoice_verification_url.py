@@ -0,0 +1,83 @@
+"""store invoice verification url instead of qr png
+
+Revision ID: c4e7a2d9f5b1
+Revises: b2c8f1e4d7a3
+Create Date: 2026-10-19
+
+"""
+import base64
+import re
+from io import BytesIO
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'c4e7a2d9f5b1'
+down_revision: Union[str, None] = 'b2c8f1e4d7a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+QR_URL_SANDBOX = "https://prewww2.aeat.es/wlpl/TIKE-CONT/ValidarQR"
+BACKFILL_BATCH_SIZE = 1000
+ISSUER_NIF = re.compile(r"<sum1:IDFactura>\s*<sum1:IDEmisorFactura>([^<]+)</sum1:IDEmisorFactura>")
+
+
+def upgrade() -> None:
+    op.add_column('invoices', sa.Column('verification_url', sa.String(length=500), nullable=True))
+
+    # Rebuild the URL each stored QR encodes from the VeriFactu record written when the invoice was issued,
+    # never from the user's current NIF. qr_code_data is kept: the PDF still falls back to it for invoices
+    # whose record is missing or incomplete.
+    bind = op.get_bind()
+    rows = bind.execute(sa.text(
+        "SELECT id, invoice_number, invoice_date, total, verifactu_xml FROM invoices "
+        "WHERE qr_code_data IS NOT NULL AND verifactu_xml IS NOT NULL "
+        "AND invoice_number IS NOT NULL AND invoice_date IS NOT NULL AND total IS NOT NULL"
+    )).mappings()
+
+    update = sa.text("UPDATE invoices SET verification_url = :url WHERE id = :id")
+    batch = []
+    for row in rows:
+        match = ISSUER_NIF.search(row['verifactu_xml'])
+        if not match:
+            continue
+        url = (
+            f"{QR_URL_SANDBOX}?nif={match.group(1).upper().strip()}"
+            f"&numserie={row['invoice_number'].strip()}"
+            f"&fecha={row['invoice_date'].strftime('%d-%m-%Y')}"
+            f"&importe={float(row['total']):.2f}"
+        )
+        batch.append({"url": url, "id": row['id']})
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            bind.execute(update, batch)
+            batch = []
+    if batch:
+        bind.execute(update, batch)
+
+
+def downgrade() -> None:
+    import qrcode
+
+    # Invoices issued since the upgrade only have a URL; give them the base64 PNG the old code reads
+    bind = op.get_bind()
+    rows = bind.execute(sa.text(
+        "SELECT id, verification_url FROM invoices WHERE verification_url IS NOT NULL AND qr_code_data IS NULL"
+    )).mappings()
+
+    update = sa.text("UPDATE invoices SET qr_code_data = :qr WHERE id = :id")
+    batch = []
+    for row in rows:
+        qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=10, border=4)
+        qr.add_data(row['verification_url'])
+        qr.make(fit=True)
+        buffer = BytesIO()
+        qr.make_image(fill_color="black", back_color="white").save(buffer)
+        batch.append({"qr": base64.b64encode(buffer.getvalue()).decode('utf-8'), "id": row['id']})
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            bind.execute(update, batch)
+            batch = []
+    if batch:
+        bind.execute(update, batch)
+
+    op.drop_column('invoices', 'verification_url')
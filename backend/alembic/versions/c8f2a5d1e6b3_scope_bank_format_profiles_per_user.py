@@ -0,0 +1,36 @@
+"""scope bank format profiles per user
+
+Revision ID: c8f2a5d1e6b3
+Revises: a3c6e1f8b2d4
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'c8f2a5d1e6b3'
+down_revision: Union[str, None] = 'a3c6e1f8b2d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Profiles learned so far are not tied to anyone; they are relearned on each user's next upload
+    op.execute("DELETE FROM bank_format_profiles")
+    op.drop_index('ix_bank_format_profiles_signature', table_name='bank_format_profiles')
+    op.add_column('bank_format_profiles', sa.Column('user_id', sa.Integer(), nullable=False))
+    op.create_foreign_key(
+        'bank_format_profiles_user_id_fkey', 'bank_format_profiles', 'users', ['user_id'], ['id']
+    )
+    op.create_unique_constraint(
+        'uq_bank_format_profiles_user_signature', 'bank_format_profiles', ['user_id', 'signature']
+    )
+
+
+def downgrade() -> None:
+    op.execute("DELETE FROM bank_format_profiles")
+    op.drop_constraint('uq_bank_format_profiles_user_signature', 'bank_format_profiles', type_='unique')
+    op.drop_constraint('bank_format_profiles_user_id_fkey', 'bank_format_profiles', type_='foreignkey')
+    op.drop_column('bank_format_profiles', 'user_id')
+    op.create_index('ix_bank_format_profiles_signature', 'bank_format_profiles', ['signature'], unique=True)
@@ -0,0 +1,44 @@
+"""add bank format profiles
+
+Revision ID: d3a8c5e17b02
+Revises: b7e2f4a91c3d
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'd3a8c5e17b02'
+down_revision: Union[str, None] = 'b7e2f4a91c3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('bank_format_profiles',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('signature', sa.String(length=64), nullable=False),
+    sa.Column('bank_name', sa.String(length=100), nullable=True),
+    sa.Column('columns', sa.JSON(), nullable=False),
+    sa.Column('date_col', sa.String(length=100), nullable=False),
+    sa.Column('amount_col', sa.String(length=100), nullable=False),
+    sa.Column('desc_col', sa.String(length=100), nullable=True),
+    sa.Column('date_format', sa.String(length=20), nullable=True),
+    sa.Column('decimal', sa.String(length=1), nullable=False),
+    sa.Column('thousands', sa.String(length=1), nullable=True),
+    sa.Column('delimiter', sa.String(length=1), nullable=True),
+    sa.Column('header_row', sa.Integer(), nullable=False),
+    sa.Column('use_count', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('last_used_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_bank_format_profiles_id'), 'bank_format_profiles', ['id'], unique=False)
+    op.create_index(op.f('ix_bank_format_profiles_signature'), 'bank_format_profiles', ['signature'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_bank_format_profiles_signature'), table_name='bank_format_profiles')
+    op.drop_index(op.f('ix_bank_format_profiles_id'), table_name='bank_format_profiles')
+    op.drop_table('bank_format_profiles')
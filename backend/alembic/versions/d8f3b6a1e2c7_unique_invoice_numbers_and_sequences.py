@@ -0,0 +1,52 @@
+"""unique invoice numbers per user and numbering sequences
+
+Revision ID: d8f3b6a1e2c7
+Revises: c4e7a2d9f5b1
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'd8f3b6a1e2c7'
+down_revision: Union[str, None] = 'c4e7a2d9f5b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    duplicates = bind.execute(sa.text(
+        "SELECT user_id, invoice_number, COUNT(*) AS copies FROM invoices "
+        "GROUP BY user_id, invoice_number HAVING COUNT(*) > 1"
+    )).all()
+    if duplicates:
+        listed = ", ".join(f"user {row.user_id}: {row.invoice_number} (x{row.copies})" for row in duplicates[:20])
+        # Invoice numbers are legal identifiers, so they are not renamed automatically
+        raise RuntimeError(
+            f"Cannot add uq_invoices_user_invoice_number, {len(duplicates)} duplicate invoice numbers "
+            f"must be resolved first: {listed}"
+        )
+
+    op.create_unique_constraint(
+        'uq_invoices_user_invoice_number', 'invoices', ['user_id', 'invoice_number']
+    )
+
+    op.create_table(
+        'invoice_number_sequences',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('series', sa.String(length=10), nullable=False),
+        sa.Column('next_value', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'series', name='uq_invoice_number_sequences_user_series'),
+    )
+    op.create_index(op.f('ix_invoice_number_sequences_id'), 'invoice_number_sequences', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_invoice_number_sequences_id'), table_name='invoice_number_sequences')
+    op.drop_table('invoice_number_sequences')
+    op.drop_constraint('uq_invoices_user_invoice_number', 'invoices', type_='unique')
@@ -0,0 +1,27 @@
+"""add encrypted plaid access tokens
+
+Revision ID: e5c1d9f3a7b4
+Revises: d3a8c5e17b02
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = 'e5c1d9f3a7b4'
+down_revision: Union[str, None] = 'd3a8c5e17b02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing plaintext tokens are sealed by the token vault on their next sync
+    op.add_column('bank_accounts', sa.Column('access_token_encrypted', postgresql.BYTEA(), nullable=True))
+    op.add_column('bank_accounts', sa.Column('access_token_key', postgresql.BYTEA(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('bank_accounts', 'access_token_key')
+    op.drop_column('bank_accounts', 'access_token_encrypted')
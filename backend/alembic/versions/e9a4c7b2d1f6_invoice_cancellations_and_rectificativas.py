@@ -0,0 +1,77 @@
+"""invoice cancellations and rectificativas
+
+Revision ID: e9a4c7b2d1f6
+Revises: d8f3b6a1e2c7
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'e9a4c7b2d1f6'
+down_revision: Union[str, None] = 'd8f3b6a1e2c7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+ACTIVE = sa.text("status <> 'cancelled'")
+
+
+def upgrade() -> None:
+    op.add_column('invoices', sa.Column('rectified_invoice_id', sa.Integer(), nullable=True))
+    op.add_column('invoices', sa.Column('rectification_reason', sa.Text(), nullable=True))
+    op.create_foreign_key(
+        'invoices_rectified_invoice_id_fkey', 'invoices', 'invoices', ['rectified_invoice_id'], ['id']
+    )
+    op.create_index(op.f('ix_invoices_rectified_invoice_id'), 'invoices', ['rectified_invoice_id'], unique=False)
+
+    op.create_table(
+        'invoice_cancellations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('invoice_id', sa.Integer(), nullable=False),
+        sa.Column('reason', sa.Text(), nullable=True),
+        sa.Column('hash_value', sa.String(length=64), nullable=False),
+        sa.Column('previous_hash', sa.String(length=64), nullable=True),
+        sa.Column('hash_input', sa.Text(), nullable=True),
+        sa.Column('verifactu_timestamp', sa.DateTime(), nullable=True),
+        sa.Column('verifactu_submitted', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.ForeignKeyConstraint(['invoice_id'], ['invoices.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('invoice_id', name='invoice_cancellations_invoice_id_key'),
+    )
+    op.create_index(op.f('ix_invoice_cancellations_id'), 'invoice_cancellations', ['id'], unique=False)
+    op.create_index(op.f('ix_invoice_cancellations_hash_value'), 'invoice_cancellations', ['hash_value'], unique=False)
+    op.create_index(
+        'ix_invoice_cancellations_user_created', 'invoice_cancellations', ['user_id', 'created_at'], unique=False
+    )
+
+    # Lists and income totals skip cancelled invoices, so their indexes leave them out
+    op.drop_index('ix_invoices_user_invoice_date', table_name='invoices')
+    op.create_index(
+        'ix_invoices_user_invoice_date_active', 'invoices', ['user_id', 'invoice_date'],
+        unique=False, postgresql_where=ACTIVE
+    )
+    op.create_index(
+        'ix_invoices_user_created_id_active', 'invoices', ['user_id', 'created_at', 'id'],
+        unique=False, postgresql_where=ACTIVE
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_invoices_user_created_id_active', table_name='invoices')
+    op.drop_index('ix_invoices_user_invoice_date_active', table_name='invoices')
+    op.create_index('ix_invoices_user_invoice_date', 'invoices', ['user_id', 'invoice_date'], unique=False)
+
+    op.drop_index('ix_invoice_cancellations_user_created', table_name='invoice_cancellations')
+    op.drop_index(op.f('ix_invoice_cancellations_hash_value'), table_name='invoice_cancellations')
+    op.drop_index(op.f('ix_invoice_cancellations_id'), table_name='invoice_cancellations')
+    op.drop_table('invoice_cancellations')
+
+    op.drop_index(op.f('ix_invoices_rectified_invoice_id'), table_name='invoices')
+    op.drop_constraint('invoices_rectified_invoice_id_fkey', 'invoices', type_='foreignkey')
+    op.drop_column('invoices', 'rectification_reason')
+    op.drop_column('invoices', 'rectified_invoice_id')
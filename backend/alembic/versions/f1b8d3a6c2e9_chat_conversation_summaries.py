@@ -0,0 +1,36 @@
+"""chat conversation summaries
+
+Revision ID: f1b8d3a6c2e9
+Revises: e9a4c7b2d1f6
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'f1b8d3a6c2e9'
+down_revision: Union[str, None] = 'e9a4c7b2d1f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'chat_conversation_summaries',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('conversation_id', sa.String(length=50), nullable=False),
+        sa.Column('summary', sa.Text(), nullable=False),
+        sa.Column('summarized_through_id', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'conversation_id', name='uq_chat_conversation_summaries_user_conversation'),
+    )
+    op.create_index(op.f('ix_chat_conversation_summaries_id'), 'chat_conversation_summaries', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_chat_conversation_summaries_id'), table_name='chat_conversation_summaries')
+    op.drop_table('chat_conversation_summaries')
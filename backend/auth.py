@@ -1,12 +1,14 @@
 import base64
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr, validator, Field
 from sqlalchemy.orm import Session
 from passlib.context import CryptContext
 from jose import jwt, JWTError
+from dataclasses import dataclass
 from datetime import datetime, timedelta, date
-from typing import Optional
+from typing import Optional, Tuple
 import re
 import hmac
 import hashlib
@@ -21,6 +23,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from database import get_db, User 
+from ttl_cache import TTLCache
+from password_hashing import PasswordHasher, PasswordHashingBusy
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -177,58 +181,143 @@ class UserUpdate(BaseModel):
 AUTH_SECRET_KEY = os.getenv("AUTH_SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = 10000
 
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+password_hasher = PasswordHasher(pwd_context)
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def _hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-in requests right now, please retry in a moment",
+        headers={"Retry-After": "1"},
+    )
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHashingBusy:
+        raise _hashing_busy()
+
+async def get_password_hash_async(password) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHashingBusy:
+        raise _hashing_busy()
+
 def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    issued_at = datetime.utcnow()
+    expire = issued_at + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire, "iat": issued_at})
     encoded_jwt = jwt.encode(to_encode, AUTH_SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+@dataclass(frozen=True)
+class UserPrincipal:
+    """The few user fields most routes need, cached so they skip loading the full User row."""
+    id: int
+    email: str
+    full_name: Optional[str]
+    nif: Optional[str]
+    region: Optional[str]
+    family_status: Optional[str]
+    num_children: Optional[int]
+
+
+PRINCIPAL_COLUMNS = (User.id, User.email, User.full_name, User.nif, User.region, User.family_status, User.num_children)
+
+_principals = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def _token_subject(token: str) -> Tuple[str, Optional[int]]:
     try:
         payload = jwt.decode(token, AUTH_SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
-            raise credentials_exception
+            raise _credentials_exception()
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    return email, payload.get("iat")
+
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    email, _ = _token_subject(token)
     user = db.query(User).filter(User.email == email).first()
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     return user
 
-@router.post("/register", response_model=Token)
-def register(user_create: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user_create.email).first()
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = get_password_hash(user_create.password)
+
+def get_current_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> UserPrincipal:
+    """Authenticated user as a UserPrincipal, for routes that only read the user's id and profile.
+
+    Principals are cached per token subject and issue time for
+    AUTH_CACHE_TTL seconds, so repeated requests with the same token cost
+    no query. Profile, settings and password changes drop the user's
+    entries in this process; other workers catch up when theirs expire.
+    """
+    email, issued_at = _token_subject(token)
+    principal = _principals.get((email, issued_at))
+    if principal is None:
+        row = db.query(*PRINCIPAL_COLUMNS).filter(User.email == email).first()
+        if row is None:
+            raise _credentials_exception()
+        principal = UserPrincipal(**row._asdict())
+        _principals.set((email, issued_at), principal)
+    return principal
+
+
+def invalidate_principal(email: str) -> None:
+    _principals.invalidate(lambda key: key[0] == email)
+
+# The password routes are async so they can await the hashing pool; their database work runs in the threadpool
+
+def _find_user(db: Session, email: str) -> Optional[User]:
+    return db.query(User).filter(User.email == email).first()
+
+def _create_user(db: Session, user_create: UserCreate, hashed_password: str) -> User:
     db_user = User(full_name=user_create.full_name, email=user_create.email, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    return db_user
+
+def _store_password(db: Session, user: User, hashed_password: str) -> None:
+    user.hashed_password = hashed_password
+    user.updated_at = datetime.utcnow()
+    db.commit()
+
+@router.post("/register", response_model=Token)
+async def register(user_create: UserCreate, db: Session = Depends(get_db)):
+    if await run_in_threadpool(_find_user, db, user_create.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    hashed_password = await get_password_hash_async(user_create.password)
+    await run_in_threadpool(_create_user, db, user_create, hashed_password)
     access_token = create_access_token(data={"sub": user_create.email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_find_user, db, form_data.username)
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email/password")
     access_token = create_access_token(data={"sub": user.email})
     return {"access_token": access_token, "token_type": "bearer"}
@@ -245,6 +334,7 @@ def update_profile(update_data: UserUpdate, current_user: User = Depends(get_cur
         setattr(current_user, field, value)  
     
     db.commit()
+    invalidate_principal(current_user.email)
     db.refresh(current_user)
     return {"message": "Profile updated successfully", "user": {"full_name": current_user.full_name, "family_status": current_user.family_status, "num_children": current_user.num_children, "region": current_user.region}}
 
@@ -286,6 +376,7 @@ def update_profile(
     
     current_user.updated_at = datetime.utcnow()
     db.commit()
+    invalidate_principal(current_user.email)
     db.refresh(current_user)
     
     return get_profile(current_user)
@@ -341,30 +432,38 @@ def update_settings(
     
     current_user.updated_at = datetime.utcnow()
     db.commit()
+    invalidate_principal(current_user.email)
     db.refresh(current_user)
     
     return get_settings(current_user, db)
 
 
 @router.post("/settings/change-password", response_model=dict)
-def change_password(
+async def change_password(
     current_password: str = Form(...),
     new_password: str = Form(...),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    if not verify_password(current_password, current_user.hashed_password):
+    if not await verify_password_async(current_password, current_user.hashed_password):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     
     if len(new_password) < 8:
         raise HTTPException(status_code=400, detail="Password must be at least 8 characters")
     
-    current_user.hashed_password = get_password_hash(new_password)
-    current_user.updated_at = datetime.utcnow()
-    db.commit()
+    hashed_password = await get_password_hash_async(new_password)
+    await run_in_threadpool(_store_password, db, current_user, hashed_password)
+    invalidate_principal(current_user.email)
     
     return {"message": "Password changed successfully"}
 
+
+@router.get("/hashing/stats")
+async def get_hashing_stats(
+    current_user: UserPrincipal = Depends(get_current_principal)
+):
+    return password_hasher.stats()
+
     
 @router.post("/kyc", response_model=dict)
 async def kyc_verify(
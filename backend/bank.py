@@ -17,13 +17,22 @@ from plaid.model.products import Products
 import pandas as pd
 from io import BytesIO
 from fastapi import UploadFile, File
-import re
+from starlette.concurrency import run_in_threadpool
 
 from dotenv import load_dotenv
 load_dotenv()
 
 from database import get_db, User, BankAccount, Transaction
 from auth import get_current_user
+from token_vault import get_token_vault
+from financials_cache import mark_financials_dirty
+from statement_import import (
+    StatementImportError,
+    IMPORT_BATCH_SIZE,
+    spool_upload,
+    import_statement,
+    log_import_progress,
+)
 
 router = APIRouter(prefix="/bank", tags=["bank"])
 
@@ -134,6 +143,9 @@ async def exchange_public_token(
         accounts_request = AccountsGetRequest(access_token=access_token)
         accounts_response = plaid_client.accounts_get(accounts_request)
         
+        vault = get_token_vault()
+        sealed_token = vault.seal(access_token)
+        
         accounts_synced = 0
         for account in accounts_response.accounts:
             existing = db.query(BankAccount).filter(
@@ -150,9 +162,9 @@ async def exchange_public_token(
                     account_type=account.type.value if account.type else "unknown",
                     plaid_account_id=account.account_id,
                     plaid_item_id=item_id,
-                    access_token=access_token,  # Store encrypted in production!
                     last_sync=datetime.utcnow()
                 )
+                vault.store_token(bank_account, access_token, sealed=sealed_token)
                 db.add(bank_account)
                 accounts_synced += 1
         
@@ -237,6 +249,8 @@ async def sync_transactions(
                 db.add(transaction)
                 transactions_added += 1
         
+        if transactions_added:
+            mark_financials_dirty(db, user_id)
         db.commit()
         return transactions_added
         
@@ -257,15 +271,22 @@ async def sync_bank_data(
     if not bank_accounts:
         raise HTTPException(status_code=404, detail="No bank accounts connected")
     
+    tokens = await get_token_vault().get_tokens_async(bank_accounts)
+    
     total_transactions = 0
+    synced_tokens = set()
     for account in bank_accounts:
-        if account.access_token:
-            count = await sync_transactions(
-                access_token=account.access_token,
-                user_id=current_user.id,
-                db=db
-            )
-            total_transactions += count
+        access_token = tokens.get(account.id)
+        if access_token:
+            # Accounts of the same Plaid item share a token; its transactions are fetched once
+            if access_token not in synced_tokens:
+                count = await sync_transactions(
+                    access_token=access_token,
+                    user_id=current_user.id,
+                    db=db
+                )
+                total_transactions += count
+                synced_tokens.add(access_token)
             account.last_sync = datetime.utcnow()
     
     db.commit()
@@ -337,6 +358,7 @@ async def disconnect_bank(
     if not account:
         raise HTTPException(status_code=404, detail="Bank account not found")
     
+    get_token_vault().forget(account)
     db.delete(account)
     db.commit()
     
@@ -346,129 +368,52 @@ class UploadResponse(BaseModel):
     message: str
     transactions_created: int
     total_rows: int
+    duplicates_skipped: int = 0
+    batches_committed: Optional[int] = None
+    bank_profile: Optional[str] = None
 
 
 @router.post("/upload", response_model=UploadResponse)
 async def upload_bank_statement(
     file: UploadFile = File(...),
+    stream: bool = False,
+    account: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     filename = file.filename.lower()
-    content = await file.read()
+    if not filename.endswith(('.csv', '.xlsx', '.xls')):
+        raise HTTPException(
+            status_code=400, 
+            detail="Unsupported file type. Please upload CSV or Excel (.xlsx, .xls)"
+        )
     
+    spool_path = None
     try:
-        if filename.endswith('.csv'):
-            for encoding in ['utf-8', 'latin-1', 'iso-8859-1', 'cp1252']:
-                try:
-                    df = pd.read_csv(BytesIO(content), encoding=encoding)
-                    break
-                except UnicodeDecodeError:
-                    continue
-            else:
-                raise HTTPException(status_code=400, detail="Could not decode CSV file")
-        elif filename.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(BytesIO(content))
+        if stream:
+            spool_path = await spool_upload(file)
+            progress = await run_in_threadpool(
+                import_statement,
+                db,
+                current_user.id,
+                spool_path,
+                filename,
+                batch_size=IMPORT_BATCH_SIZE,
+                on_progress=log_import_progress(current_user.id),
+                account=account
+            )
         else:
-            raise HTTPException(
-                status_code=400, 
-                detail="Unsupported file type. Please upload CSV or Excel (.xlsx, .xls)"
+            content = await file.read()
+            progress = await run_in_threadpool(
+                import_statement,
+                db,
+                current_user.id,
+                BytesIO(content),
+                filename,
+                account=account
             )
         
-        if df.empty:
-            raise HTTPException(status_code=400, detail="The uploaded file is empty")
-        
-        df.columns = df.columns.str.lower().str.strip()
-        
-        date_patterns = ['fecha', 'date', 'fecha operación', 'fecha valor', 'f. valor', 'fecha op']
-        amount_patterns = ['importe', 'amount', 'cantidad', 'euros', 'importe (€)', 'importe eur']
-        desc_patterns = ['concepto', 'description', 'descripción', 'movimiento', 'detalle', 'observaciones']
-        
-        date_col = None
-        amount_col = None
-        desc_col = None
-        
-        for col in df.columns:
-            col_lower = col.lower()
-            if not date_col and any(p in col_lower for p in date_patterns):
-                date_col = col
-            if not amount_col and any(p in col_lower for p in amount_patterns):
-                amount_col = col
-            if not desc_col and any(p in col_lower for p in desc_patterns):
-                desc_col = col
-        
-        if not date_col or not amount_col:
-            if len(df.columns) >= 2:
-                date_col = df.columns[0]
-                amount_col = df.columns[1]
-                desc_col = df.columns[2] if len(df.columns) > 2 else None
-            else:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Could not identify date and amount columns. Please ensure your file has headers like 'Fecha', 'Importe', 'Concepto'."
-                )
-        
-        transactions_created = 0
-        
-        for idx, row in df.iterrows():
-            try:
-                date_val = row[date_col]
-                if pd.isna(date_val):
-                    continue
-                    
-                if isinstance(date_val, str):
-                    for fmt in ['%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d/%m/%y']:
-                        try:
-                            date_val = datetime.strptime(date_val.strip(), fmt)
-                            break
-                        except ValueError:
-                            continue
-                    else:
-                        date_val = pd.to_datetime(date_val, dayfirst=True)
-                elif hasattr(date_val, 'to_pydatetime'):
-                    date_val = date_val.to_pydatetime()
-                
-                amount_val = row[amount_col]
-                if pd.isna(amount_val):
-                    continue
-                    
-                if isinstance(amount_val, str):
-                    amount_str = re.sub(r'[€$\s]', '', amount_val)
-                    if ',' in amount_str and '.' in amount_str:
-                        amount_str = amount_str.replace('.', '').replace(',', '.')
-                    elif ',' in amount_str:
-                        amount_str = amount_str.replace(',', '.')
-                    amount = float(amount_str)
-                else:
-                    amount = float(amount_val)
-                
-                if amount == 0:
-                    continue
-                
-                description = "Bank transaction"
-                if desc_col and not pd.isna(row[desc_col]):
-                    description = str(row[desc_col])[:500]  
-                
-                txn_type = "income" if amount > 0 else "expense"
-                
-                transaction = Transaction(
-                    user_id=current_user.id,
-                    date=date_val if isinstance(date_val, datetime) else datetime.now(),
-                    amount=abs(amount),
-                    type=txn_type,
-                    description=description,
-                    provider="manual_upload"
-                )
-                db.add(transaction)
-                transactions_created += 1
-                
-            except Exception as e:
-                print(f"Skipping row {idx}: {e}")
-                continue
-        
-        db.commit()
-        
-        if transactions_created == 0:
+        if progress.transactions_created == 0 and progress.duplicates_skipped == 0:
             raise HTTPException(
                 status_code=400,
                 detail="No valid transactions found in the file. Please check the file format."
@@ -476,13 +421,21 @@ async def upload_bank_statement(
         
         return UploadResponse(
             message="Bank statement processed successfully",
-            transactions_created=transactions_created,
-            total_rows=len(df)
+            transactions_created=progress.transactions_created,
+            total_rows=progress.rows_read,
+            duplicates_skipped=progress.duplicates_skipped,
+            batches_committed=progress.batches_committed if stream else None,
+            bank_profile=progress.profile
         )
         
+    except StatementImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except pd.errors.EmptyDataError:
         raise HTTPException(status_code=400, detail="The uploaded file is empty")
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+    finally:
+        if spool_path:
+            os.unlink(spool_path)
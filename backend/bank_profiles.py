@@ -0,0 +1,167 @@
+import hashlib
+import logging
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Optional, List, Tuple, Iterable
+
+from sqlalchemy import desc
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from database import BankFormatProfile
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class HeaderCandidate:
+    row: int
+    delimiter: Optional[str]
+    columns: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class StatementProfile:
+    bank_name: str
+    columns: Tuple[str, ...]
+    date_col: str
+    amount_col: str
+    desc_col: Optional[str] = None
+    date_format: Optional[str] = "%d/%m/%Y"
+    decimal: str = ","
+    thousands: Optional[str] = "."
+    delimiter: Optional[str] = ";"
+    header_row: int = 0
+
+    @property
+    def signature(self) -> str:
+        return header_signature(self.columns)
+
+    @property
+    def used_columns(self) -> Tuple[str, ...]:
+        return tuple(c for c in (self.date_col, self.amount_col, self.desc_col) if c)
+
+
+def normalize_header(value) -> str:
+    if value is None:
+        return ""
+    return str(value).strip().strip('"').strip().lower()
+
+
+def header_signature(columns: Iterable) -> str:
+    normalized = [normalize_header(c) for c in columns]
+    while normalized and not normalized[-1]:
+        normalized.pop()
+    return hashlib.sha256("|".join(normalized).encode("utf-8")).hexdigest()
+
+
+BUILTIN_PROFILES = {
+    profile.signature: profile
+    for profile in [
+        StatementProfile(
+            bank_name="Santander",
+            columns=("fecha operación", "fecha valor", "concepto", "importe", "saldo"),
+            date_col="fecha operación", amount_col="importe", desc_col="concepto",
+            header_row=7,
+        ),
+        StatementProfile(
+            bank_name="BBVA",
+            columns=("f.valor", "fecha", "concepto", "movimiento", "importe", "divisa", "disponible", "divisa", "observaciones"),
+            date_col="fecha", amount_col="importe", desc_col="concepto",
+            header_row=4,
+        ),
+        StatementProfile(
+            bank_name="CaixaBank",
+            columns=("concepto", "fecha", "importe", "saldo"),
+            date_col="fecha", amount_col="importe", desc_col="concepto",
+        ),
+        StatementProfile(
+            bank_name="ING",
+            columns=("f. valor", "categoría", "subcategoría", "descripción", "comentario", "imagen", "importe (€)", "saldo (€)"),
+            date_col="f. valor", amount_col="importe (€)", desc_col="descripción",
+            header_row=5,
+        ),
+        StatementProfile(
+            bank_name="Sabadell",
+            columns=("f. operativa", "concepto", "f. valor", "importe", "saldo", "referencia 1", "referencia 2"),
+            date_col="f. operativa", amount_col="importe", desc_col="concepto",
+            header_row=8,
+        ),
+    ]
+}
+
+
+def _from_record(record: BankFormatProfile) -> StatementProfile:
+    return StatementProfile(
+        bank_name=record.bank_name,
+        columns=tuple(record.columns or ()),
+        date_col=record.date_col,
+        amount_col=record.amount_col,
+        desc_col=record.desc_col,
+        date_format=record.date_format,
+        decimal=record.decimal,
+        thousands=record.thousands,
+        delimiter=record.delimiter,
+        header_row=record.header_row,
+    )
+
+
+def match_profile(db: Session, user_id: int, candidates: List[HeaderCandidate]) -> Optional[StatementProfile]:
+    """Return the profile for the first candidate header row that has one.
+
+    Learned profiles are only matched against the uploads of the user they
+    were learned from. The candidate's own row and delimiter win over the
+    stored ones, so a layout learned from an .xlsx export also matches its
+    CSV twin.
+    """
+    if not candidates:
+        return None
+
+    signatures = [(header_signature(c.columns), c) for c in candidates]
+    for signature, candidate in signatures:
+        if signature in BUILTIN_PROFILES:
+            return replace(BUILTIN_PROFILES[signature], header_row=candidate.row, delimiter=candidate.delimiter)
+
+    records = db.query(BankFormatProfile).filter(
+        BankFormatProfile.user_id == user_id,
+        BankFormatProfile.signature.in_({s for s, _ in signatures})
+    ).order_by(desc(BankFormatProfile.use_count)).all()
+    if not records:
+        return None
+
+    by_signature = {r.signature: r for r in records}
+    for signature, candidate in signatures:
+        record = by_signature.get(signature)
+        if record:
+            record.use_count = (record.use_count or 0) + 1
+            record.last_used_at = datetime.utcnow()
+            return replace(_from_record(record), header_row=candidate.row, delimiter=candidate.delimiter)
+    return None
+
+
+def learn_profile(db: Session, user_id: int, profile: StatementProfile) -> None:
+    if profile.signature in BUILTIN_PROFILES:
+        return
+
+    stmt = pg_insert(BankFormatProfile).values(
+        user_id=user_id,
+        signature=profile.signature,
+        bank_name=profile.bank_name,
+        columns=list(profile.columns),
+        date_col=profile.date_col,
+        amount_col=profile.amount_col,
+        desc_col=profile.desc_col,
+        date_format=profile.date_format,
+        decimal=profile.decimal,
+        thousands=profile.thousands,
+        delimiter=profile.delimiter,
+        header_row=profile.header_row,
+        use_count=1,
+        created_at=datetime.utcnow(),
+        last_used_at=datetime.utcnow(),
+    ).on_conflict_do_nothing(index_elements=[BankFormatProfile.user_id, BankFormatProfile.signature])
+    db.execute(stmt)
+    db.commit()
+
+    logger.info(f"Learned bank format profile {profile.signature[:16]}... for user {user_id} ({', '.join(profile.columns)})")
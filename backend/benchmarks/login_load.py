@@ -0,0 +1,135 @@
+"""Login storm benchmark for the password hashing pool.
+
+Fires --logins logins at --concurrency at once through the auth router,
+in process over ASGI against an in-memory SQLite database, while a second
+client polls an authenticated read-only route (GET /auth/settings). It
+reports login throughput and latency, how fast overload is shed with 503s,
+how long the probe waited, and the hashing pool's own stats.
+
+Run from the backend directory:
+
+    python benchmarks/login_load.py --logins 200 --concurrency 100
+
+PASSWORD_HASH_WORKERS and PASSWORD_HASH_MAX_QUEUE are read from the
+environment as in the app.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("AUTH_SECRET_KEY", "benchmark")
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import BYTEA, JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import database
+import auth
+
+EMAIL = "benchmark@example.com"
+PASSWORD = "benchmark-password"
+PROBE_INTERVAL = 0.02
+
+
+@compiles(BYTEA, "sqlite")
+def _bytea_on_sqlite(type_, compiler, **kw):
+    return "BLOB"
+
+
+@compiles(JSONB, "sqlite")
+def _jsonb_on_sqlite(type_, compiler, **kw):
+    return "JSON"
+
+
+def build_app() -> FastAPI:
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    database.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    db = Session()
+    db.add(database.User(email=EMAIL, full_name="Benchmark User", hashed_password=auth.get_password_hash(PASSWORD)))
+    db.commit()
+    db.close()
+
+    def get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(auth.router)
+    app.dependency_overrides[database.get_db] = get_db
+    return app
+
+
+def percentile_ms(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, int(len(ordered) * fraction) - 1)] * 1000
+
+
+async def run(logins: int, concurrency: int) -> None:
+    transport = httpx.ASGITransport(app=build_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=300) as client:
+        credentials = {"username": EMAIL, "password": PASSWORD}
+        token = (await client.post("/auth/login", data=credentials)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        statuses = {}
+        served, rejected, probes = [], [], []
+        semaphore = asyncio.Semaphore(concurrency)
+        finished = asyncio.Event()
+
+        async def login():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/auth/login", data=credentials)
+                elapsed = time.perf_counter() - started
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                (served if response.status_code == 200 else rejected).append(elapsed)
+
+        async def probe():
+            while not finished.is_set():
+                started = time.perf_counter()
+                await client.get("/auth/settings", headers=headers)
+                probes.append(time.perf_counter() - started)
+                await asyncio.sleep(PROBE_INTERVAL)
+
+        prober = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        duration = time.perf_counter() - started
+        finished.set()
+        await prober
+
+    print(f"{logins} logins at concurrency {concurrency} on {os.cpu_count()} CPU(s) in {duration:.1f}s")
+    print(f"  status codes:     {dict(sorted(statuses.items()))}")
+    print(f"  logins/s:         {len(served) / duration:.1f}")
+    print(f"  login latency:    p50 {percentile_ms(served, .5):.0f}ms, p99 {percentile_ms(served, .99):.0f}ms")
+    print(f"  503 latency:      p50 {percentile_ms(rejected, .5):.0f}ms")
+    print(f"  probe latency:    p50 {percentile_ms(probes, .5):.0f}ms, p99 {percentile_ms(probes, .99):.0f}ms, "
+          f"max {max(probes) * 1000:.0f}ms")
+    print(f"  hashing pool:     {auth.password_hasher.stats()}")
+    auth.password_hasher.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.logins, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
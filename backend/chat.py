@@ -1,28 +1,57 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import List, Optional
+from sqlalchemy import desc, func, select, tuple_
+from typing import AsyncIterator, List, Optional, Tuple
 from pydantic import BaseModel
-from datetime import datetime, timedelta
-from openai import OpenAI
+from dataclasses import dataclass
+from datetime import datetime
+from openai import AsyncOpenAI
+import httpx
 import os
 import json
+import re
 import uuid
 import logging
 
-from database import get_db, User, ChatMessage, Transaction
-from auth import get_current_user
+from database import get_db, SessionLocal, ChatMessage, ChatConversationSummary
+from auth import UserPrincipal, get_current_principal
+from pagination import encode_cursor, decode_cursor
+from financial_context import FinancialContext, get_financial_context
+from response_cache import CachedResponse, get_chat_response_cache
+from chat_memory import (
+    ConversationContext, build_conversation_context, build_summary_prompt, load_turns_to_summarize, store_summary
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-client = OpenAI(
+CONVERSATION_PAGE_SIZE = 20
+CONVERSATION_MAX_PAGE_SIZE = 100
+LAST_MESSAGE_PREVIEW = 100
+
+GROK_MODEL = "grok-3"
+GROK_TIMEOUT = float(os.getenv("GROK_TIMEOUT", "60"))
+GROK_MAX_CONNECTIONS = int(os.getenv("GROK_MAX_CONNECTIONS", "20"))
+
+# One pooled HTTP client per process, so requests reuse open TLS connections to the API
+client = AsyncOpenAI(
     api_key=os.getenv("GROK_API_KEY"),
     base_url="https://api.x.ai/v1",
+    timeout=GROK_TIMEOUT,
+    http_client=httpx.AsyncClient(
+        timeout=GROK_TIMEOUT,
+        limits=httpx.Limits(max_connections=GROK_MAX_CONNECTIONS, max_keepalive_connections=GROK_MAX_CONNECTIONS),
+    ),
 )
 
+
+async def close_chat_client() -> None:
+    await client.close()
+
 class ChatMessageRequest(BaseModel):
     message: str
     conversation_id: Optional[str] = None
@@ -53,7 +82,10 @@ class ConversationSummary(BaseModel):
     updated_at: datetime
 
 
-def build_system_prompt(user: User, income: float, expenses: float) -> str:
+def build_system_prompt(user: UserPrincipal, context: FinancialContext, summary: Optional[str] = None) -> str:
+    categories = ", ".join(
+        f"{category} (€{total:,.2f})" for category, total in context.top_expense_categories
+    ) or "None recorded"
     return f"""
 You are TaxHelper AI, a specialized tax advisor for Spanish autónomos (self-employed workers).
 
@@ -85,24 +117,30 @@ Always respond in valid JSON format:
   "related_modelos": ["303", "130"],
   "estimated_tax": 1500.00,
   "confidence": 0.95,
-  "is_off_topic": false
+  "is_off_topic": false,
+  "uses_personal_data": false
 }}
 
 Notes:
 - "deductions", "suggestions", "related_modelos", "estimated_tax" can be null if not applicable
 - "confidence" should reflect how certain you are (0.0-1.0)
 - "is_off_topic" must be true if question is not tax/business related
+- "uses_personal_data" must be true if the answer draws on the user's name, income, expenses or expense categories
 
 ## User Context
 - Name: {user.full_name}
 - Region: {user.region or 'Not specified'}
 - Family Status: {user.family_status or 'Not specified'}
 - Children: {user.num_children or 0}
-- Income (last 6 months): €{income:,.2f}
-- Expenses (last 6 months): €{expenses:,.2f}
+- Income (last 6 months): €{context.income:,.2f}
+- Expenses (last 6 months): €{context.expenses:,.2f}
+- Top expense categories (last 6 months): {categories}
 
 Be concise, practical, and always consider their specific situation.
-"""
+""" + (f"""
+## Earlier in This Conversation
+{summary}
+""" if summary else "")
 
 
 def parse_ai_response(content: str) -> dict:
@@ -125,17 +163,22 @@ def parse_ai_response(content: str) -> dict:
         }
 
 
-@router.post("/message", response_model=ChatMessageResponse)
-async def send_message(
-    request: ChatMessageRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    
+def _error_response() -> dict:
+    return {
+        "answer": "I'm sorry, I encountered an error processing your request. Please try again.",
+        "is_off_topic": False,
+        "confidence": 0
+    }
+
+
+def _prepare_conversation(
+    db: Session, user: UserPrincipal, request: ChatMessageRequest
+) -> Tuple[str, List[dict], ConversationContext, FinancialContext]:
+    """Store the user's message and build the prompt messages for the model."""
     conv_id = request.conversation_id or str(uuid.uuid4())[:8]
     
     user_msg = ChatMessage(
-        user_id=current_user.id,
+        user_id=user.id,
         conversation_id=conv_id,
         role="user",
         content=request.message
@@ -143,58 +186,65 @@ async def send_message(
     db.add(user_msg)
     db.commit()
     
-    from_date = datetime.now() - timedelta(days=180)
-    transactions = db.query(Transaction).filter(
-        Transaction.user_id == current_user.id,
-        Transaction.date >= from_date
-    ).all()
-    
-    total_income = sum(t.amount for t in transactions if t.type == "income")
-    total_expenses = sum(t.amount for t in transactions if t.type == "expense")
-    
-    history = db.query(ChatMessage).filter(
-        ChatMessage.user_id == current_user.id,
-        ChatMessage.conversation_id == conv_id
-    ).order_by(ChatMessage.created_at.desc()).limit(10).all()
-    
-    system_prompt = build_system_prompt(current_user, total_income, total_expenses)
-    messages = [{"role": "system", "content": system_prompt}]
-    
-    for msg in reversed(history):
-        if msg.role == "assistant" and msg.response_data:
-            messages.append({
-                "role": "assistant",
-                "content": json.dumps(msg.response_data)
-            })
-        else:
-            messages.append({
-                "role": msg.role,
-                "content": msg.content
-            })
+    context = build_conversation_context(db, user.id, conv_id)
+    financial = get_financial_context(db, user.id)
+    system_prompt = build_system_prompt(user, financial, context.summary)
+    messages = [{"role": "system", "content": system_prompt}] + context.messages
     
+    return conv_id, messages, context, financial
+
+
+def _run_with_session(func, *args):
+    db = SessionLocal()
     try:
-        response = client.chat.completions.create(
-            model="grok-3",
-            messages=messages,
-            temperature=0.1,
-            max_tokens=600
+        return func(db, *args)
+    finally:
+        db.close()
+
+
+async def _update_summary(user_id: int, conv_id: str, through_id: int) -> None:
+    """Fold turns that no longer fit the history budget into the conversation's rolling summary.
+
+    Runs after the response is sent, a batch at a time, so the summary is
+    extended incrementally and never rebuilt from the whole conversation.
+    """
+    while True:
+        previous, previous_through, turns = await run_in_threadpool(
+            _run_with_session, load_turns_to_summarize, user_id, conv_id, through_id
         )
+        if not turns:
+            return
         
-        assistant_content = response.choices[0].message.content
-        parsed_data = parse_ai_response(assistant_content)
-        tokens_used = response.usage.total_tokens if response.usage else None
+        try:
+            response = await client.chat.completions.create(
+                model=GROK_MODEL,
+                messages=build_summary_prompt(previous, turns),
+                temperature=0,
+                max_tokens=300
+            )
+            summary = response.choices[0].message.content.strip()
+        except Exception as e:
+            logger.error(f"Grok API summary error: {e}")
+            return
         
-    except Exception as e:
-        logger.error(f"Grok API error: {e}")
-        parsed_data = {
-            "answer": "I'm sorry, I encountered an error processing your request. Please try again.",
-            "is_off_topic": False,
-            "confidence": 0
-        }
-        tokens_used = None
-    
+        stored = await run_in_threadpool(
+            _run_with_session, store_summary, user_id, conv_id, summary, previous_through, turns[-1]["id"]
+        )
+        if not stored:
+            # A concurrent update moved the summary on; it carries on from there
+            return
+
+
+def _schedule_summary(background_tasks: BackgroundTasks, user_id: int, conv_id: str, context: ConversationContext) -> None:
+    if context.summarize_through is not None:
+        background_tasks.add_task(_update_summary, user_id, conv_id, context.summarize_through)
+
+
+def _save_assistant_message(
+    db: Session, user_id: int, conv_id: str, parsed_data: dict, tokens_used: Optional[int]
+) -> ChatMessageResponse:
     assistant_msg = ChatMessage(
-        user_id=current_user.id,
+        user_id=user_id,
         conversation_id=conv_id,
         role="assistant",
         content=parsed_data.get("answer", ""),
@@ -217,10 +267,185 @@ async def send_message(
     )
 
 
+@dataclass(frozen=True)
+class CacheScope:
+    # Users an answer may be shared with: everything in the prompt except the financial context
+    profile: tuple
+    # The asking user's name and figures as an answer might quote them
+    personal_terms: Tuple[str, ...]
+
+
+def _amount_spellings(amount: float) -> List[str]:
+    english = [f"{amount:,.2f}", f"{amount:.2f}", f"{amount:,.0f}"]
+    spanish = [text.translate(str.maketrans(",.", ".,")) for text in english]
+    # Bare whole numbers only when long enough not to collide with rates and modelo numbers
+    plain = [f"{amount:.0f}"] if amount >= 1000 else []
+    return english + spanish + plain
+
+
+def _cache_scope(user: UserPrincipal, context: ConversationContext, financial: FinancialContext) -> Optional[CacheScope]:
+    """Scope an answer can be shared in, or None for a follow-up that depends on the conversation."""
+    if context.summary or len(context.messages) != 1:
+        return None
+    terms = [part for part in (user.full_name or "").split() if len(part) > 2]
+    terms += [category for category, _ in financial.top_expense_categories]
+    amounts = [financial.income, financial.expenses] + [total for _, total in financial.top_expense_categories]
+    for amount in amounts:
+        if amount >= 1:
+            terms += _amount_spellings(amount)
+    return CacheScope(
+        profile=((user.region or "").lower(), (user.family_status or "").lower(), user.num_children or 0),
+        personal_terms=tuple(term.lower() for term in terms),
+    )
+
+
+def _cached_answer(scope: Optional[CacheScope], question: str) -> Optional[CachedResponse]:
+    if scope is None:
+        return None
+    cached = get_chat_response_cache().lookup(scope.profile, question)
+    if cached:
+        logger.info(f"Chat cache hit (similarity {cached.similarity:.2f}, {cached.tokens_saved} tokens saved)")
+    return cached
+
+
+def _is_shareable(scope: CacheScope, parsed_data: dict) -> bool:
+    """Whether an answer is free of the asking user's own data; anything doubtful stays private."""
+    # Estimates are worked out from the user's figures, and only answers the model marks as generic qualify
+    if parsed_data.get("estimated_tax") is not None or parsed_data.get("uses_personal_data") is not False:
+        return False
+    text = json.dumps(parsed_data, ensure_ascii=False).lower()
+    return not any(re.search(rf"(?<!\w){re.escape(term)}(?!\w)", text) for term in scope.personal_terms)
+
+
+def _remember_answer(scope: Optional[CacheScope], question: str, parsed_data: dict, tokens_used: Optional[int]) -> None:
+    if scope is None or not _is_shareable(scope, parsed_data):
+        return
+    get_chat_response_cache().store(scope.profile, question, parsed_data, tokens_used)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def _stream_answer(
+    user_id: int, conv_id: str, messages: List[dict], scope: Optional[CacheScope], question: str
+) -> AsyncIterator[str]:
+    """Relay the model's output as server-sent events, then store the answer.
+
+    `token` events carry the raw text deltas as they arrive; the closing
+    `done` event carries the stored message with the parsed response. If the
+    client disconnects first, nothing is stored. A cached answer is sent as
+    a single `token` event.
+    """
+    yield _sse("start", {"conversation_id": conv_id})
+    
+    cached = _cached_answer(scope, question)
+    if cached:
+        yield _sse("token", {"delta": json.dumps(cached.response)})
+        response = await run_in_threadpool(_run_with_session, _save_assistant_message, user_id, conv_id, cached.response, 0)
+        yield _sse("done", response.model_dump(mode="json"))
+        return
+    
+    parts = []
+    tokens_used = None
+    try:
+        stream = await client.chat.completions.create(
+            model=GROK_MODEL,
+            messages=messages,
+            temperature=0.1,
+            max_tokens=600,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            if chunk.usage:
+                tokens_used = chunk.usage.total_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                delta = chunk.choices[0].delta.content
+                parts.append(delta)
+                yield _sse("token", {"delta": delta})
+        
+        parsed_data = parse_ai_response("".join(parts))
+        _remember_answer(scope, question, parsed_data, tokens_used)
+        
+    except Exception as e:
+        logger.error(f"Grok API streaming error: {e}")
+        parsed_data = _error_response()
+        tokens_used = None
+    
+    # The request's session is closed once the response starts, so the answer gets its own
+    response = await run_in_threadpool(_run_with_session, _save_assistant_message, user_id, conv_id, parsed_data, tokens_used)
+    yield _sse("done", response.model_dump(mode="json"))
+
+
+@router.post("/message", response_model=ChatMessageResponse)
+async def send_message(
+    request: ChatMessageRequest,
+    background_tasks: BackgroundTasks,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    
+    conv_id, messages, context, financial = await run_in_threadpool(_prepare_conversation, db, current_user, request)
+    _schedule_summary(background_tasks, current_user.id, conv_id, context)
+    scope = _cache_scope(current_user, context, financial)
+    
+    # A cache hit costs no tokens, so tokens_used stays 0 for it
+    cached = _cached_answer(scope, request.message)
+    if cached:
+        return await run_in_threadpool(_save_assistant_message, db, current_user.id, conv_id, cached.response, 0)
+    
+    try:
+        response = await client.chat.completions.create(
+            model=GROK_MODEL,
+            messages=messages,
+            temperature=0.1,
+            max_tokens=600
+        )
+        
+        assistant_content = response.choices[0].message.content
+        parsed_data = parse_ai_response(assistant_content)
+        tokens_used = response.usage.total_tokens if response.usage else None
+        _remember_answer(scope, request.message, parsed_data, tokens_used)
+        
+    except Exception as e:
+        logger.error(f"Grok API error: {e}")
+        parsed_data = _error_response()
+        tokens_used = None
+    
+    return await run_in_threadpool(_save_assistant_message, db, current_user.id, conv_id, parsed_data, tokens_used)
+
+
+@router.post("/message/stream")
+async def stream_message(
+    request: ChatMessageRequest,
+    background_tasks: BackgroundTasks,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    conv_id, messages, context, financial = await run_in_threadpool(_prepare_conversation, db, current_user, request)
+    _schedule_summary(background_tasks, current_user.id, conv_id, context)
+    
+    return StreamingResponse(
+        _stream_answer(
+            current_user.id, conv_id, messages, _cache_scope(current_user, context, financial), request.message
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/cache/stats")
+async def get_response_cache_stats(
+    current_user: UserPrincipal = Depends(get_current_principal)
+):
+    return get_chat_response_cache().stats()
+
+
 @router.get("/conversation/{conversation_id}", response_model=List[ChatMessageResponse])
 async def get_conversation(
     conversation_id: str,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     messages = db.query(ChatMessage).filter(
@@ -244,54 +469,73 @@ async def get_conversation(
 
 @router.get("/conversations", response_model=List[ConversationSummary])
 async def get_conversations(
-    limit: int = 20,
-    current_user: User = Depends(get_current_user),
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(CONVERSATION_PAGE_SIZE, ge=1, le=CONVERSATION_MAX_PAGE_SIZE),
+    current_user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
-    from sqlalchemy import func
-    
-    subquery = db.query(
+    """Conversations by most recent message, newest first, in one query.
+
+    Window functions over ix_chat_messages_user_conversation_created pick
+    each conversation's last message alongside its count and start time.
+    Pages continue from the (created_at, id) of the previous page's last
+    message, passed back as X-Next-Cursor.
+    """
+    by_conversation = dict(partition_by=ChatMessage.conversation_id)
+    ranked = select(
+        ChatMessage.id,
         ChatMessage.conversation_id,
-        func.count(ChatMessage.id).label('message_count'),
-        func.min(ChatMessage.created_at).label('created_at'),
-        func.max(ChatMessage.created_at).label('updated_at')
-    ).filter(
+        func.substr(ChatMessage.content, 1, LAST_MESSAGE_PREVIEW).label("last_message"),
+        ChatMessage.created_at,
+        func.count().over(**by_conversation).label("message_count"),
+        func.min(ChatMessage.created_at).over(**by_conversation).label("started_at"),
+        func.row_number().over(
+            order_by=(desc(ChatMessage.created_at), desc(ChatMessage.id)), **by_conversation
+        ).label("position")
+    ).where(
         ChatMessage.user_id == current_user.id
-    ).group_by(
-        ChatMessage.conversation_id
     ).subquery()
     
-    conversations = db.query(subquery).order_by(
-        desc(subquery.c.updated_at)
-    ).limit(limit).all()
+    query = select(ranked).where(ranked.c.position == 1)
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        query = query.where(tuple_(ranked.c.created_at, ranked.c.id) < (cursor_created_at, cursor_id))
     
-    result = []
-    for conv in conversations:
-        last_msg = db.query(ChatMessage).filter(
-            ChatMessage.conversation_id == conv.conversation_id
-        ).order_by(desc(ChatMessage.created_at)).first()
-        
-        result.append(ConversationSummary(
+    conversations = db.execute(
+        query.order_by(desc(ranked.c.created_at), desc(ranked.c.id)).limit(limit + 1)
+    ).all()
+    
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(conversations[-1].created_at, conversations[-1].id)
+    
+    return [
+        ConversationSummary(
             conversation_id=conv.conversation_id,
-            last_message=last_msg.content[:100] if last_msg else "",
+            last_message=conv.last_message or "",
             message_count=conv.message_count,
-            created_at=conv.created_at,
-            updated_at=conv.updated_at
-        ))
-    
-    return result
+            created_at=conv.started_at,
+            updated_at=conv.created_at
+        )
+        for conv in conversations
+    ]
 
 
 @router.delete("/conversation/{conversation_id}")
 async def delete_conversation(
     conversation_id: str,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     deleted = db.query(ChatMessage).filter(
         ChatMessage.user_id == current_user.id,
         ChatMessage.conversation_id == conversation_id
     ).delete()
+    db.query(ChatConversationSummary).filter(
+        ChatConversationSummary.user_id == current_user.id,
+        ChatConversationSummary.conversation_id == conversation_id
+    ).delete()
     
     db.commit()
     
@@ -303,7 +547,7 @@ async def delete_conversation(
 
 @router.post("/new")
 async def start_new_conversation(
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_principal)
 ):
     conv_id = str(uuid.uuid4())[:8]
     return {"conversation_id": conv_id}
\ No newline at end of file
@@ -0,0 +1,182 @@
+import os
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import ChatMessage, ChatConversationSummary
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_encoding = None
+_encoding_loader: Optional[threading.Thread] = None
+_encoding_lock = threading.Lock()
+
+
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1500"))
+CHAT_HISTORY_MAX_MESSAGES = 30
+CHAT_SUMMARY_WORDS = 150
+CHAT_SUMMARY_BATCH = 20
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _load_encoding() -> None:
+    global _encoding
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Not installed, or its vocabulary cannot be downloaded: keep the estimate
+        logger.warning(f"tiktoken unavailable ({e}) - estimating chat token counts from text length")
+
+
+def _get_encoding():
+    """The tokenizer once it has loaded, else None.
+
+    The first call starts loading it in the background: the vocabulary may
+    be downloaded on first use, with no timeout, so neither startup nor a
+    request ever waits for it. Counts are estimated until it is ready.
+    """
+    global _encoding_loader
+    if _encoding_loader is None:
+        with _encoding_lock:
+            if _encoding_loader is None:
+                _encoding_loader = threading.Thread(target=_load_encoding, name="tiktoken-loader", daemon=True)
+                _encoding_loader.start()
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def message_content(message: ChatMessage) -> str:
+    """Text a stored message is replayed as; assistant turns send only their non-empty fields, compactly."""
+    if message.role == "assistant" and message.response_data:
+        data = {key: value for key, value in message.response_data.items() if value is not None}
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return message.content
+
+
+@dataclass
+class ConversationContext:
+    summary: Optional[str]
+    messages: List[dict]
+    # Newest message that fell outside the budget without being summarized yet
+    summarize_through: Optional[int] = None
+
+
+def build_conversation_context(
+    db: Session, user_id: int, conversation_id: str, budget: int = CHAT_HISTORY_TOKENS
+) -> ConversationContext:
+    """Recent turns that fit in `budget` tokens, verbatim, plus the rolling summary of earlier ones.
+
+    Only messages newer than the summary are read, at most
+    CHAT_HISTORY_MAX_MESSAGES of them, so the cost stays the same however
+    long the conversation gets. The newest message is always kept.
+    """
+    summary = db.query(ChatConversationSummary).filter(
+        ChatConversationSummary.user_id == user_id,
+        ChatConversationSummary.conversation_id == conversation_id
+    ).first()
+
+    recent = db.query(ChatMessage).filter(
+        ChatMessage.user_id == user_id,
+        ChatMessage.conversation_id == conversation_id,
+        ChatMessage.id > (summary.summarized_through_id if summary else 0)
+    ).order_by(ChatMessage.id.desc()).limit(CHAT_HISTORY_MAX_MESSAGES).all()
+
+    kept = []
+    used = 0
+    for message in recent:
+        content = message_content(message)
+        tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        if kept and used + tokens > budget:
+            break
+        kept.append({"role": message.role, "content": content})
+        used += tokens
+
+    overflow = recent[len(kept):]
+    return ConversationContext(
+        summary=summary.summary if summary else None,
+        messages=list(reversed(kept)),
+        summarize_through=overflow[0].id if overflow else None,
+    )
+
+
+def load_turns_to_summarize(
+    db: Session, user_id: int, conversation_id: str, through_id: int
+) -> Tuple[Optional[str], int, List[dict]]:
+    """The current summary, the message id it covers, and the next batch of messages up to `through_id` to fold in."""
+    summary = db.query(ChatConversationSummary).filter(
+        ChatConversationSummary.user_id == user_id,
+        ChatConversationSummary.conversation_id == conversation_id
+    ).first()
+    after_id = summary.summarized_through_id if summary else 0
+
+    messages = db.query(ChatMessage).filter(
+        ChatMessage.user_id == user_id,
+        ChatMessage.conversation_id == conversation_id,
+        ChatMessage.id > after_id,
+        ChatMessage.id <= through_id
+    ).order_by(ChatMessage.id).limit(CHAT_SUMMARY_BATCH).all()
+
+    turns = [{"id": m.id, "role": m.role, "content": m.content} for m in messages]
+    return (summary.summary if summary else None), after_id, turns
+
+
+def build_summary_prompt(previous: Optional[str], turns: List[dict]) -> List[dict]:
+    transcript = "\n".join(
+        f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['content']}" for turn in turns
+    )
+    return [
+        {
+            "role": "system",
+            "content": (
+                "You maintain the running summary of a conversation between a Spanish autónomo and "
+                "TaxHelper AI, a tax advisor. Merge the new turns into the summary. Keep the facts the "
+                "user shared about their situation, the questions asked and the conclusions reached. "
+                f"Use at most {CHAT_SUMMARY_WORDS} words and reply with the summary text only."
+            )
+        },
+        {
+            "role": "user",
+            "content": f"Current summary:\n{previous or '(none yet)'}\n\nNew turns:\n{transcript}"
+        },
+    ]
+
+
+def store_summary(
+    db: Session, user_id: int, conversation_id: str, summary_text: str, previous_through: int, through_id: int
+) -> bool:
+    """Save a new summary unless another update got there first; returns whether it was saved."""
+    try:
+        if previous_through:
+            updated = db.query(ChatConversationSummary).filter(
+                ChatConversationSummary.user_id == user_id,
+                ChatConversationSummary.conversation_id == conversation_id,
+                ChatConversationSummary.summarized_through_id == previous_through
+            ).update({"summary": summary_text, "summarized_through_id": through_id}, synchronize_session=False)
+            if not updated:
+                db.rollback()
+                return False
+        else:
+            db.add(ChatConversationSummary(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                summary=summary_text,
+                summarized_through_id=through_id
+            ))
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+        return False
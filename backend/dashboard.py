@@ -1,13 +1,15 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select, true, literal, union_all
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime, date
 from decimal import Decimal
+import pandas as pd
 
-from database import get_db, User, Transaction, Invoice
-from auth import get_current_user
+from database import get_db, Transaction, Invoice, INVOICE_STATUS_CANCELLED
+from auth import UserPrincipal, get_current_principal
+from financials_cache import financials_generation, get_cached_financials, cache_financials
 
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 
@@ -32,6 +34,23 @@ class PeriodFinancials(BaseModel):
     expense_count: int
 
 
+class FinancialSeriesPoint(BaseModel):
+    period_start: date
+    label: str
+    total_income: float
+    total_expenses: float
+    net_balance: float
+    estimated_iva: float
+    estimated_irpf: float
+    invoice_count: int
+    expense_count: int
+
+
+class FinancialSeries(BaseModel):
+    granularity: str
+    points: List[FinancialSeriesPoint]
+
+
 def get_current_tax_period() -> TaxPeriod:
     today = date.today()
     current_year = today.year
@@ -80,9 +99,54 @@ def get_current_tax_period() -> TaxPeriod:
 
 from datetime import timedelta
 
+EXPENSE_TYPES = ["expense", "invoice", "receipt"]
+ESTIMATED_IVA_RATE = 0.21
+ESTIMATED_IRPF_RATE = 0.20
+
+SERIES_MAX_PERIODS = 60
+SERIES_FREQUENCIES = {"month": "M", "quarter": "Q"}
+
+
+def _period_totals(db: Session, user_id: int, period_start: datetime, period_end: datetime):
+    """Income, invoice count, expenses and expense count for a period in one round trip.
+
+    Each table is reduced to a single row by its own aggregate subquery and
+    the two rows are cross-joined, so every sum still runs over its own index.
+    """
+    income = select(
+        func.coalesce(func.sum(Invoice.total), 0).label("total_income"),
+        func.count(Invoice.id).label("invoice_count")
+    ).where(
+        Invoice.user_id == user_id,
+        Invoice.status != INVOICE_STATUS_CANCELLED,
+        Invoice.invoice_date >= period_start,
+        Invoice.invoice_date <= period_end
+    ).subquery()
+
+    expenses = select(
+        func.coalesce(func.sum(Transaction.amount), 0).label("total_expenses"),
+        func.count(Transaction.id).label("expense_count")
+    ).where(
+        Transaction.user_id == user_id,
+        Transaction.is_deleted == False,
+        Transaction.date >= period_start,
+        Transaction.date <= period_end,
+        Transaction.type.in_(EXPENSE_TYPES)
+    ).subquery()
+
+    row = db.execute(
+        select(
+            income.c.total_income, income.c.invoice_count,
+            expenses.c.total_expenses, expenses.c.expense_count
+        ).select_from(income.join(expenses, true()))
+    ).one()
+
+    return float(row.total_income), row.invoice_count, float(row.total_expenses), row.expense_count
+
+
 @router.get("/period-financials", response_model=PeriodFinancials)
 async def get_period_financials(
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     period = get_current_tax_period()
@@ -90,39 +154,17 @@ async def get_period_financials(
     period_start = datetime.combine(period.start_date, datetime.min.time())
     period_end = datetime.combine(period.end_date, datetime.max.time())
     
-    income_result = db.query(func.sum(Invoice.total)).filter(
-        Invoice.user_id == current_user.id,
-        Invoice.invoice_date >= period_start,
-        Invoice.invoice_date <= period_end
-    ).scalar()
-    
-    total_income = float(income_result) if income_result else 0.0
-    
-    invoice_count = db.query(func.count(Invoice.id)).filter(
-        Invoice.user_id == current_user.id,
-        Invoice.invoice_date >= period_start,
-        Invoice.invoice_date <= period_end
-    ).scalar() or 0
-    
-    expense_result = db.query(func.sum(Transaction.amount)).filter(
-        Transaction.user_id == current_user.id,
-        Transaction.date >= period_start,
-        Transaction.date <= period_end,
-        Transaction.type.in_(["expense", "invoice", "receipt"])
-    ).scalar()
-    
-    total_expenses = float(expense_result) if expense_result else 0.0
-    
-    expense_count = db.query(func.count(Transaction.id)).filter(
-        Transaction.user_id == current_user.id,
-        Transaction.date >= period_start,
-        Transaction.date <= period_end,
-        Transaction.type.in_(["expense", "invoice", "receipt"])
-    ).scalar() or 0
+    generation = financials_generation(current_user.id)
+    totals = get_cached_financials(current_user.id, ("period", period.start_date))
+    if totals is None:
+        totals = _period_totals(db, current_user.id, period_start, period_end)
+        cache_financials(current_user.id, ("period", period.start_date), totals, generation)
+
+    total_income, invoice_count, total_expenses, expense_count = totals
     
     net_balance = total_income - total_expenses
-    estimated_iva = total_income * 0.21  
-    estimated_irpf = max(0, net_balance * 0.20)
+    estimated_iva = total_income * ESTIMATED_IVA_RATE
+    estimated_irpf = max(0, net_balance * ESTIMATED_IRPF_RATE)
     
     return PeriodFinancials(
         period=period,
@@ -136,8 +178,99 @@ async def get_period_financials(
     )
 
 
+def _series_totals(db: Session, user_id: int, granularity: str, start: datetime, end: datetime) -> pd.DataFrame:
+    """Income, expenses and counts per month or quarter, grouped in the database in one round trip.
+
+    Each table is aggregated per date_trunc bucket, and the two results are
+    merged with UNION ALL and summed per bucket. Buckets with no activity
+    are absent.
+    """
+    invoice_bucket = func.date_trunc(granularity, Invoice.invoice_date)
+    income = select(
+        invoice_bucket.label("bucket"),
+        func.sum(Invoice.total).label("total_income"),
+        literal(0).label("total_expenses"),
+        func.count(Invoice.id).label("invoice_count"),
+        literal(0).label("expense_count")
+    ).where(
+        Invoice.user_id == user_id,
+        Invoice.status != INVOICE_STATUS_CANCELLED,
+        Invoice.invoice_date >= start,
+        Invoice.invoice_date < end
+    ).group_by(invoice_bucket)
+
+    expense_bucket = func.date_trunc(granularity, Transaction.date)
+    expenses = select(
+        expense_bucket.label("bucket"),
+        literal(0).label("total_income"),
+        func.sum(Transaction.amount).label("total_expenses"),
+        literal(0).label("invoice_count"),
+        func.count(Transaction.id).label("expense_count")
+    ).where(
+        Transaction.user_id == user_id,
+        Transaction.is_deleted == False,
+        Transaction.date >= start,
+        Transaction.date < end,
+        Transaction.type.in_(EXPENSE_TYPES)
+    ).group_by(expense_bucket)
+
+    buckets = union_all(income, expenses).subquery()
+    rows = db.execute(
+        select(
+            buckets.c.bucket,
+            func.sum(buckets.c.total_income).label("total_income"),
+            func.sum(buckets.c.total_expenses).label("total_expenses"),
+            func.sum(buckets.c.invoice_count).label("invoice_count"),
+            func.sum(buckets.c.expense_count).label("expense_count")
+        ).group_by(buckets.c.bucket)
+    ).all()
+
+    return pd.DataFrame(rows, columns=["bucket", "total_income", "total_expenses", "invoice_count", "expense_count"])
+
+
+def _financial_series(totals: pd.DataFrame, periods: pd.PeriodIndex) -> List[FinancialSeriesPoint]:
+    """Fill in empty periods and derive the tax estimates for the whole series at once."""
+    frame = totals.assign(
+        period=pd.to_datetime(totals["bucket"]).dt.to_period(periods.freq)
+    ).drop(columns="bucket").set_index("period").astype(float).reindex(periods, fill_value=0.0)
+
+    frame["net_balance"] = frame["total_income"] - frame["total_expenses"]
+    frame["estimated_iva"] = frame["total_income"] * ESTIMATED_IVA_RATE
+    frame["estimated_irpf"] = (frame["net_balance"] * ESTIMATED_IRPF_RATE).clip(lower=0)
+    frame[["invoice_count", "expense_count"]] = frame[["invoice_count", "expense_count"]].astype(int)
+
+    return [
+        FinancialSeriesPoint(period_start=period.start_time.date(), label=str(period), **values)
+        for period, values in zip(frame.index, frame.to_dict("records"))
+    ]
+
+
+@router.get("/financial-series", response_model=FinancialSeries)
+async def get_financial_series(
+    granularity: str = Query("quarter", pattern="^(month|quarter)$"),
+    periods: int = Query(8, ge=1, le=SERIES_MAX_PERIODS),
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """Income, expenses and estimated IVA/IRPF for the last `periods` months or quarters, oldest first."""
+    period_index = pd.period_range(
+        end=pd.Period(date.today(), freq=SERIES_FREQUENCIES[granularity]), periods=periods
+    )
+    start = period_index[0].start_time.to_pydatetime()
+    end = (period_index[-1] + 1).start_time.to_pydatetime()
+
+    cache_key = ("series", granularity, start.date(), periods)
+    generation = financials_generation(current_user.id)
+    points = get_cached_financials(current_user.id, cache_key)
+    if points is None:
+        points = _financial_series(_series_totals(db, current_user.id, granularity, start, end), period_index)
+        cache_financials(current_user.id, cache_key, points, generation)
+
+    return FinancialSeries(granularity=granularity, points=points)
+
+
 @router.get("/current-period", response_model=TaxPeriod)
 async def get_current_period(
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_principal)
 ):
     return get_current_tax_period()
\ No newline at end of file
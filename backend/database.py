@@ -1,8 +1,9 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Text, JSON, Numeric, Boolean, Date
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Text, JSON, Numeric, Boolean, Date, Index, UniqueConstraint, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.dialects.postgresql import BYTEA 
 import os
+from contextlib import contextmanager
 from datetime import datetime
 
 DATABASE_HOST = os.getenv("DATABASE_HOST", "localhost")
@@ -89,6 +90,8 @@ class BankAccount(Base):
     account_type = Column(String(50), nullable=True)   
     account_number = Column(BYTEA, nullable=True)      
     access_token = Column(String(500), nullable=True)  
+    access_token_encrypted = Column(BYTEA, nullable=True)
+    access_token_key = Column(BYTEA, nullable=True)
     plaid_account_id = Column(String(100), nullable=True, index=True)   
     plaid_item_id = Column(String(100), nullable=True) 
     last_sync = Column(DateTime, nullable=True)
@@ -112,8 +115,55 @@ class Transaction(Base):
     plaid_transaction_id = Column(String(100), nullable=True, unique=True, index=True) 
     is_deleted = Column(Boolean, default=False, nullable=False)
     deleted_at = Column(DateTime, nullable=True)
+    fingerprint = Column(String(64), nullable=True)
     
     user = relationship("User", back_populates="transactions")
+    
+    __table_args__ = (
+        Index(
+            "ix_transactions_fingerprint",
+            "fingerprint",
+            unique=True,
+            postgresql_where=text("fingerprint IS NOT NULL")
+        ),
+        Index("ix_transactions_user_date_id", "user_id", "date", "id"),
+        Index("ix_transactions_user_category_date_id", "user_id", "category", "date", "id"),
+        Index(
+            "ix_transactions_description_trgm",
+            "description",
+            postgresql_using="gin",
+            postgresql_ops={"description": "gin_trgm_ops"}
+        ),
+        Index(
+            "ix_transactions_invoice_id_trgm",
+            "invoice_id",
+            postgresql_using="gin",
+            postgresql_ops={"invoice_id": "gin_trgm_ops"}
+        ),
+    )
+
+class BankFormatProfile(Base):
+    __tablename__ = "bank_format_profiles"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    signature = Column(String(64), nullable=False)
+    bank_name = Column(String(100), nullable=True)
+    columns = Column(JSON, nullable=False)
+    date_col = Column(String(100), nullable=False)
+    amount_col = Column(String(100), nullable=False)
+    desc_col = Column(String(100), nullable=True)
+    date_format = Column(String(20), nullable=True)
+    decimal = Column(String(1), default=",", nullable=False)
+    thousands = Column(String(1), nullable=True)
+    delimiter = Column(String(1), nullable=True)
+    header_row = Column(Integer, default=0, nullable=False)
+    use_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "signature", name="uq_bank_format_profiles_user_signature"),
+    )
 
 class Reminder(Base):
     __tablename__ = "reminders"
@@ -145,8 +195,28 @@ class ChatMessage(Base):
     tokens_used = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        Index("ix_chat_messages_user_conversation_created", "user_id", "conversation_id", "created_at"),
+    )
+    
     user = relationship("User", back_populates="chat_messages")
 
+class ChatConversationSummary(Base):
+    __tablename__ = "chat_conversation_summaries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    conversation_id = Column(String(50), nullable=False)
+    summary = Column(Text, nullable=False)
+    summarized_through_id = Column(Integer, nullable=False)  # last chat_messages.id folded into the summary
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "conversation_id", name="uq_chat_conversation_summaries_user_conversation"),
+    )
+
+INVOICE_STATUS_CANCELLED = "cancelled"
+
 class Invoice(Base):
     __tablename__ = "invoices"
     
@@ -183,7 +253,8 @@ class Invoice(Base):
     verifactu_hash = Column(String(64), nullable=True, index=True)
     previous_hash = Column(String(64), nullable=True, index=True)
     
-    qr_code_data = Column(Text, nullable=True)
+    qr_code_data = Column(Text, nullable=True)  # legacy base64 PNG, new invoices store verification_url only
+    verification_url = Column(String(500), nullable=True)
     
     verifactu_timestamp = Column(DateTime, nullable=True)
     
@@ -198,10 +269,66 @@ class Invoice(Base):
     
     verifactu_xml = Column(Text, nullable=True)
     
+    # Set on rectificativas (R1-R5), which are new invoices pointing at the one they correct
+    rectified_invoice_id = Column(Integer, ForeignKey("invoices.id"), nullable=True, index=True)
+    rectification_reason = Column(Text, nullable=True)
+    
     verifactu_events = relationship("InvoiceVerifactuEvent", back_populates="invoice", cascade="all, delete-orphan")
     user = relationship("User", back_populates="invoices")
     items = relationship("InvoiceItem", back_populates="invoice", cascade="all, delete-orphan")
     verifactu_chain_records = relationship("VerifactuChainRecord", back_populates="invoice")
+    cancellation = relationship("InvoiceCancellation", back_populates="invoice", uselist=False)
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "invoice_number", name="uq_invoices_user_invoice_number"),
+        Index("ix_invoices_user_created_id", "user_id", "created_at", "id"),
+        # Lists and income totals skip cancelled invoices, so their indexes leave them out
+        Index(
+            "ix_invoices_user_created_id_active", "user_id", "created_at", "id",
+            postgresql_where=text(f"status <> '{INVOICE_STATUS_CANCELLED}'")
+        ),
+        Index(
+            "ix_invoices_user_invoice_date_active", "user_id", "invoice_date",
+            postgresql_where=text(f"status <> '{INVOICE_STATUS_CANCELLED}'")
+        ),
+    )
+
+class InvoiceCancellation(Base):
+    """RegistroAnulacion: cancelling an invoice appends this record to the chain instead of deleting rows."""
+    __tablename__ = "invoice_cancellations"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), nullable=False)
+    
+    reason = Column(Text, nullable=True)
+    
+    hash_value = Column(String(64), nullable=False, index=True)
+    previous_hash = Column(String(64), nullable=True)
+    hash_input = Column(Text, nullable=True)
+    verifactu_timestamp = Column(DateTime, nullable=True)
+    verifactu_submitted = Column(Boolean, default=False, nullable=False)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    invoice = relationship("Invoice", back_populates="cancellation")
+    
+    __table_args__ = (
+        UniqueConstraint("invoice_id", name="invoice_cancellations_invoice_id_key"),
+        Index("ix_invoice_cancellations_user_created", "user_id", "created_at"),
+    )
+
+class InvoiceNumberSequence(Base):
+    __tablename__ = "invoice_number_sequences"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    series = Column(String(10), nullable=False)
+    next_value = Column(Integer, nullable=False, default=1)
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "series", name="uq_invoice_number_sequences_user_series"),
+    )
 
 class InvoiceItem(Base):
     __tablename__ = "invoice_items"
@@ -444,4 +571,46 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+_UNIT_OF_WORK = "unit_of_work"
+
+@contextmanager
+def unit_of_work(db):
+    """Run a request's writes as a single transaction.
+
+    Helpers that would otherwise commit on their own (see in_unit_of_work)
+    only add their rows, so everything is flushed together and committed
+    once when the block exits, or rolled back if it raises. Objects are not
+    expired by that commit, so building the response does not reload them.
+    A nested block joins the outer one.
+    """
+    if db.info.get(_UNIT_OF_WORK):
+        yield db
+        return
+
+    db.info[_UNIT_OF_WORK] = True
+    expire_on_commit = db.expire_on_commit
+    try:
+        yield db
+        db.expire_on_commit = False
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        db.expire_on_commit = expire_on_commit
+        db.info.pop(_UNIT_OF_WORK, None)
+
+
+def in_unit_of_work(db) -> bool:
+    return bool(db.info.get(_UNIT_OF_WORK))
+
+
+def is_unique_violation(error, constraint: str) -> bool:
+    """True if an IntegrityError was raised by the named unique constraint."""
+    diag = getattr(error.orig, "diag", None)
+    if diag is not None and getattr(diag, "constraint_name", None):
+        return diag.constraint_name == constraint
+    return constraint in str(error.orig)
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import threading
+import logging
+from typing import Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class DiskLRUCache:
+    """Size-bounded directory of cache files.
+
+    A file's mtime is its last use, and the least recently used files are
+    removed once the directory grows past max_bytes. Writes go through a
+    temporary file and os.replace, so readers never see a partial entry
+    even when several workers share the directory.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = ""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def _entries(self):
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self.suffix) and not entry.name.endswith(".tmp"):
+                yield entry
+
+    def _current_size(self) -> int:
+        if self._size is None:
+            self._size = sum(e.stat().st_size for e in self._entries())
+        return self._size
+
+    def _record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_path(self, key: str) -> Optional[str]:
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except OSError:
+            self._record(False)
+            return None
+        self._record(True)
+        return path
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        path = self.path_for(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self._record(False)
+            return None
+        self._record(True)
+        return data
+
+    def put(self, key: str, data: bytes) -> Optional[str]:
+        if len(data) > self.max_bytes:
+            return None
+
+        path = self.path_for(key)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            with self._lock:
+                current = self._current_size()
+                previous = os.path.getsize(path) if os.path.exists(path) else 0
+                os.replace(temp_path, path)
+                self._size = current - previous + len(data)
+                if self._size > self.max_bytes:
+                    self._evict(keep=path)
+            return path
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {key[:16]}... to {self.directory}: {e}")
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            return None
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        # Trim to 90% of the limit so eviction does not run on every write
+        target = int(self.max_bytes * 0.9)
+        entries = sorted(
+            ((e.stat().st_mtime, e.stat().st_size, e.path) for e in self._entries())
+        )
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+                size -= entry_size
+            except OSError:
+                continue
+        self._size = size
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size_bytes": self._current_size(),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -1,16 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, BackgroundTasks
+from sqlalchemy import func, or_, tuple_, insert, update
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime, timedelta
-import os
-import tempfile
-import re
 import json
 import logging
 
 from database import get_db, User, Transaction
 from auth import get_current_user
+from financials_cache import mark_financials_dirty
+from pagination import encode_cursor, decode_cursor, parse_date_range
+from ocr_pipeline import (
+    OCRJob, ReceiptData, spool_receipts, process_receipts, save_receipts,
+    create_job, get_job, run_job
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,13 +24,6 @@ router = APIRouter(prefix="/expenses", tags=["expenses"])
 from dotenv import load_dotenv
 load_dotenv()
 
-try:
-    from docstrange import DocumentExtractor
-    HAS_DOCSTRANGE = True
-except ImportError:
-    HAS_DOCSTRANGE = False
-    logger.warning("docstrange not installed - document parsing disabled")
-
 class ExpenseCreate(BaseModel):
     date: str
     amount: float
@@ -70,6 +67,49 @@ class UploadResponse(BaseModel):
     verified: bool = True
 
 
+class UploadJobResponse(BaseModel):
+    job_id: str
+    status: str
+    total: int
+    processed: int
+    results: List[UploadResponse] = []
+    errors: List[dict] = []
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+BULK_MAX_ITEMS = 1000
+
+
+class ExpenseBulkUpdateItem(ExpenseUpdate):
+    id: int
+
+
+class ExpenseBulkCreate(BaseModel):
+    items: List[ExpenseCreate] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+
+class ExpenseBulkUpdate(BaseModel):
+    items: List[ExpenseBulkUpdateItem] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+
+class ExpenseBulkIds(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+
+class BulkItemResult(BaseModel):
+    index: int
+    id: Optional[int] = None
+    status: str
+    error: Optional[str] = None
+
+
+class BulkResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkItemResult]
+
+
 class AdviceRequest(BaseModel):
     full_text: str
     user_region: str
@@ -95,48 +135,291 @@ class GeneralAdviceResponse(BaseModel):
     suggestions: List[str]
     confidence: float
 
+EXPENSE_PAGE_SIZE = 100
+EXPENSE_MAX_PAGE_SIZE = 500
+EXPENSE_FIELDS = list(ExpenseResponse.model_fields)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return EXPENSE_FIELDS
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in EXPENSE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
 @router.get("/")
 async def get_expenses(
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
     type: Optional[str] = None,
     include_deleted: bool = False, 
+    category: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    q: Optional[str] = Query(None, description="Search in description and invoice number"),
+    fields: Optional[str] = Query(None, description="Comma-separated list of fields to return"),
+    cursor: Optional[str] = None,
+    limit: int = Query(EXPENSE_PAGE_SIZE, ge=1, le=EXPENSE_MAX_PAGE_SIZE),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    query = db.query(Transaction).filter(
+    selected = _parse_fields(fields)
+    # id and date are always loaded because the cursor is built from them
+    columns = [Transaction.id, Transaction.date] + [
+        getattr(Transaction, f) for f in selected if f not in ("id", "date")
+    ]
+
+    query = db.query(*columns).filter(
         Transaction.user_id == current_user.id,
-        Transaction.type.in_(["expense", "invoice", "receipt"])  # CHANGED!
+        Transaction.type.in_(["expense", "invoice", "receipt"]),  # CHANGED!
+        Transaction.date.isnot(None)
     )
     
     if not include_deleted:
         query = query.filter(Transaction.is_deleted == False)
     
-    if date_from:
-        query = query.filter(Transaction.date >= datetime.fromisoformat(date_from))
-    if date_to:
-        query = query.filter(Transaction.date <= datetime.fromisoformat(date_to))
+    start, end = parse_date_range(date_from, date_to)
+    if start:
+        query = query.filter(Transaction.date >= start)
+    if end:
+        query = query.filter(Transaction.date < end)
     
     if type:
         query = query.filter(Transaction.type == type)
+
+    if category:
+        query = query.filter(Transaction.category == category)
+    if min_amount is not None:
+        query = query.filter(Transaction.amount >= min_amount)
+    if max_amount is not None:
+        query = query.filter(Transaction.amount <= max_amount)
+    if q:
+        pattern = f"%{_escape_like(q)}%"
+        query = query.filter(or_(
+            Transaction.description.ilike(pattern, escape="\\"),
+            Transaction.invoice_id.ilike(pattern, escape="\\")
+        ))
+
+    summary = None
+    if not cursor:
+        # Totals cover every matching expense, not just this page, so they are sent with the first page
+        count, total = query.with_entities(
+            func.count(Transaction.id), func.coalesce(func.sum(Transaction.amount), 0)
+        ).one()
+        summary = {"count": count, "total_amount": float(total)}
+
+    if cursor:
+        cursor_date, cursor_id = decode_cursor(cursor)
+        query = query.filter(tuple_(Transaction.date, Transaction.id) < (cursor_date, cursor_id))
+
+    rows = query.order_by(Transaction.date.desc(), Transaction.id.desc()).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1].date, rows[-1].id) if has_more else None
+
+    if fields:
+        expense_list = [
+            {
+                f: (float(row.amount) if row.amount else 0.0) if f == "amount" else getattr(row, f)
+                for f in selected
+            }
+            for row in rows
+        ]
+    else:
+        expense_list = [
+            ExpenseResponse(
+                id=exp.id,
+                date=exp.date,
+                amount=float(exp.amount) if exp.amount else 0.0,
+                type=exp.type,
+                category=exp.category,
+                description=exp.description,
+                invoice_id=exp.invoice_id,
+                created_at=exp.created_at
+            )
+            for exp in rows
+        ]
     
-    expenses = query.order_by(Transaction.date.desc()).all()
-    
-    expense_list = [
-        ExpenseResponse(
-            id=exp.id,
-            date=exp.date,
-            amount=float(exp.amount) if exp.amount else 0.0,
-            type=exp.type,
-            category=exp.category,
-            description=exp.description,
-            invoice_id=exp.invoice_id,
-            created_at=exp.created_at
+    return {"expenses": expense_list, "next_cursor": next_cursor, "has_more": has_more, "summary": summary}
+
+def _parse_expense_date(value: str) -> Optional[datetime]:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+
+
+def _build_description(description: Optional[str], vendor: Optional[str]) -> str:
+    description = description or ""
+    if vendor:
+        description = f"{vendor} | {description}" if description else vendor
+    return description
+
+
+def _bulk_response(results: List[BulkItemResult], all_or_nothing: bool, db: Session, user_id: int) -> BulkResponse:
+    failed = sum(1 for r in results if r.status == "error")
+    response = BulkResponse(succeeded=len(results) - failed, failed=failed, results=results)
+    if failed and all_or_nothing:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=response.model_dump())
+    mark_financials_dirty(db, user_id)
+    db.commit()
+    return response
+
+
+@router.post("/bulk", response_model=BulkResponse)
+async def bulk_create_expenses(
+    payload: ExpenseBulkCreate,
+    all_or_nothing: bool = False,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    results = []
+    rows = []
+    for index, item in enumerate(payload.items):
+        expense_date = _parse_expense_date(item.date)
+        if expense_date is None:
+            results.append(BulkItemResult(index=index, status="error", error=f"Invalid date: {item.date}"))
+            continue
+        results.append(BulkItemResult(index=index, status="created"))
+        rows.append({
+            "user_id": current_user.id,
+            "date": expense_date,
+            "amount": item.amount,
+            "type": item.type,
+            "category": item.category,
+            "description": _build_description(item.description, item.vendor),
+            "invoice_id": item.invoice_number,
+            "provider": "manual",
+        })
+
+    if rows and not (all_or_nothing and len(rows) < len(results)):
+        ids = db.scalars(
+            insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True),
+            rows
+        ).all()
+        created = iter(ids)
+        for result in results:
+            if result.status == "created":
+                result.id = next(created)
+
+    return _bulk_response(results, all_or_nothing, db, current_user.id)
+
+
+@router.patch("/bulk", response_model=BulkResponse)
+async def bulk_update_expenses(
+    payload: ExpenseBulkUpdate,
+    all_or_nothing: bool = False,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    requested_ids = {item.id for item in payload.items}
+    existing = {row.id for row in db.query(Transaction.id).filter(
+        Transaction.id.in_(requested_ids),
+        Transaction.user_id == current_user.id
+    )}
+
+    results = []
+    rows = []
+    seen = set()
+    for index, item in enumerate(payload.items):
+        if item.id not in existing:
+            results.append(BulkItemResult(index=index, id=item.id, status="error", error="Expense not found"))
+            continue
+        if item.id in seen:
+            results.append(BulkItemResult(index=index, id=item.id, status="error", error="Duplicate id in request"))
+            continue
+        seen.add(item.id)
+
+        values = {"id": item.id}
+        if item.date:
+            expense_date = _parse_expense_date(item.date)
+            if expense_date is None:
+                results.append(BulkItemResult(index=index, id=item.id, status="error", error=f"Invalid date: {item.date}"))
+                continue
+            values["date"] = expense_date
+        if item.amount is not None:
+            values["amount"] = item.amount
+        if item.type:
+            values["type"] = item.type
+        if item.category:
+            values["category"] = item.category
+        if item.description is not None:
+            values["description"] = _build_description(item.description, item.vendor)
+        if item.invoice_number is not None:
+            values["invoice_id"] = item.invoice_number
+
+        results.append(BulkItemResult(index=index, id=item.id, status="updated"))
+        if len(values) > 1:
+            rows.append(values)
+
+    if rows and not (all_or_nothing and any(r.status == "error" for r in results)):
+        db.execute(update(Transaction), rows)
+
+    return _bulk_response(results, all_or_nothing, db, current_user.id)
+
+
+def _bulk_set_deleted(
+    db: Session, user_id: int, ids: List[int], deleted: bool, all_or_nothing: bool
+) -> BulkResponse:
+    changed = set(db.scalars(
+        update(Transaction)
+        .where(
+            Transaction.id.in_(set(ids)),
+            Transaction.user_id == user_id,
+            Transaction.is_deleted == (not deleted)
         )
-        for exp in expenses
-    ]
-    
-    return {"expenses": expense_list}
+        .values(is_deleted=deleted, deleted_at=datetime.utcnow() if deleted else None)
+        .returning(Transaction.id)
+        .execution_options(synchronize_session=False)
+    ).all())
+
+    status = "deleted" if deleted else "restored"
+    error = "Expense not found" if deleted else "Deleted expense not found"
+    results = []
+    reported = set()
+    for index, expense_id in enumerate(ids):
+        if expense_id in reported:
+            results.append(BulkItemResult(index=index, id=expense_id, status="error", error="Duplicate id in request"))
+        elif expense_id in changed:
+            reported.add(expense_id)
+            results.append(BulkItemResult(index=index, id=expense_id, status=status))
+        else:
+            results.append(BulkItemResult(index=index, id=expense_id, status="error", error=error))
+
+    return _bulk_response(results, all_or_nothing, db, user_id)
+
+
+@router.post("/bulk/delete", response_model=BulkResponse)
+async def bulk_delete_expenses(
+    payload: ExpenseBulkIds,
+    all_or_nothing: bool = False,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return _bulk_set_deleted(db, current_user.id, payload.ids, True, all_or_nothing)
+
+
+@router.post("/bulk/restore", response_model=BulkResponse)
+async def bulk_restore_expenses(
+    payload: ExpenseBulkIds,
+    all_or_nothing: bool = False,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return _bulk_set_deleted(db, current_user.id, payload.ids, False, all_or_nothing)
+
 
 @router.get("/{expense_id}", response_model=ExpenseResponse)
 async def get_expense(
@@ -170,17 +453,8 @@ async def create_expense(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    try:
-        expense_date = datetime.strptime(expense_data.date, "%Y-%m-%d")
-    except ValueError:
-        try:
-            expense_date = datetime.fromisoformat(expense_data.date.replace('Z', '+00:00'))
-        except ValueError:
-            expense_date = datetime.now()
-    
-    description = expense_data.description or ""
-    if expense_data.vendor:
-        description = f"{expense_data.vendor} | {description}" if description else expense_data.vendor
+    expense_date = _parse_expense_date(expense_data.date) or datetime.now()
+    description = _build_description(expense_data.description, expense_data.vendor)
     
     expense = Transaction(
         user_id=current_user.id,
@@ -194,6 +468,7 @@ async def create_expense(
     )
     
     db.add(expense)
+    mark_financials_dirty(db, current_user.id)
     db.commit()
     db.refresh(expense)
     
@@ -248,6 +523,7 @@ async def update_expense(
     if expense_data.invoice_number is not None:
         expense.invoice_id = expense_data.invoice_number
     
+    mark_financials_dirty(db, current_user.id)
     db.commit()
     db.refresh(expense)
     
@@ -279,117 +555,86 @@ async def delete_expense(
     
     expense.is_deleted = True
     expense.deleted_at = datetime.utcnow()
+    mark_financials_dirty(db, current_user.id)
     
     db.commit()
     
     return {"message": "Expense deleted successfully", "id": expense_id}
 
+def _validate_receipt_files(files: List[UploadFile]) -> None:
+    for file in files:
+        if not file.content_type.startswith('image/') and file.content_type != 'application/pdf':
+            raise HTTPException(status_code=400, detail="Only images or PDF allowed")
+
+
+def _to_upload_response(receipt: ReceiptData) -> UploadResponse:
+    return UploadResponse(
+        transaction_id=receipt.transaction_id,
+        amount=receipt.amount,
+        description=receipt.description,
+        date=receipt.date.isoformat(),
+        invoice_id=receipt.invoice_id
+    )
+
+
+def _to_job_response(job: OCRJob) -> UploadJobResponse:
+    return UploadJobResponse(
+        job_id=job.job_id,
+        status=job.status,
+        total=job.total,
+        processed=job.processed,
+        results=[_to_upload_response(r) for r in job.results if r.transaction_id is not None],
+        errors=job.errors,
+        created_at=job.created_at,
+        finished_at=job.finished_at
+    )
+
+
 @router.post("/upload", response_model=List[UploadResponse])
 async def upload_invoices(
     files: List[UploadFile] = File(...),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    if not HAS_DOCSTRANGE:
-        # Fallback: create basic transaction without parsing
-        results = []
-        for file in files:
-            if not file.content_type.startswith('image/') and file.content_type != 'application/pdf':
-                raise HTTPException(status_code=400, detail="Only images or PDF allowed")
-            
-            transaction = Transaction(
-                user_id=current_user.id,
-                date=datetime.now(),
-                amount=0.0,
-                type="expense",
-                category="deductible",
-                description=f"Uploaded: {file.filename}",
-                invoice_id=file.filename,
-                provider="upload"
-            )
-            db.add(transaction)
-            db.commit()
-            db.refresh(transaction)
-            
-            results.append(UploadResponse(
-                transaction_id=transaction.id,
-                amount=0.0,
-                description=f"Uploaded: {file.filename}",
-                date=datetime.now().isoformat(),
-                invoice_id=file.filename
-            ))
-        return results
-    
-    extractor = DocumentExtractor(api_key=os.getenv("DOCSTRANGE_API_KEY"))
-    results = []
-    
-    for file in files:
-        if not file.content_type.startswith('image/') and file.content_type != 'application/pdf':
-            raise HTTPException(status_code=400, detail="Only images or PDF allowed")
-        
-        file_content = await file.read()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file.filename.split('.')[-1]}") as temp_file:
-            temp_path = temp_file.name
-            temp_file.write(file_content)
-        
-        try:
-            result = extractor.extract(temp_path)
-            full_text = str(result)
-            
-            fields = result.extract_data(
-                specified_fields=[
-                    "total_amount", "due_date", "vendor_name", "invoice_number",
-                    "line_items", "description"
-                ]
-            )
-            
-            content = fields.get('extracted_fields', {}).get('content', {})
-            
-            amount_str = str(content.get('total_amount', '0.0'))
-            amount = float(amount_str.replace(',', '.')) if amount_str != '0.0' else 0.0
-            
-            date_str = str(content.get('due_date', ''))
-            date = datetime.fromisoformat(date_str) if date_str else datetime.now()
-            
-            description = str(content.get('vendor_name', 'Unknown invoice'))
-            invoice_id = content.get('invoice_number', file.filename)
-            
-            line_items = content.get('line_items', [])
-            if line_items:
-                items_desc = ", ".join([str(item.get('description', '')) for item in line_items[:4]])
-                description += f" | Items: {items_desc}"
-            
-            if amount == 0.0:
-                amount_match = re.search(r'Total\s*([\d,]+\.?\d*\s*€)', full_text, re.IGNORECASE)
-                if amount_match:
-                    amount_str = amount_match.group(1).replace(',', '.').replace(' €', '')
-                    amount = float(amount_str)
-            
-            transaction = Transaction(
-                user_id=current_user.id,
-                date=date,
-                amount=amount,
-                type="expense",
-                category="deductible",
-                description=description,
-                invoice_id=invoice_id,
-                provider="docstrange"
-            )
-            db.add(transaction)
-            db.commit()
-            db.refresh(transaction)
-            
-            results.append(UploadResponse(
-                transaction_id=transaction.id,
-                amount=amount,
-                description=description,
-                date=date.isoformat(),
-                invoice_id=invoice_id
-            ))
-        finally:
-            os.unlink(temp_path)
-    
-    return results
+    _validate_receipt_files(files)
+    spooled_files = await spool_receipts(files)
+
+    receipts, errors = await process_receipts(spooled_files)
+    if errors:
+        # Nothing is saved unless every file was read; results are cached, so a retry only redoes the failures.
+        # Use /upload/jobs to keep the receipts that did succeed.
+        raise HTTPException(
+            status_code=502,
+            detail={"message": "Could not process some of the uploaded files", "errors": errors}
+        )
+
+    save_receipts(db, current_user.id, receipts)
+    return [_to_upload_response(r) for r in receipts]
+
+
+@router.post("/upload/jobs", response_model=UploadJobResponse, status_code=202)
+async def start_upload_job(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    _validate_receipt_files(files)
+    spooled_files = await spool_receipts(files)
+
+    job = create_job(current_user.id, len(spooled_files))
+    background_tasks.add_task(run_job, job, spooled_files)
+    return _to_job_response(job)
+
+
+@router.get("/upload/jobs/{job_id}", response_model=UploadJobResponse)
+async def get_upload_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    job = get_job(job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return _to_job_response(job)
 
 @router.post("/{expense_id}/restore")
 async def restore_expense(
@@ -408,6 +653,7 @@ async def restore_expense(
     
     expense.is_deleted = False
     expense.deleted_at = None
+    mark_financials_dirty(db, current_user.id)
     
     db.commit()
     
@@ -0,0 +1,54 @@
+import os
+import json
+import hashlib
+import tempfile
+import logging
+from typing import Optional, Iterable
+
+from disk_cache import DiskLRUCache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+EXTRACTION_CACHE_DIR = os.getenv(
+    "EXTRACTION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "taxhelper_extraction_cache")
+)
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+class ExtractionCache(DiskLRUCache):
+    """Content-addressed on-disk cache of document extraction results.
+
+    Entries are JSON files named after a SHA-256 of the document bytes, the
+    extractor version and the requested fields.
+    """
+
+    def __init__(self, directory: str = EXTRACTION_CACHE_DIR, max_bytes: int = EXTRACTION_CACHE_MAX_BYTES):
+        super().__init__(directory, max_bytes, suffix=".json")
+
+    @staticmethod
+    def make_key(digest: str, extractor_version: str, fields: Iterable[str]) -> str:
+        material = "|".join([digest, extractor_version, ",".join(sorted(fields))])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        data = self.get_bytes(key)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def set(self, key: str, value: dict) -> None:
+        self.put(key, json.dumps(value, default=str).encode("utf-8"))
+
+
+_extraction_cache = None
+
+def get_extraction_cache() -> ExtractionCache:
+    global _extraction_cache
+    if _extraction_cache is None:
+        _extraction_cache = ExtractionCache()
+    return _extraction_cache
@@ -0,0 +1,64 @@
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Transaction
+from financials_cache import financials_generation, get_cached_financials, cache_financials
+
+CONTEXT_WINDOW_DAYS = 180
+CONTEXT_TOP_CATEGORIES = 3
+
+
+@dataclass(frozen=True)
+class FinancialContext:
+    income: float = 0.0
+    expenses: float = 0.0
+    top_expense_categories: Tuple[Tuple[str, float], ...] = ()
+
+
+def _load_context(db: Session, user_id: int, from_date: datetime) -> FinancialContext:
+    rows = db.query(
+        Transaction.type,
+        Transaction.category,
+        func.sum(Transaction.amount).label("total")
+    ).filter(
+        Transaction.user_id == user_id,
+        Transaction.is_deleted == False,
+        Transaction.date >= from_date,
+        Transaction.type.in_(["income", "expense"])
+    ).group_by(Transaction.type, Transaction.category).all()
+
+    income = sum(float(row.total) for row in rows if row.type == "income")
+    expense_rows = [row for row in rows if row.type == "expense"]
+    categories = sorted(
+        ((row.category, float(row.total)) for row in expense_rows if row.category),
+        key=lambda item: item[1],
+        reverse=True
+    )
+
+    return FinancialContext(
+        income=income,
+        expenses=sum(float(row.total) for row in expense_rows),
+        top_expense_categories=tuple(categories[:CONTEXT_TOP_CATEGORIES]),
+    )
+
+
+def get_financial_context(db: Session, user_id: int) -> FinancialContext:
+    """Income, expenses and top expense categories over the last CONTEXT_WINDOW_DAYS.
+
+    Computed by one query grouped by type and category, so its cost depends
+    on the number of categories rather than transactions. Cached per user
+    and day until a write to the user's transactions or invoices commits.
+    """
+    from_date = date.today() - timedelta(days=CONTEXT_WINDOW_DAYS)
+    cache_key = ("chat_context", from_date)
+
+    generation = financials_generation(user_id)
+    context = get_cached_financials(user_id, cache_key)
+    if context is None:
+        context = _load_context(db, user_id, datetime.combine(from_date, datetime.min.time()))
+        cache_financials(user_id, cache_key, context, generation)
+    return context
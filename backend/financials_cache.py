@@ -0,0 +1,65 @@
+import os
+import threading
+from typing import Any, Dict, Hashable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from ttl_cache import TTLCache
+
+FINANCIALS_CACHE_TTL = float(os.getenv("FINANCIALS_CACHE_TTL", "300"))
+FINANCIALS_CACHE_SIZE = 10000
+
+_DIRTY_USERS = "dirty_financials"
+
+_cache = TTLCache(maxsize=FINANCIALS_CACHE_SIZE, ttl=FINANCIALS_CACHE_TTL)
+_generations: Dict[int, int] = {}
+_lock = threading.Lock()
+
+
+def financials_generation(user_id: int) -> int:
+    """Read before computing a value, and pass to cache_financials when storing it."""
+    with _lock:
+        return _generations.get(user_id, 0)
+
+
+def get_cached_financials(user_id: int, key: Hashable) -> Optional[Any]:
+    return _cache.get((user_id, key))
+
+
+def cache_financials(user_id: int, key: Hashable, value: Any, generation: int) -> None:
+    # Skip values computed before a write that has committed since, so they cannot outlive the invalidation
+    with _lock:
+        if _generations.get(user_id, 0) != generation:
+            return
+        _cache.set((user_id, key), value)
+
+
+def invalidate_financials(user_id: int) -> int:
+    with _lock:
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+        return _cache.invalidate(lambda cached_key: cached_key[0] == user_id)
+
+
+def mark_financials_dirty(db: Session, user_id: int) -> None:
+    """Drop the user's cached figures once the session's current transaction commits.
+
+    Each worker process holds its own cache, so other workers catch up when
+    their entries expire after FINANCIALS_CACHE_TTL.
+    """
+    db.info.setdefault(_DIRTY_USERS, set()).add(user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session) -> None:
+    for user_id in session.info.pop(_DIRTY_USERS, ()):
+        invalidate_financials(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session: Session) -> None:
+    session.info.pop(_DIRTY_USERS, None)
+
+
+def financials_cache_stats() -> dict:
+    return _cache.stats()
@@ -0,0 +1,96 @@
+import io
+import re
+import csv
+import hashlib
+import zipfile
+import logging
+from datetime import datetime
+from typing import Dict, List, Tuple, AsyncIterator
+
+from invoice_pdf import InvoicePdfData, InvoicePdfRenderer
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+INVOICE_EXPORT_MAX = 5000
+
+MANIFEST_COLUMNS = [
+    "file", "invoice_id", "invoice_number", "invoice_date", "client_name", "total",
+    "status", "verifactu_record_type", "verifactu_hash", "previous_hash", "pdf_sha256"
+]
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only, non-seekable sink for ZipFile that hands back what was written so far."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _entry_name(invoice_number: str, invoice_id: int, used: set) -> str:
+    safe_number = re.sub(r"[^A-Za-z0-9._-]+", "_", invoice_number or "") or str(invoice_id)
+    name = f"invoice_{safe_number}.pdf"
+    if name in used:
+        name = f"invoice_{safe_number}_{invoice_id}.pdf"
+    used.add(name)
+    return name
+
+
+def _zip_timestamp(value: datetime) -> Tuple[int, int, int, int, int, int]:
+    value = value or datetime.now()
+    return max(value, datetime(1980, 1, 1)).timetuple()[:6]
+
+
+async def stream_invoice_zip(
+    renderer: InvoicePdfRenderer,
+    jobs: List[Tuple[str, InvoicePdfData]],
+    manifest: Dict[int, dict]
+) -> AsyncIterator[bytes]:
+    """Stream a ZIP with one PDF per invoice followed by a CSV manifest.
+
+    PDFs are added in the order they finish rendering and each is flushed to
+    the client straight away, so only the PDFs in flight are held in memory.
+    PDFs are stored uncompressed since they are compressed already.
+    """
+    sink = _ZipStream()
+    used_names = set()
+    rows = []
+
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        async for data, pdf in renderer.iter_pdfs(jobs):
+            name = _entry_name(data.invoice_number, data.id, used_names)
+            archive.writestr(zipfile.ZipInfo(name, date_time=_zip_timestamp(data.invoice_date)), pdf)
+            rows.append({**manifest[data.id], "file": name, "pdf_sha256": hashlib.sha256(pdf).hexdigest()})
+            yield sink.drain()
+
+        rows.sort(key=lambda r: (r["invoice_date"], r["invoice_id"]))
+        manifest_buffer = io.StringIO()
+        writer = csv.DictWriter(manifest_buffer, fieldnames=MANIFEST_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+        archive.writestr(
+            zipfile.ZipInfo("manifest.csv", date_time=_zip_timestamp(datetime.now())),
+            manifest_buffer.getvalue().encode("utf-8"),
+            compress_type=zipfile.ZIP_DEFLATED
+        )
+
+    yield sink.drain()
+    logger.info(f"Exported {len(rows)} invoice PDFs")
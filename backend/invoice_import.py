@@ -0,0 +1,289 @@
+import os
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from database import User, Invoice, InvoiceItem, InvoiceVerifactuEvent, VerifactuChainRecord
+from verifactu import VerifactuService, VerifactuRecordData, VerifactuRecordType, VerifactuEventType
+from verifactu_events import VerifactuEventService
+from invoice_numbering import INVOICE_DEFAULT_SERIES, reserve_invoice_numbers
+from invoice_records import invoice_amounts, last_chain_hash
+from financials_cache import mark_financials_dirty
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+INVOICE_IMPORT_MAX = 20000
+INVOICE_IMPORT_CHUNK_SIZE = int(os.getenv("INVOICE_IMPORT_CHUNK_SIZE", "500"))
+
+
+@dataclass
+class ImportResult:
+    index: int
+    invoice_number: Optional[str]
+    status: str
+    id: Optional[int] = None
+    verifactu_hash: Optional[str] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class _PreparedInvoice:
+    index: int
+    invoice: Dict[str, Any]
+    items: List[Dict[str, Any]]
+    hash_input: str
+    event_data: Dict[str, Any]
+
+
+def _validate(invoices: Sequence, taken: set) -> Dict[int, str]:
+    """Errors by payload index for invoices that cannot be imported."""
+    errors = {}
+    seen = set()
+    for index, invoice in enumerate(invoices):
+        number = invoice.invoice_number
+        if number and number in taken:
+            errors[index] = f"Invoice number {number} already exists"
+        elif number and number in seen:
+            errors[index] = f"Duplicate invoice number {number} in import"
+        elif not invoice.items:
+            errors[index] = "Invoice has no items"
+        elif any(item.quantity <= 0 for item in invoice.items):
+            errors[index] = "Item quantities must be positive"
+        seen.add(number)
+    return errors
+
+
+def _existing_numbers(db: Session, user_id: int, numbers: List[str]) -> set:
+    rows = db.query(Invoice.invoice_number).filter(
+        Invoice.user_id == user_id,
+        Invoice.invoice_number.in_(numbers)
+    ).all()
+    return {number for (number,) in rows}
+
+
+def _assign_numbers(db: Session, user_id: int, invoices: Sequence) -> List[str]:
+    """Invoice numbers for a chunk, reserving one block per series for those sent without one."""
+    missing = {}
+    for invoice in invoices:
+        if not invoice.invoice_number:
+            series = invoice.series or INVOICE_DEFAULT_SERIES
+            missing[series] = missing.get(series, 0) + 1
+
+    blocks = {
+        series: iter(reserve_invoice_numbers(db, user_id, series, count))
+        for series, count in missing.items()
+    }
+    return [
+        invoice.invoice_number or next(blocks[invoice.series or INVOICE_DEFAULT_SERIES])
+        for invoice in invoices
+    ]
+
+
+def _prepare(
+    index: int,
+    invoice,
+    invoice_number: str,
+    user: User,
+    previous_hash: Optional[str],
+    created_at: datetime
+) -> _PreparedInvoice:
+    items, total, vat_amount = invoice_amounts(invoice.items)
+
+    record_data = VerifactuRecordData(
+        nif=user.nif or user.email,
+        document_number=invoice_number,
+        document_date=invoice.invoice_date.date() if isinstance(invoice.invoice_date, datetime) else invoice.invoice_date,
+        total_amount=total,
+        vat_amount=vat_amount,
+        vat_rate=21.0,
+        record_type=VerifactuRecordType.INVOICE_ISSUED,
+        recipient_name=invoice.client_name,
+    )
+    hash_result = VerifactuService.generate_hash(record_data, previous_hash)
+    verification_url, _ = VerifactuService.build_verification_url(record_data)
+
+    row = {
+        "user_id": user.id,
+        "business_name": invoice.business_name,
+        "registration_number": invoice.registration_number,
+        "business_address": invoice.business_address,
+        "city_region": invoice.city_region,
+        "representative": invoice.representative,
+        "department": invoice.department,
+        "client_name": invoice.client_name,
+        "client_address": invoice.client_address,
+        "client_contact": invoice.client_contact,
+        "reference_number": invoice.reference_number,
+        "invoice_number": invoice_number,
+        "invoice_date": invoice.invoice_date,
+        "service_description": invoice.service_description,
+        "payment_terms": invoice.payment_terms,
+        "total": total,
+        "status": "created",
+        "created_at": created_at,
+        "updated_at": created_at,
+        "is_deleted": False,
+        "verifactu_hash": hash_result.hash_value,
+        "previous_hash": previous_hash,
+        "verification_url": verification_url,
+        "verifactu_timestamp": hash_result.timestamp,
+        "verifactu_record_type": VerifactuRecordType.INVOICE_ISSUED.value,
+        "verifactu_submitted": False,
+    }
+
+    return _PreparedInvoice(
+        index=index,
+        invoice=row,
+        items=items,
+        hash_input=hash_result.hash_input,
+        event_data={
+            "invoice_number": invoice_number,
+            "total_amount": str(total),
+            "vat_amount": str(vat_amount),
+            "client_name": invoice.client_name,
+            "verification_url": verification_url,
+            "imported": True,
+        },
+    )
+
+
+def _insert_chunk(
+    db: Session,
+    user: User,
+    chunk: List[_PreparedInvoice],
+    ip_address: Optional[str],
+    user_agent: Optional[str]
+) -> List[int]:
+    invoice_ids = db.scalars(
+        insert(Invoice).returning(Invoice.id, sort_by_parameter_order=True),
+        [prepared.invoice for prepared in chunk]
+    ).all()
+
+    item_rows = []
+    event_rows = []
+    chain_rows = []
+    for invoice_id, prepared in zip(invoice_ids, chunk):
+        row = prepared.invoice
+        item_rows.extend({**item, "invoice_id": invoice_id} for item in prepared.items)
+
+        event_rows.append(VerifactuEventService.invoice_event_values(
+            user_id=user.id,
+            invoice_id=invoice_id,
+            event_type=VerifactuEventType.INVOICE_CREATED,
+            hash_after=row["verifactu_hash"],
+            hash_before=row["previous_hash"],
+            ip_address=ip_address,
+            user_agent=user_agent,
+            event_data=prepared.event_data,
+        ))
+        event_rows.append(VerifactuEventService.invoice_event_values(
+            user_id=user.id,
+            invoice_id=invoice_id,
+            event_type=VerifactuEventType.HASH_GENERATED,
+            hash_after=row["verifactu_hash"],
+            hash_before=row["previous_hash"],
+            ip_address=ip_address,
+            user_agent=user_agent,
+            event_data={"hash_input": prepared.hash_input, "algorithm": "SHA-256"},
+        ))
+
+        if user.nif:
+            chain_rows.append({
+                "nif": user.nif.upper().strip(),
+                "software_id": "01",
+                "invoice_number": row["invoice_number"],
+                "invoice_date": row["invoice_date"],
+                "invoice_type": row["verifactu_record_type"],
+                "hash_value": row["verifactu_hash"],
+                "previous_hash": row["previous_hash"],
+                "hash_input": prepared.hash_input,
+                "invoice_id": invoice_id,
+                "created_at": row["created_at"],
+            })
+
+    db.execute(insert(InvoiceItem), item_rows)
+    db.execute(insert(InvoiceVerifactuEvent), event_rows)
+    if chain_rows:
+        db.execute(insert(VerifactuChainRecord), chain_rows)
+
+    return invoice_ids
+
+
+def import_invoices(
+    db: Session,
+    user: User,
+    invoices: Sequence,
+    chunk_size: int = INVOICE_IMPORT_CHUNK_SIZE,
+    ip_address: Optional[str] = None,
+    user_agent: Optional[str] = None
+) -> List[ImportResult]:
+    """Import many invoices with their items, VeriFactu chain records and events.
+
+    Numbering is checked against the database in one query and the hash
+    chain is built in memory in payload order, continuing from the user's
+    last chained record. Invoices sent without a number get one from their series,
+    reserved a block at a time per chunk. Each chunk is written with bulk
+    inserts and committed as a single transaction; if a chunk fails, it is
+    rolled back (returning its reserved numbers) and the chain carries on
+    from the last committed hash, so invoices that were stored never point
+    at ones that were not.
+    """
+    numbers = [invoice.invoice_number for invoice in invoices if invoice.invoice_number]
+    errors = _validate(invoices, _existing_numbers(db, user.id, numbers))
+
+    results = [
+        ImportResult(index=index, invoice_number=invoice.invoice_number, status="error", error=errors[index])
+        if index in errors else
+        ImportResult(index=index, invoice_number=invoice.invoice_number, status="pending")
+        for index, invoice in enumerate(invoices)
+    ]
+    valid = [index for index in range(len(invoices)) if index not in errors]
+
+    previous_hash = last_chain_hash(db, user.id)
+    # created_at orders the chain, so keep it strictly increasing within the import
+    created_at = datetime.utcnow()
+
+    for start in range(0, len(valid), chunk_size):
+        chunk_indexes = valid[start:start + chunk_size]
+        chunk_start_hash = previous_hash
+        chunk = []
+
+        try:
+            chunk_numbers = _assign_numbers(db, user.id, [invoices[index] for index in chunk_indexes])
+            for index, invoice_number in zip(chunk_indexes, chunk_numbers):
+                created_at += timedelta(microseconds=1)
+                prepared = _prepare(index, invoices[index], invoice_number, user, previous_hash, created_at)
+                previous_hash = prepared.invoice["verifactu_hash"]
+                chunk.append(prepared)
+
+            invoice_ids = _insert_chunk(db, user, chunk, ip_address, user_agent)
+            mark_financials_dirty(db, user.id)
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            logger.error(f"Invoice import chunk starting at {chunk_indexes[0]} failed: {e}")
+            previous_hash = chunk_start_hash
+            for index in chunk_indexes:
+                result = results[index]
+                result.status = "error"
+                result.error = "Could not store this batch of invoices"
+            continue
+
+        for invoice_id, prepared in zip(invoice_ids, chunk):
+            result = results[prepared.index]
+            result.status = "created"
+            result.id = invoice_id
+            result.invoice_number = prepared.invoice["invoice_number"]
+            result.verifactu_hash = prepared.invoice["verifactu_hash"]
+
+    created = sum(1 for result in results if result.status == "created")
+    logger.info(f"Imported {created}/{len(invoices)} invoices for user {user.id}")
+
+    return results
@@ -0,0 +1,84 @@
+import os
+import re
+import logging
+from typing import List
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from database import Invoice, InvoiceNumberSequence
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+INVOICE_DEFAULT_SERIES = os.getenv("INVOICE_DEFAULT_SERIES", "F")
+INVOICE_NUMBER_DIGITS = 6
+SERIES_PATTERN = r"^[A-Za-z0-9]{1,10}$"
+
+
+def format_invoice_number(series: str, value: int) -> str:
+    return f"{series}-{value:0{INVOICE_NUMBER_DIGITS}d}"
+
+
+def _highest_used(db: Session, user_id: int, series: str) -> int:
+    """Highest number already issued in a series, so a new sequence starts after it."""
+    pattern = re.compile(rf"^{re.escape(series)}-(\d+)$")
+    rows = db.query(Invoice.invoice_number).filter(
+        Invoice.user_id == user_id,
+        Invoice.invoice_number.like(f"{series}-%")
+    ).all()
+    values = [int(match.group(1)) for (number,) in rows if (match := pattern.match(number))]
+    return max(values, default=0)
+
+
+def reserve_invoice_numbers(db: Session, user_id: int, series: str, count: int = 1) -> List[str]:
+    """Reserve `count` consecutive invoice numbers in a user's series.
+
+    The whole block costs one UPDATE ... RETURNING (plus an upsert the first
+    time a series is used). It runs in the caller's transaction: the
+    sequence row stays locked until that commits, which keeps numbering
+    correlative, and a rollback hands the block back instead of leaving a gap.
+    """
+    if count < 1:
+        return []
+
+    end = db.execute(
+        update(InvoiceNumberSequence)
+        .where(
+            InvoiceNumberSequence.user_id == user_id,
+            InvoiceNumberSequence.series == series
+        )
+        .values(next_value=InvoiceNumberSequence.next_value + count)
+        .returning(InvoiceNumberSequence.next_value)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+    if end is None:
+        start = _highest_used(db, user_id, series) + 1
+        stmt = insert(InvoiceNumberSequence).values(user_id=user_id, series=series, next_value=start + count)
+        end = db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[InvoiceNumberSequence.user_id, InvoiceNumberSequence.series],
+                set_={"next_value": InvoiceNumberSequence.next_value + count}
+            ).returning(InvoiceNumberSequence.next_value)
+        ).scalar()
+        logger.info(f"Started invoice series {series} for user {user_id} at {start}")
+
+    return [format_invoice_number(series, value) for value in range(end - count, end)]
+
+
+def resync_invoice_sequence(db: Session, user_id: int, series: str) -> None:
+    """Move a series past numbers that were issued by hand in its format."""
+    db.execute(
+        update(InvoiceNumberSequence)
+        .where(
+            InvoiceNumberSequence.user_id == user_id,
+            InvoiceNumberSequence.series == series
+        )
+        .values(next_value=func.greatest(
+            InvoiceNumberSequence.next_value, _highest_used(db, user_id, series) + 1
+        ))
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,308 @@
+import os
+import io
+import base64
+import asyncio
+import hashlib
+import tempfile
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional, Tuple, Iterable, AsyncIterator
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+from starlette.concurrency import run_in_threadpool
+
+from disk_cache import DiskLRUCache
+from qr_codes import render_qr
+from verifactu import VerifactuService
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "taxhelper_invoice_pdfs"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+
+# Bump when the layout changes so cached PDFs are not served with the old design
+PDF_RENDER_VERSION = "1"
+
+
+@dataclass
+class InvoicePdfItem:
+    description: str
+    quantity: Decimal
+    unit_price: Decimal
+    amount: Decimal
+
+
+@dataclass
+class InvoicePdfData:
+    """Plain copy of the invoice fields used by the PDF, safe to send to a worker process."""
+    id: int
+    business_name: str
+    invoice_number: str
+    invoice_date: datetime
+    client_name: str
+    client_address: Optional[str] = None
+    qr_code_data: Optional[str] = None
+    verification_url: Optional[str] = None
+    verifactu_hash: Optional[str] = None
+    items: List[InvoicePdfItem] = field(default_factory=list)
+
+
+def snapshot_invoice(invoice, items) -> InvoicePdfData:
+    return InvoicePdfData(
+        id=invoice.id,
+        business_name=invoice.business_name,
+        invoice_number=invoice.invoice_number,
+        invoice_date=invoice.invoice_date,
+        client_name=invoice.client_name,
+        client_address=invoice.client_address,
+        qr_code_data=invoice.qr_code_data,
+        verification_url=invoice.verification_url,
+        verifactu_hash=invoice.verifactu_hash,
+        items=[
+            InvoicePdfItem(
+                description=item.description,
+                quantity=item.quantity,
+                unit_price=item.unit_price,
+                amount=item.amount,
+            )
+            for item in items
+        ],
+    )
+
+
+def pdf_cache_key(invoice) -> str:
+    material = "|".join([
+        PDF_RENDER_VERSION,
+        str(invoice.id),
+        invoice.verifactu_hash or "",
+        invoice.updated_at.isoformat() if invoice.updated_at else "",
+    ])
+    return f"{invoice.id}-{hashlib.sha256(material.encode('utf-8')).hexdigest()[:32]}"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/") == etag for c in candidates)
+
+
+def generate_invoice_pdf(invoice, items):
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=20*mm, bottomMargin=20*mm)
+
+    styles = getSampleStyleSheet()
+
+    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=24, spaceAfter=12)
+    header_style = ParagraphStyle('Header', parent=styles['Normal'], fontSize=12, spaceAfter=6)
+    small_style = ParagraphStyle('Small', parent=styles['Normal'], fontSize=9)
+    verifactu_style = ParagraphStyle('Verifactu', parent=styles['Normal'], fontSize=10, textColor=colors.HexColor('#02B0C2'))
+    verifactu_legal_style = ParagraphStyle('VerifactuLegal', parent=styles['Normal'], fontSize=8, textColor=colors.HexColor('#666666'))
+
+    elements = []
+
+    elements.append(Paragraph(invoice.business_name, title_style))
+    elements.append(Paragraph(f"Invoice #{invoice.invoice_number}", header_style))
+    elements.append(Paragraph(f"Date: {invoice.invoice_date.strftime('%d/%m/%Y')}", small_style))
+    elements.append(Spacer(1, 20))
+
+    elements.append(Paragraph(f"<b>Client:</b> {invoice.client_name}", small_style))
+    if invoice.client_address:
+        elements.append(Paragraph(f"Address: {invoice.client_address}", small_style))
+    elements.append(Spacer(1, 20))
+
+    table_data = [['Description', 'Qty', 'Unit Price', 'Amount']]
+    for item in items:
+        table_data.append([
+            item.description,
+            f"{item.quantity:.2f}",
+            f"€{item.unit_price:.2f}",
+            f"€{item.amount:.2f}"
+        ])
+
+    subtotal = sum(float(item.amount) for item in items)
+    vat = subtotal * 0.21
+    total = subtotal + vat
+
+    table_data.append(['', '', 'Subtotal:', f"€{subtotal:.2f}"])
+    table_data.append(['', '', 'IVA (21%):', f"€{vat:.2f}"])
+    table_data.append(['', '', 'TOTAL:', f"€{total:.2f}"])
+
+    table = Table(table_data, colWidths=[90*mm, 20*mm, 30*mm, 30*mm])
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#02B0C2')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('GRID', (0, 0), (-1, -4), 1, colors.black),
+        ('FONTNAME', (2, -3), (3, -1), 'Helvetica-Bold'),
+    ]))
+    elements.append(table)
+    elements.append(Spacer(1, 20))
+
+    verification_url = getattr(invoice, 'verification_url', None)
+    if verification_url or getattr(invoice, 'qr_code_data', None):
+        elements.append(Spacer(1, 20))
+
+        verifactu_divider = Table([['']], colWidths=[170*mm])
+        verifactu_divider.setStyle(TableStyle([
+            ('LINEABOVE', (0, 0), (-1, -1), 1, colors.HexColor('#02B0C2')),
+        ]))
+        elements.append(verifactu_divider)
+        elements.append(Spacer(1, 10))
+
+        try:
+            if verification_url:
+                qr_image_data = render_qr(verification_url, "png")
+            else:
+                qr_image_data = base64.b64decode(invoice.qr_code_data)
+            qr_buffer = io.BytesIO(qr_image_data)
+            qr_image = Image(qr_buffer, width=25*mm, height=25*mm)
+
+            verifactu_badge = Paragraph("<b>VERI*FACTU</b>", verifactu_style)
+            verifactu_text = Paragraph(VerifactuService.get_legal_text("es"), verifactu_legal_style)
+
+            hash_display = ""
+            if hasattr(invoice, 'verifactu_hash') and invoice.verifactu_hash:
+                hash_display = f"Huella: {invoice.verifactu_hash[:16]}..."
+
+            hash_text = Paragraph(hash_display, verifactu_legal_style)
+
+            verifactu_content = Table([
+                [qr_image, Table([[verifactu_badge], [verifactu_text], [hash_text]], colWidths=[140*mm])]
+            ], colWidths=[30*mm, 140*mm])
+
+            verifactu_content.setStyle(TableStyle([
+                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+                ('LEFTPADDING', (1, 0), (1, 0), 10),
+            ]))
+
+            verifactu_box = Table([[verifactu_content]], colWidths=[170*mm])
+            verifactu_box.setStyle(TableStyle([
+                ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#02B0C2')),
+                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f0fafb')),
+                ('TOPPADDING', (0, 0), (-1, -1), 8),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+                ('LEFTPADDING', (0, 0), (-1, -1), 8),
+                ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+            ]))
+
+            elements.append(verifactu_box)
+
+        except Exception as e:
+            logger.error(f"Error generating VeriFactu section: {e}")
+            elements.append(Paragraph(
+                f"<b>VERI*FACTU Compliant</b> - {VerifactuService.get_legal_text('es')}",
+                verifactu_style
+            ))
+
+    doc.build(elements)
+    buffer.seek(0)
+    return buffer
+
+
+def render_invoice_pdf(data: InvoicePdfData) -> bytes:
+    return generate_invoice_pdf(data, data.items).getvalue()
+
+
+class InvoicePdfRenderer:
+    """Renders invoice PDFs in a process pool and keeps the results in a disk LRU."""
+
+    def __init__(self, cache: Optional[DiskLRUCache] = None, max_workers: int = PDF_RENDER_WORKERS):
+        self.cache = cache or DiskLRUCache(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES, suffix=".pdf")
+        self.max_workers = max_workers
+        self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn keeps worker processes free of the parent's DB connections and threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def cached_path(self, key: str) -> Optional[str]:
+        return self.cache.get_path(key)
+
+    async def render(self, key: str, data: InvoicePdfData) -> Tuple[Optional[str], bytes]:
+        """Render a PDF off the event loop and store it under key.
+
+        Returns the cached file path (None if it could not be stored) and the PDF bytes.
+        """
+        try:
+            pdf = await asyncio.get_running_loop().run_in_executor(self._get_pool(), render_invoice_pdf, data)
+        except BrokenProcessPool:
+            logger.error("PDF render pool is broken, rendering in a thread instead")
+            self._pool = None
+            pdf = await run_in_threadpool(render_invoice_pdf, data)
+
+        return self.cache.put(key, pdf), pdf
+
+    async def load_or_render(self, key: str, data: InvoicePdfData) -> bytes:
+        pdf = await run_in_threadpool(self.cache.get_bytes, key)
+        if pdf is None:
+            _, pdf = await self.render(key, data)
+        return pdf
+
+    async def iter_pdfs(
+        self, jobs: Iterable[Tuple[str, InvoicePdfData]], concurrency: Optional[int] = None
+    ) -> AsyncIterator[Tuple[InvoicePdfData, bytes]]:
+        """Yield (invoice, pdf) pairs in completion order.
+
+        At most `concurrency` invoices are loaded or rendered at a time, so a
+        large export never queues thousands of snapshots in the pool at once.
+        """
+        concurrency = concurrency or self.max_workers * 2
+        queue = iter(jobs)
+        pending = set()
+
+        async def run(key: str, data: InvoicePdfData):
+            return data, await self.load_or_render(key, data)
+
+        def fill():
+            for key, data in queue:
+                pending.add(asyncio.ensure_future(run(key, data)))
+                if len(pending) >= concurrency:
+                    return
+
+        fill()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.discard(task)
+                    yield task.result()
+                fill()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+_invoice_pdf_renderer = None
+
+def get_invoice_pdf_renderer() -> InvoicePdfRenderer:
+    global _invoice_pdf_renderer
+    if _invoice_pdf_renderer is None:
+        _invoice_pdf_renderer = InvoicePdfRenderer()
+    return _invoice_pdf_renderer
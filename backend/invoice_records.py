@@ -0,0 +1,274 @@
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import desc
+from sqlalchemy.orm import Session
+
+from database import (
+    User, Invoice, InvoiceItem, InvoiceCancellation, VerifactuChainRecord, INVOICE_STATUS_CANCELLED
+)
+from verifactu import VerifactuService, VerifactuRecordData, VerifactuRecordType, VerifactuEventType
+from verifactu_events import VerifactuEventService
+from financials_cache import mark_financials_dirty
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+VAT_RATE = Decimal("0.21")
+CENT = Decimal("0.01")
+
+CANCELLATION_RECORD_TYPE = "AN"
+
+
+def invoice_amounts(items) -> Tuple[List[Dict[str, Any]], Decimal, Decimal]:
+    """Item rows, total and VAT for the items of an InvoiceCreate, in Decimal."""
+    rows = []
+    for item in items:
+        quantity = Decimal(str(item.quantity))
+        unit_price = Decimal(str(item.unit_price))
+        rows.append({
+            "description": item.description,
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "amount": (quantity * unit_price).quantize(CENT),
+        })
+    total = sum((row["amount"] for row in rows), Decimal("0"))
+    return rows, total, (total * VAT_RATE).quantize(CENT)
+
+
+def last_chain_hash(db: Session, user_id: int) -> Optional[str]:
+    """Huella of the user's most recent record, whether an invoice (alta) or a cancellation."""
+    last_invoice = db.query(Invoice.verifactu_hash, Invoice.created_at).filter(
+        Invoice.user_id == user_id,
+        Invoice.verifactu_hash.isnot(None)
+    ).order_by(desc(Invoice.created_at)).first()
+
+    last_cancellation = db.query(InvoiceCancellation.hash_value, InvoiceCancellation.created_at).filter(
+        InvoiceCancellation.user_id == user_id
+    ).order_by(desc(InvoiceCancellation.created_at)).first()
+
+    if last_cancellation and (not last_invoice or last_cancellation.created_at > last_invoice.created_at):
+        return last_cancellation.hash_value
+    return last_invoice.verifactu_hash if last_invoice else None
+
+
+def _document_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _add_chain_record(db: Session, user: User, **values) -> None:
+    if user.nif:
+        db.add(VerifactuChainRecord(nif=user.nif.upper().strip(), software_id="01", **values))
+
+
+def issue_invoice(
+    db: Session,
+    user: User,
+    invoice_data,
+    invoice_number: str,
+    record_type: VerifactuRecordType,
+    client_ip: Optional[str] = None,
+    user_agent: Optional[str] = None,
+    rectifies: Optional[Invoice] = None,
+    rectification_reason: Optional[str] = None
+) -> Invoice:
+    """Chain and stage a new invoice (F1, or R1-R5 when it rectifies another).
+
+    Meant to run inside unit_of_work: it flushes once for the invoice id and
+    leaves the events to the caller's commit.
+    """
+    item_rows, total, vat_amount = invoice_amounts(invoice_data.items)
+    previous_hash = last_chain_hash(db, user.id)
+
+    record_data = VerifactuRecordData(
+        nif=user.nif or user.email,
+        document_number=invoice_number,
+        document_date=_document_date(invoice_data.invoice_date),
+        total_amount=total,
+        vat_amount=vat_amount,
+        vat_rate=21.0,
+        record_type=record_type,
+        recipient_name=invoice_data.client_name,
+    )
+
+    hash_result = VerifactuService.generate_hash(record_data, previous_hash)
+    # The QR image is rendered on demand by GET /invoices/{id}/qr
+    verification_url, _ = VerifactuService.build_verification_url(record_data)
+
+    invoice = Invoice(
+        user_id=user.id,
+        business_name=invoice_data.business_name,
+        registration_number=invoice_data.registration_number,
+        business_address=invoice_data.business_address,
+        city_region=invoice_data.city_region,
+        representative=invoice_data.representative,
+        department=invoice_data.department,
+        client_name=invoice_data.client_name,
+        client_address=invoice_data.client_address,
+        client_contact=invoice_data.client_contact,
+        reference_number=invoice_data.reference_number,
+        invoice_number=invoice_number,
+        invoice_date=invoice_data.invoice_date,
+        service_description=invoice_data.service_description,
+        payment_terms=invoice_data.payment_terms,
+        total=total,
+        status="created",
+        verifactu_hash=hash_result.hash_value,
+        previous_hash=previous_hash,
+        verification_url=verification_url,
+        verifactu_timestamp=hash_result.timestamp,
+        verifactu_record_type=record_type.value,
+        verifactu_submitted=False,
+        rectified_invoice_id=rectifies.id if rectifies else None,
+        rectification_reason=rectification_reason,
+    )
+    invoice.items = [InvoiceItem(**row) for row in item_rows]
+
+    db.add(invoice)
+    mark_financials_dirty(db, user.id)
+    # One flush inserts the invoice (id via RETURNING) and its items; the
+    # unique constraint on (user_id, invoice_number) rejects a taken number here
+    db.flush()
+
+    _add_chain_record(
+        db, user,
+        invoice_number=invoice_number,
+        invoice_date=invoice.invoice_date,
+        invoice_type=record_type.value,
+        hash_value=hash_result.hash_value,
+        previous_hash=previous_hash,
+        hash_input=hash_result.hash_input,
+        invoice_id=invoice.id,
+    )
+
+    event_data = {
+        "invoice_number": invoice_number,
+        "total_amount": str(total),
+        "vat_amount": str(vat_amount),
+        "client_name": invoice_data.client_name,
+        "verification_url": verification_url
+    }
+    if rectifies:
+        event_data.update({
+            "record_type": record_type.value,
+            "rectified_invoice_number": rectifies.invoice_number,
+            "reason": rectification_reason,
+        })
+
+    VerifactuEventService.log_invoice_event(
+        db=db,
+        user_id=user.id,
+        invoice_id=invoice.id,
+        event_type=VerifactuEventType.INVOICE_CREATED,
+        hash_after=hash_result.hash_value,
+        hash_before=previous_hash,
+        ip_address=client_ip,
+        user_agent=user_agent,
+        event_data=event_data
+    )
+
+    VerifactuEventService.log_invoice_event(
+        db=db,
+        user_id=user.id,
+        invoice_id=invoice.id,
+        event_type=VerifactuEventType.HASH_GENERATED,
+        hash_after=hash_result.hash_value,
+        hash_before=previous_hash,
+        ip_address=client_ip,
+        user_agent=user_agent,
+        event_data={
+            "hash_input": hash_result.hash_input,
+            "algorithm": "SHA-256"
+        }
+    )
+
+    if rectifies:
+        VerifactuEventService.log_invoice_event(
+            db=db,
+            user_id=user.id,
+            invoice_id=rectifies.id,
+            event_type=VerifactuEventType.INVOICE_CORRECTED,
+            hash_after=hash_result.hash_value,
+            hash_before=rectifies.verifactu_hash,
+            ip_address=client_ip,
+            user_agent=user_agent,
+            event_data={
+                "rectificativa_id": invoice.id,
+                "rectificativa_number": invoice_number,
+                "record_type": record_type.value,
+                "reason": rectification_reason
+            }
+        )
+
+    return invoice
+
+
+def cancel_invoice(
+    db: Session,
+    user: User,
+    invoice: Invoice,
+    reason: Optional[str] = None,
+    client_ip: Optional[str] = None,
+    user_agent: Optional[str] = None
+) -> InvoiceCancellation:
+    """Append a RegistroAnulacion for an invoice and mark it cancelled.
+
+    The invoice, its items and its events are kept; only its status
+    changes. Meant to run inside unit_of_work.
+    """
+    previous_hash = last_chain_hash(db, user.id)
+
+    hash_result = VerifactuService.generate_cancellation_hash(
+        user.nif or user.email,
+        invoice.invoice_number,
+        _document_date(invoice.invoice_date),
+        previous_hash
+    )
+
+    cancellation = InvoiceCancellation(
+        user_id=user.id,
+        invoice_id=invoice.id,
+        reason=reason,
+        hash_value=hash_result.hash_value,
+        previous_hash=previous_hash,
+        hash_input=hash_result.hash_input,
+        verifactu_timestamp=hash_result.timestamp,
+    )
+    db.add(cancellation)
+    invoice.status = INVOICE_STATUS_CANCELLED
+    mark_financials_dirty(db, user.id)
+
+    _add_chain_record(
+        db, user,
+        invoice_number=invoice.invoice_number,
+        invoice_date=invoice.invoice_date,
+        invoice_type=CANCELLATION_RECORD_TYPE,
+        hash_value=hash_result.hash_value,
+        previous_hash=previous_hash,
+        hash_input=hash_result.hash_input,
+        invoice_id=invoice.id,
+    )
+
+    VerifactuEventService.log_invoice_event(
+        db=db,
+        user_id=user.id,
+        invoice_id=invoice.id,
+        event_type=VerifactuEventType.INVOICE_CANCELLED,
+        hash_after=hash_result.hash_value,
+        hash_before=previous_hash,
+        ip_address=client_ip,
+        user_agent=user_agent,
+        event_data={
+            "invoice_number": invoice.invoice_number,
+            "total_amount": str(invoice.total),
+            "reason": reason,
+            "hash_input": hash_result.hash_input
+        }
+    )
+
+    logger.info(f"Invoice {invoice.invoice_number} cancelled with hash: {hash_result.hash_value[:16]}...")
+
+    return cancellation
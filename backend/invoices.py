@@ -1,34 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request, Query
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import desc, func, tuple_
+from sqlalchemy.exc import IntegrityError
+from pydantic import BaseModel, Field
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
 import tempfile
-import io
 import os
-import base64
 import logging
 
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import mm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.enums import TA_RIGHT, TA_CENTER
-
-from database import get_db, User, Invoice, InvoiceItem, InvoiceVerifactuEvent
+from database import (
+    get_db, unit_of_work, is_unique_violation, User, Invoice, InvoiceItem, InvoiceVerifactuEvent,
+    INVOICE_STATUS_CANCELLED
+)
 from auth import get_current_user
+from pagination import encode_cursor, decode_cursor, parse_date_range
 
-from verifactu import (
-    VerifactuService,
-    VerifactuRecordData,
-    VerifactuRecordType,
-    VerifactuEventType,
-)
-from verifactu_events import VerifactuEventService
+from verifactu import VerifactuService, VerifactuRecordType
+from invoice_pdf import get_invoice_pdf_renderer, pdf_cache_key, snapshot_invoice, etag_matches
+from invoice_export import INVOICE_EXPORT_MAX, stream_invoice_zip
+from qr_codes import QR_MEDIA_TYPES, render_qr, qr_etag
+from invoice_numbering import INVOICE_DEFAULT_SERIES, SERIES_PATTERN, reserve_invoice_numbers, resync_invoice_sequence
+from invoice_import import INVOICE_IMPORT_MAX, INVOICE_IMPORT_CHUNK_SIZE, import_invoices
+from financials_cache import mark_financials_dirty
+from invoice_records import issue_invoice, cancel_invoice
 
 try:
     from docstrange import DocumentExtractor
@@ -69,7 +67,9 @@ class InvoiceCreate(BaseModel):
     client_contact: Optional[str] = None
     reference_number: Optional[str] = None
 
-    invoice_number: str
+    # Leave invoice_number empty to take the next number of `series`
+    invoice_number: Optional[str] = Field(default=None, max_length=50)
+    series: Optional[str] = Field(default=None, pattern=SERIES_PATTERN)
     invoice_date: datetime
     
     service_description: Optional[str] = None
@@ -78,6 +78,25 @@ class InvoiceCreate(BaseModel):
     items: List[InvoiceItemCreate]
 
 
+RECTIFICATIVA_TYPES = {
+    VerifactuRecordType.RECTIFICATIVA_R1,
+    VerifactuRecordType.RECTIFICATIVA_R2,
+    VerifactuRecordType.RECTIFICATIVA_R3,
+    VerifactuRecordType.RECTIFICATIVA_R4,
+    VerifactuRecordType.RECTIFICATIVA_R5,
+}
+
+
+class InvoiceRectificationCreate(BaseModel):
+    record_type: VerifactuRecordType = VerifactuRecordType.RECTIFICATIVA_R4
+    reason: str = Field(min_length=1)
+    # Correction lines (por diferencias), negative amounts reduce the original
+    items: List[InvoiceItemCreate] = Field(min_length=1)
+    invoice_number: Optional[str] = Field(default=None, max_length=50)
+    series: str = Field(default="R", pattern=SERIES_PATTERN)
+    invoice_date: Optional[datetime] = None
+
+
 class InvoiceResponse(BaseModel):
     id: int
     invoice_number: str
@@ -89,6 +108,8 @@ class InvoiceResponse(BaseModel):
     created_at: datetime
     verifactu_hash: Optional[str] = None
     verifactu_submitted: bool = False
+    verifactu_record_type: Optional[str] = None
+    rectified_invoice_id: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -117,7 +138,12 @@ class InvoiceDetailResponse(BaseModel):
     verifactu_hash: Optional[str] = None
     verifactu_submitted: bool = False
     qr_code_base64: Optional[str] = None
+    qr_code_url: Optional[str] = None
+    verification_url: Optional[str] = None
     verifactu_legal_text: Optional[str] = None
+    verifactu_record_type: Optional[str] = None
+    rectified_invoice_id: Optional[int] = None
+    rectification_reason: Optional[str] = None
     
     class Config:
         from_attributes = True
@@ -133,6 +159,26 @@ class VerifactuEventResponse(BaseModel):
     ip_address: Optional[str]
 
 
+class InvoiceImportRequest(BaseModel):
+    invoices: List[InvoiceCreate]
+    chunk_size: int = Field(default=INVOICE_IMPORT_CHUNK_SIZE, ge=1, le=5000)
+
+
+class InvoiceImportResult(BaseModel):
+    index: int
+    invoice_number: Optional[str] = None
+    status: str
+    id: Optional[int] = None
+    verifactu_hash: Optional[str] = None
+    error: Optional[str] = None
+
+
+class InvoiceImportResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[InvoiceImportResult]
+
+
 class UploadIncomeResponse(BaseModel):
     invoice_id: int
     amount: float
@@ -145,6 +191,42 @@ def get_client_info(request: Request) -> tuple[Optional[str], Optional[str]]:
     user_agent = request.headers.get("user-agent", "")[:500]
     return client_ip, user_agent
 
+def _issue_invoice(
+    db: Session,
+    current_user: User,
+    invoice_data: InvoiceCreate,
+    record_type: VerifactuRecordType,
+    client_ip: Optional[str],
+    user_agent: Optional[str],
+    rectifies: Optional[Invoice] = None,
+    rectification_reason: Optional[str] = None
+) -> Invoice:
+    series = invoice_data.series or INVOICE_DEFAULT_SERIES
+    invoice_number = invoice_data.invoice_number
+    try:
+        with unit_of_work(db):
+            if not invoice_number:
+                invoice_number = reserve_invoice_numbers(db, current_user.id, series)[0]
+            return issue_invoice(
+                db, current_user, invoice_data, invoice_number, record_type,
+                client_ip, user_agent, rectifies, rectification_reason
+            )
+    except IntegrityError as e:
+        if not is_unique_violation(e, "uq_invoices_user_invoice_number"):
+            raise
+        if not invoice_data.invoice_number:
+            # A number was entered by hand ahead of the sequence; move past it
+            with unit_of_work(db):
+                resync_invoice_sequence(db, current_user.id, series)
+            raise HTTPException(
+                status_code=409,
+                detail=f"Invoice number {invoice_number} was already taken, please retry"
+            )
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invoice number {invoice_number} already exists"
+        )
+
 @router.post("/", response_model=InvoiceResponse)
 async def create_invoice(
     invoice_data: InvoiceCreate,
@@ -152,136 +234,164 @@ async def create_invoice(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    existing = db.query(Invoice).filter(
-        Invoice.user_id == current_user.id,
-        Invoice.invoice_number == invoice_data.invoice_number
-    ).first()
-    
-    if existing:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invoice number {invoice_data.invoice_number} already exists"
-        )
-    
-    total = sum(item.quantity * item.unit_price for item in invoice_data.items)
-    vat_amount = total * Decimal("0.21")
+    client_ip, user_agent = get_client_info(request)
     
-    last_invoice = db.query(Invoice).filter(
-        Invoice.user_id == current_user.id,
-        Invoice.verifactu_hash.isnot(None)
-    ).order_by(desc(Invoice.created_at)).first()
-    
-    previous_hash = last_invoice.verifactu_hash if last_invoice else None
-    
-    record_data = VerifactuRecordData(
-        nif=current_user.nif or current_user.email,
-        document_number=invoice_data.invoice_number,
-        document_date=invoice_data.invoice_date.date() if isinstance(invoice_data.invoice_date, datetime) else invoice_data.invoice_date,
-        total_amount=Decimal(str(total)),
-        vat_amount=vat_amount,
-        vat_rate=21.0,
-        record_type=VerifactuRecordType.INVOICE_ISSUED,
-        recipient_name=invoice_data.client_name,
+    db_invoice = _issue_invoice(
+        db, current_user, invoice_data, VerifactuRecordType.INVOICE_ISSUED, client_ip, user_agent
     )
     
-    hash_result = VerifactuService.generate_hash(record_data, previous_hash)
-    qr_result = VerifactuService.generate_qr_code(record_data, hash_result.hash_value)
-    
-    db_invoice = Invoice(
-        user_id=current_user.id,
-        business_name=invoice_data.business_name,
-        registration_number=invoice_data.registration_number,
-        business_address=invoice_data.business_address,
-        city_region=invoice_data.city_region,
-        representative=invoice_data.representative,
-        department=invoice_data.department,
-        client_name=invoice_data.client_name,
-        client_address=invoice_data.client_address,
-        client_contact=invoice_data.client_contact,
-        reference_number=invoice_data.reference_number,
-        invoice_number=invoice_data.invoice_number,
-        invoice_date=invoice_data.invoice_date,
-        service_description=invoice_data.service_description,
-        payment_terms=invoice_data.payment_terms,
-        total=total,
-        status="created",
-        verifactu_hash=hash_result.hash_value,
-        previous_hash=previous_hash,
-        qr_code_data=qr_result.qr_base64,
-        verifactu_timestamp=hash_result.timestamp,
-        verifactu_record_type=VerifactuRecordType.INVOICE_ISSUED.value,
-        verifactu_submitted=False,
-    )
+    logger.info(f"Invoice {db_invoice.invoice_number} created with VeriFactu hash: {db_invoice.verifactu_hash[:16]}...")
     
-    db.add(db_invoice)
-    db.commit()
-    db.refresh(db_invoice)
-    
-    for item in invoice_data.items:
-        db_item = InvoiceItem(
-            invoice_id=db_invoice.id,
-            description=item.description,
-            quantity=item.quantity,
-            unit_price=item.unit_price,
-            amount=item.quantity * item.unit_price
+    return db_invoice
+
+
+@router.post("/import", response_model=InvoiceImportResponse)
+async def import_invoices_bulk(
+    payload: InvoiceImportRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    if not payload.invoices:
+        raise HTTPException(status_code=400, detail="No invoices to import")
+    if len(payload.invoices) > INVOICE_IMPORT_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Import is limited to {INVOICE_IMPORT_MAX} invoices per request"
         )
-        db.add(db_item)
     
     client_ip, user_agent = get_client_info(request)
     
-    VerifactuEventService.log_invoice_event(
-        db=db,
-        user_id=current_user.id,
-        invoice_id=db_invoice.id,
-        event_type=VerifactuEventType.INVOICE_CREATED,
-        hash_after=hash_result.hash_value,
-        hash_before=previous_hash,
-        ip_address=client_ip,
-        user_agent=user_agent,
-        event_data={
-            "invoice_number": invoice_data.invoice_number,
-            "total_amount": str(total),
-            "vat_amount": str(vat_amount),
-            "client_name": invoice_data.client_name,
-            "qr_generated": True,
-            "verification_url": qr_result.verification_url
-        }
+    results = await run_in_threadpool(
+        import_invoices,
+        db,
+        current_user,
+        payload.invoices,
+        payload.chunk_size,
+        client_ip,
+        user_agent,
     )
     
-    VerifactuEventService.log_invoice_event(
-        db=db,
-        user_id=current_user.id,
-        invoice_id=db_invoice.id,
-        event_type=VerifactuEventType.HASH_GENERATED,
-        hash_after=hash_result.hash_value,
-        hash_before=previous_hash,
-        ip_address=client_ip,
-        user_agent=user_agent,
-        event_data={
-            "hash_input": hash_result.hash_input,
-            "algorithm": "SHA-256"
-        }
+    created = sum(1 for result in results if result.status == "created")
+    return InvoiceImportResponse(
+        created=created,
+        failed=len(results) - created,
+        results=[InvoiceImportResult(**vars(result)) for result in results]
     )
-    
-    db.commit()
-    
-    logger.info(f"Invoice {db_invoice.invoice_number} created with VeriFactu hash: {hash_result.hash_value[:16]}...")
-    
-    return db_invoice
+
+
+INVOICE_PAGE_SIZE = 50
+INVOICE_MAX_PAGE_SIZE = 500
+INVOICE_LIST_COLUMNS = (
+    Invoice.id, Invoice.invoice_number, Invoice.invoice_date, Invoice.business_name,
+    Invoice.client_name, Invoice.total, Invoice.status, Invoice.created_at,
+    Invoice.verifactu_hash, Invoice.verifactu_submitted, Invoice.verifactu_record_type,
+    Invoice.rectified_invoice_id,
+)
 
 
 @router.get("/", response_model=List[InvoiceResponse])
 async def get_invoices(
+    response: Response,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(INVOICE_PAGE_SIZE, ge=1, le=INVOICE_MAX_PAGE_SIZE),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    invoices = db.query(Invoice).filter(
+    # Only the columns InvoiceResponse needs; qr_code_data, verifactu_xml and the long text fields stay in the DB
+    query = db.query(Invoice).options(load_only(*INVOICE_LIST_COLUMNS)).filter(
         Invoice.user_id == current_user.id
-    ).order_by(desc(Invoice.created_at)).all()
+    )
+
+    start, end = parse_date_range(date_from, date_to)
+    if start:
+        query = query.filter(Invoice.invoice_date >= start)
+    if end:
+        query = query.filter(Invoice.invoice_date < end)
+    if status:
+        query = query.filter(Invoice.status == status)
+    else:
+        # Matches the partial index ix_invoices_user_created_id_active
+        query = query.filter(Invoice.status != INVOICE_STATUS_CANCELLED)
+
+    if not cursor:
+        # Totals cover every matching invoice, not just this page, so they are sent with the first page
+        count, total = query.with_entities(
+            func.count(Invoice.id), func.coalesce(func.sum(Invoice.total), 0)
+        ).one()
+        response.headers["X-Total-Count"] = str(count)
+        response.headers["X-Total-Amount"] = str(total)
+
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        query = query.filter(tuple_(Invoice.created_at, Invoice.id) < (cursor_created_at, cursor_id))
+
+    invoices = query.order_by(desc(Invoice.created_at), desc(Invoice.id)).limit(limit + 1).all()
+
+    if len(invoices) > limit:
+        invoices = invoices[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(invoices[-1].created_at, invoices[-1].id)
     
     return invoices
 
 
+@router.get("/export")
+async def export_invoices(
+    date_from: str,
+    date_to: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    start, end = parse_date_range(date_from, date_to)
+    if start is None or end is None:
+        raise HTTPException(status_code=400, detail="date_from and date_to must be ISO dates")
+
+    invoices = db.query(Invoice).filter(
+        Invoice.user_id == current_user.id,
+        Invoice.is_deleted == False,
+        Invoice.invoice_date >= start,
+        Invoice.invoice_date < end
+    ).order_by(Invoice.invoice_date, Invoice.id).limit(INVOICE_EXPORT_MAX + 1).all()
+
+    if not invoices:
+        raise HTTPException(status_code=404, detail="No invoices in this period")
+    if len(invoices) > INVOICE_EXPORT_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many invoices in this period (max {INVOICE_EXPORT_MAX}), please use a shorter range"
+        )
+
+    items_by_invoice = {}
+    for item in db.query(InvoiceItem).filter(InvoiceItem.invoice_id.in_([i.id for i in invoices])):
+        items_by_invoice.setdefault(item.invoice_id, []).append(item)
+
+    jobs = []
+    manifest = {}
+    for invoice in invoices:
+        jobs.append((pdf_cache_key(invoice), snapshot_invoice(invoice, items_by_invoice.get(invoice.id, []))))
+        manifest[invoice.id] = {
+            "invoice_id": invoice.id,
+            "invoice_number": invoice.invoice_number,
+            "invoice_date": invoice.invoice_date.isoformat(),
+            "client_name": invoice.client_name,
+            "total": str(invoice.total),
+            "status": invoice.status,
+            "verifactu_record_type": invoice.verifactu_record_type,
+            "verifactu_hash": invoice.verifactu_hash or "",
+            "previous_hash": invoice.previous_hash or "",
+        }
+
+    filename = f"invoices_{start:%Y%m%d}_{(end - timedelta(microseconds=1)):%Y%m%d}.zip"
+    return StreamingResponse(
+        stream_invoice_zip(get_invoice_pdf_renderer(), jobs, manifest),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
 @router.get("/{invoice_id}", response_model=InvoiceDetailResponse)
 async def get_invoice(
     invoice_id: int,
@@ -330,7 +440,12 @@ async def get_invoice(
         verifactu_hash=invoice.verifactu_hash,
         verifactu_submitted=invoice.verifactu_submitted,
         qr_code_base64=invoice.qr_code_data,
-        verifactu_legal_text=VerifactuService.get_legal_text("es")
+        qr_code_url=f"/invoices/{invoice.id}/qr" if invoice.verification_url else None,
+        verification_url=invoice.verification_url,
+        verifactu_legal_text=VerifactuService.get_legal_text("es"),
+        verifactu_record_type=invoice.verifactu_record_type,
+        rectified_invoice_id=invoice.rectified_invoice_id,
+        rectification_reason=invoice.rectification_reason
     )
 
 
@@ -338,9 +453,11 @@ async def get_invoice(
 async def delete_invoice(
     invoice_id: int,
     request: Request,
+    reason: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    """Cancel an invoice with a RegistroAnulacion; the invoice itself is kept."""
     invoice = db.query(Invoice).filter(
         Invoice.id == invoice_id,
         Invoice.user_id == current_user.id
@@ -349,32 +466,86 @@ async def delete_invoice(
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
+    if invoice.status == INVOICE_STATUS_CANCELLED:
+        raise HTTPException(status_code=400, detail="Invoice is already cancelled")
+    
     client_ip, user_agent = get_client_info(request)
     
-    VerifactuEventService.log_invoice_event(
-        db=db,
-        user_id=current_user.id,
-        invoice_id=invoice.id,
-        event_type=VerifactuEventType.INVOICE_CANCELLED,
-        hash_after=invoice.verifactu_hash,
-        hash_before=invoice.verifactu_hash,
-        ip_address=client_ip,
-        user_agent=user_agent,
-        event_data={
-            "invoice_number": invoice.invoice_number,
-            "total_amount": str(invoice.total),
-            "reason": "User requested deletion"
-        }
+    try:
+        with unit_of_work(db):
+            cancellation = cancel_invoice(
+                db, current_user, invoice, reason or "User requested deletion", client_ip, user_agent
+            )
+    except IntegrityError as e:
+        if not is_unique_violation(e, "invoice_cancellations_invoice_id_key"):
+            raise
+        raise HTTPException(status_code=400, detail="Invoice is already cancelled")
+    
+    return {
+        "message": "Invoice cancelled successfully",
+        "cancellation_hash": cancellation.hash_value
+    }
+
+
+@router.post("/{invoice_id}/rectify", response_model=InvoiceResponse)
+async def rectify_invoice(
+    invoice_id: int,
+    payload: InvoiceRectificationCreate,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Issue a rectificativa (R1-R5) for an invoice; its items are the corrections."""
+    original = db.query(Invoice).filter(
+        Invoice.id == invoice_id,
+        Invoice.user_id == current_user.id
+    ).first()
+    
+    if not original:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    
+    if original.status == INVOICE_STATUS_CANCELLED:
+        raise HTTPException(status_code=400, detail="Cancelled invoices cannot be rectified")
+    
+    if payload.record_type not in RECTIFICATIVA_TYPES:
+        raise HTTPException(status_code=400, detail="record_type must be one of R1, R2, R3, R4, R5")
+    
+    is_simplified = original.verifactu_record_type == VerifactuRecordType.INVOICE_SIMPLIFIED.value
+    if (payload.record_type == VerifactuRecordType.RECTIFICATIVA_R5) != is_simplified:
+        raise HTTPException(
+            status_code=400,
+            detail="R5 rectifies simplified invoices only, use R1-R4 for complete invoices"
+        )
+    
+    invoice_data = InvoiceCreate(
+        business_name=original.business_name,
+        registration_number=original.registration_number,
+        business_address=original.business_address,
+        city_region=original.city_region,
+        representative=original.representative,
+        department=original.department,
+        client_name=original.client_name,
+        client_address=original.client_address,
+        client_contact=original.client_contact,
+        reference_number=original.reference_number,
+        invoice_number=payload.invoice_number,
+        series=payload.series,
+        invoice_date=payload.invoice_date or datetime.now(),
+        service_description=original.service_description,
+        payment_terms=original.payment_terms,
+        items=payload.items,
     )
     
-    db.query(InvoiceItem).filter(InvoiceItem.invoice_id == invoice_id).delete()
+    client_ip, user_agent = get_client_info(request)
     
-    db.delete(invoice)
-    db.commit()
+    rectificativa = _issue_invoice(
+        db, current_user, invoice_data, payload.record_type, client_ip, user_agent,
+        rectifies=original, rectification_reason=payload.reason
+    )
     
-    logger.info(f"Invoice {invoice.invoice_number} cancelled and deleted")
+    logger.info(f"Invoice {original.invoice_number} rectified by {rectificativa.invoice_number} ({payload.record_type.value})")
     
-    return {"message": "Invoice deleted successfully"}
+    return rectificativa
 
 
 @router.get("/{invoice_id}/verifactu-events", response_model=List[VerifactuEventResponse])
@@ -409,9 +580,38 @@ async def get_invoice_verifactu_events(
         for e in events
     ]
 
+@router.get("/{invoice_id}/qr")
+async def get_invoice_qr(
+    invoice_id: int,
+    request: Request,
+    format: str = Query("svg", pattern="^(svg|png)$"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    verification_url = db.query(Invoice.verification_url).filter(
+        Invoice.id == invoice_id,
+        Invoice.user_id == current_user.id
+    ).scalar()
+    
+    if not verification_url:
+        raise HTTPException(status_code=404, detail="Invoice QR not found")
+    
+    etag = qr_etag(verification_url, format)
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    return Response(
+        content=await run_in_threadpool(render_qr, verification_url, format),
+        media_type=QR_MEDIA_TYPES[format],
+        headers=headers
+    )
+
+
 @router.get("/{invoice_id}/pdf")
 async def download_invoice_pdf(
     invoice_id: int,
+    request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -423,131 +623,27 @@ async def download_invoice_pdf(
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    items = db.query(InvoiceItem).filter(InvoiceItem.invoice_id == invoice_id).all()
-    
-    pdf_buffer = generate_invoice_pdf(invoice, items)
-    
+    cache_key = pdf_cache_key(invoice)
+    etag = f'"{cache_key}"'
     filename = f"invoice_{invoice.invoice_number}.pdf"
-    
-    return StreamingResponse(
-        pdf_buffer,
-        media_type="application/pdf",
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}"
-        }
-    )
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    renderer = get_invoice_pdf_renderer()
+    pdf_path = renderer.cached_path(cache_key)
+    if pdf_path is None:
+        items = db.query(InvoiceItem).filter(InvoiceItem.invoice_id == invoice_id).all()
+        pdf_path, pdf = await renderer.render(cache_key, snapshot_invoice(invoice, items))
+        if pdf_path is None:
+            return Response(
+                content=pdf,
+                media_type="application/pdf",
+                headers={**headers, "Content-Disposition": f"attachment; filename={filename}"}
+            )
 
-def generate_invoice_pdf(invoice, items):
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=20*mm, bottomMargin=20*mm)
-    
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=24, spaceAfter=12)
-    header_style = ParagraphStyle('Header', parent=styles['Normal'], fontSize=12, spaceAfter=6)
-    small_style = ParagraphStyle('Small', parent=styles['Normal'], fontSize=9)
-    verifactu_style = ParagraphStyle('Verifactu', parent=styles['Normal'], fontSize=10, textColor=colors.HexColor('#02B0C2'))
-    verifactu_legal_style = ParagraphStyle('VerifactuLegal', parent=styles['Normal'], fontSize=8, textColor=colors.HexColor('#666666'))
-    
-    elements = []
-    
-    elements.append(Paragraph(invoice.business_name, title_style))
-    elements.append(Paragraph(f"Invoice #{invoice.invoice_number}", header_style))
-    elements.append(Paragraph(f"Date: {invoice.invoice_date.strftime('%d/%m/%Y')}", small_style))
-    elements.append(Spacer(1, 20))
-    
-    elements.append(Paragraph(f"<b>Client:</b> {invoice.client_name}", small_style))
-    if invoice.client_address:
-        elements.append(Paragraph(f"Address: {invoice.client_address}", small_style))
-    elements.append(Spacer(1, 20))
-    
-    table_data = [['Description', 'Qty', 'Unit Price', 'Amount']]
-    for item in items:
-        table_data.append([
-            item.description,
-            f"{item.quantity:.2f}",
-            f"€{item.unit_price:.2f}",
-            f"€{item.amount:.2f}"
-        ])
-    
-    subtotal = sum(float(item.amount) for item in items)
-    vat = subtotal * 0.21
-    total = subtotal + vat
-    
-    table_data.append(['', '', 'Subtotal:', f"€{subtotal:.2f}"])
-    table_data.append(['', '', 'IVA (21%):', f"€{vat:.2f}"])
-    table_data.append(['', '', 'TOTAL:', f"€{total:.2f}"])
-    
-    table = Table(table_data, colWidths=[90*mm, 20*mm, 30*mm, 30*mm])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#02B0C2')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('GRID', (0, 0), (-1, -4), 1, colors.black),
-        ('FONTNAME', (2, -3), (3, -1), 'Helvetica-Bold'),
-    ]))
-    elements.append(table)
-    elements.append(Spacer(1, 20))
-    
-    if hasattr(invoice, 'qr_code_data') and invoice.qr_code_data:
-        elements.append(Spacer(1, 20))
-        
-        verifactu_divider = Table([['']], colWidths=[170*mm])
-        verifactu_divider.setStyle(TableStyle([
-            ('LINEABOVE', (0, 0), (-1, -1), 1, colors.HexColor('#02B0C2')),
-        ]))
-        elements.append(verifactu_divider)
-        elements.append(Spacer(1, 10))
-        
-        try:
-            qr_image_data = base64.b64decode(invoice.qr_code_data)
-            qr_buffer = io.BytesIO(qr_image_data)
-            qr_image = Image(qr_buffer, width=25*mm, height=25*mm)
-            
-            verifactu_badge = Paragraph("<b>VERI*FACTU</b>", verifactu_style)
-            verifactu_text = Paragraph(VerifactuService.get_legal_text("es"), verifactu_legal_style)
-            
-            hash_display = ""
-            if hasattr(invoice, 'verifactu_hash') and invoice.verifactu_hash:
-                hash_display = f"Huella: {invoice.verifactu_hash[:16]}..."
-            
-            hash_text = Paragraph(hash_display, verifactu_legal_style)
-            
-            verifactu_content = Table([
-                [qr_image, Table([[verifactu_badge], [verifactu_text], [hash_text]], colWidths=[140*mm])]
-            ], colWidths=[30*mm, 140*mm])
-            
-            verifactu_content.setStyle(TableStyle([
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-                ('LEFTPADDING', (1, 0), (1, 0), 10),
-            ]))
-            
-            verifactu_box = Table([[verifactu_content]], colWidths=[170*mm])
-            verifactu_box.setStyle(TableStyle([
-                ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#02B0C2')),
-                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f0fafb')),
-                ('TOPPADDING', (0, 0), (-1, -1), 8),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-                ('LEFTPADDING', (0, 0), (-1, -1), 8),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-            ]))
-            
-            elements.append(verifactu_box)
-            
-        except Exception as e:
-            logger.error(f"Error generating VeriFactu section: {e}")
-            elements.append(Paragraph(
-                f"<b>VERI*FACTU Compliant</b> - {VerifactuService.get_legal_text('es')}",
-                verifactu_style
-            ))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer
+    return FileResponse(pdf_path, media_type="application/pdf", filename=filename, headers=headers)
 
 @router.post("/upload", response_model=List[UploadIncomeResponse])
 async def upload_income_documents(
@@ -556,36 +652,38 @@ async def upload_income_documents(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    results = []
-    
-    for file in files:
-        if not file.content_type.startswith('image/') and file.content_type != 'application/pdf':
-            raise HTTPException(status_code=400, detail="Only images or PDF allowed")
-        
-        import uuid
-        
-        invoice_number = f"INC-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:4].upper()}"
-        
-        invoice = Invoice(
-            user_id=current_user.id,
-            business_name=current_user.full_name or "Business",
-            client_name="Uploaded Document",
-            invoice_number=invoice_number,
-            invoice_date=datetime.now(),
-            total=Decimal("0.00"),
-            status="draft",
-        )
-        
-        db.add(invoice)
-        db.commit()
-        db.refresh(invoice)
-        
-        results.append(UploadIncomeResponse(
+    created = []
+    
+    with unit_of_work(db):
+        for file in files:
+            if not file.content_type.startswith('image/') and file.content_type != 'application/pdf':
+                raise HTTPException(status_code=400, detail="Only images or PDF allowed")
+            
+            import uuid
+            
+            invoice_number = f"INC-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:4].upper()}"
+            
+            invoice = Invoice(
+                user_id=current_user.id,
+                business_name=current_user.full_name or "Business",
+                client_name="Uploaded Document",
+                invoice_number=invoice_number,
+                invoice_date=datetime.now(),
+                total=Decimal("0.00"),
+                status="draft",
+            )
+            
+            db.add(invoice)
+            created.append((invoice, file.filename))
+        mark_financials_dirty(db, current_user.id)
+    
+    return [
+        UploadIncomeResponse(
             invoice_id=invoice.id,
             amount=0.0,
-            description=f"Uploaded: {file.filename}",
+            description=f"Uploaded: {filename}",
             date=datetime.now().isoformat(),
             client_name="Pending extraction"
-        ))
-    
-    return results
\ No newline at end of file
+        )
+        for invoice, filename in created
+    ]
\ No newline at end of file
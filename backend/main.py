@@ -8,12 +8,13 @@ from dotenv import load_dotenv
 from bank import router as bank_router
 from veriff import router as veriff_router
 from reminders import router as reminders_router
-from chat import router as chat_router
+from chat import router as chat_router, close_chat_client
 from invoices import router as invoice_router
 from dashboard import router as dashboard_router
 from reports import router as reports_router
 from verifactu_events import router as verifactu_events_router
 from aeat_submission import router as aeat_router
+from invoice_pdf import get_invoice_pdf_renderer
 
 app = FastAPI(title="TaxHelper API", version="0.1.0")
 load_dotenv()
@@ -26,9 +27,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Total-Amount", "ETag"],
 )
 
-from auth import router as auth_router
+from auth import router as auth_router, password_hasher
 app.include_router(auth_router)
 app.include_router(expenses_router)
 app.include_router(bank_router)
@@ -49,6 +51,18 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.on_event("shutdown")
+def shutdown_pdf_renderer():
+    get_invoice_pdf_renderer().shutdown()
+
+@app.on_event("shutdown")
+def shutdown_password_hasher():
+    password_hasher.shutdown()
+
+@app.on_event("shutdown")
+async def shutdown_chat_client():
+    await close_chat_client()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,261 @@
+import os
+import re
+import uuid
+import hashlib
+import asyncio
+import tempfile
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional, Dict, Tuple
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal, Transaction
+from extraction_cache import get_extraction_cache
+from financials_cache import mark_financials_dirty
+from ttl_cache import TTLCache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    from importlib.metadata import version as package_version
+    from docstrange import DocumentExtractor
+    HAS_DOCSTRANGE = True
+    EXTRACTOR_VERSION = f"docstrange-{package_version('docstrange')}"
+except ImportError:
+    HAS_DOCSTRANGE = False
+    EXTRACTOR_VERSION = None
+    logger.warning("docstrange not installed - document parsing disabled")
+
+
+OCR_MAX_WORKERS = int(os.getenv("OCR_MAX_WORKERS", "8"))
+OCR_JOB_CONCURRENCY = int(os.getenv("OCR_JOB_CONCURRENCY", "4"))
+OCR_JOB_TTL = 3600
+
+RECEIPT_FIELDS = [
+    "total_amount", "due_date", "vendor_name", "invoice_number",
+    "line_items", "description"
+]
+
+_executor = ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS, thread_name_prefix="ocr")
+_worker_state = threading.local()
+_jobs = TTLCache(maxsize=1000, ttl=OCR_JOB_TTL)
+
+
+@dataclass
+class SpooledFile:
+    path: str
+    filename: str
+    digest: str
+
+
+@dataclass
+class ReceiptData:
+    filename: str
+    amount: float
+    date: datetime
+    description: str
+    invoice_id: str
+    provider: str
+    transaction_id: Optional[int] = None
+
+
+@dataclass
+class OCRJob:
+    job_id: str
+    user_id: int
+    total: int
+    status: str = "queued"
+    processed: int = 0
+    results: List[ReceiptData] = field(default_factory=list)
+    errors: List[Dict[str, str]] = field(default_factory=list)
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+
+async def spool_receipts(files) -> List[SpooledFile]:
+    spooled = []
+    for file in files:
+        content = await file.read()
+        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file.filename.split('.')[-1]}") as temp_file:
+            temp_file.write(content)
+        spooled.append(SpooledFile(
+            path=temp_file.name,
+            filename=file.filename,
+            digest=hashlib.sha256(content).hexdigest()
+        ))
+    return spooled
+
+
+def _get_extractor():
+    extractor = getattr(_worker_state, "extractor", None)
+    if extractor is None:
+        extractor = DocumentExtractor(api_key=os.getenv("DOCSTRANGE_API_KEY"))
+        _worker_state.extractor = extractor
+    return extractor
+
+
+def _extract_fields(spooled: SpooledFile) -> Tuple[str, dict]:
+    """Run docstrange on a file, or reuse the result of an identical earlier upload."""
+    cache = get_extraction_cache()
+    key = cache.make_key(spooled.digest, EXTRACTOR_VERSION, RECEIPT_FIELDS)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached["full_text"], cached["content"]
+
+    result = _get_extractor().extract(spooled.path)
+    full_text = str(result)
+
+    fields = result.extract_data(specified_fields=RECEIPT_FIELDS)
+    content = fields.get('extracted_fields', {}).get('content', {})
+
+    cache.set(key, {"full_text": full_text, "content": content})
+    return full_text, content
+
+
+def extract_receipt(spooled: SpooledFile) -> ReceiptData:
+    if not HAS_DOCSTRANGE:
+        # Fallback: create basic transaction without parsing
+        return ReceiptData(
+            filename=spooled.filename,
+            amount=0.0,
+            date=datetime.now(),
+            description=f"Uploaded: {spooled.filename}",
+            invoice_id=spooled.filename,
+            provider="upload"
+        )
+
+    full_text, content = _extract_fields(spooled)
+
+    amount_str = str(content.get('total_amount', '0.0'))
+    amount = float(amount_str.replace(',', '.')) if amount_str != '0.0' else 0.0
+
+    date_str = str(content.get('due_date', ''))
+    date = datetime.fromisoformat(date_str) if date_str else datetime.now()
+
+    description = str(content.get('vendor_name', 'Unknown invoice'))
+    invoice_id = content.get('invoice_number', spooled.filename)
+
+    line_items = content.get('line_items', [])
+    if line_items:
+        items_desc = ", ".join([str(item.get('description', '')) for item in line_items[:4]])
+        description += f" | Items: {items_desc}"
+
+    if amount == 0.0:
+        amount_match = re.search(r'Total\s*([\d,]+\.?\d*\s*€)', full_text, re.IGNORECASE)
+        if amount_match:
+            amount_str = amount_match.group(1).replace(',', '.').replace(' €', '')
+            amount = float(amount_str)
+
+    return ReceiptData(
+        filename=spooled.filename,
+        amount=amount,
+        date=date,
+        description=description,
+        invoice_id=str(invoice_id),
+        provider="docstrange"
+    )
+
+
+async def process_receipts(
+    spooled_files: List[SpooledFile],
+    job: Optional[OCRJob] = None,
+    max_concurrency: int = OCR_JOB_CONCURRENCY
+) -> Tuple[List[ReceiptData], List[Dict[str, str]]]:
+    """Extract all receipts in the OCR thread pool, at most max_concurrency at a time.
+
+    Results are collected in completion order and, when a job is given,
+    published on it as soon as each file finishes.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(spooled: SpooledFile):
+        async with semaphore:
+            try:
+                return spooled, await loop.run_in_executor(_executor, extract_receipt, spooled), None
+            except Exception as e:
+                logger.error(f"Receipt extraction failed for {spooled.filename}: {e}")
+                return spooled, None, str(e)
+            finally:
+                os.unlink(spooled.path)
+
+    receipts = []
+    errors = []
+    for next_done in asyncio.as_completed([run(s) for s in spooled_files]):
+        spooled, receipt, error = await next_done
+        if error:
+            errors.append({"filename": spooled.filename, "error": error})
+        else:
+            receipts.append(receipt)
+        if job:
+            job.processed += 1
+            job.results = list(receipts)
+            job.errors = list(errors)
+
+    return receipts, errors
+
+
+def save_receipts(db: Session, user_id: int, receipts: List[ReceiptData]) -> List[ReceiptData]:
+    transactions = [
+        Transaction(
+            user_id=user_id,
+            date=receipt.date,
+            amount=receipt.amount,
+            type="expense",
+            category="deductible",
+            description=receipt.description,
+            invoice_id=receipt.invoice_id,
+            provider=receipt.provider
+        )
+        for receipt in receipts
+    ]
+    db.add_all(transactions)
+    db.flush()
+
+    for receipt, transaction in zip(receipts, transactions):
+        receipt.transaction_id = transaction.id
+
+    mark_financials_dirty(db, user_id)
+    db.commit()
+    return receipts
+
+
+def create_job(user_id: int, total: int) -> OCRJob:
+    job = OCRJob(job_id=uuid.uuid4().hex, user_id=user_id, total=total)
+    _jobs.set(job.job_id, job)
+    return job
+
+
+def get_job(job_id: str, user_id: int) -> Optional[OCRJob]:
+    job = _jobs.get(job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    return job
+
+
+def _save_with_new_session(user_id: int, receipts: List[ReceiptData]) -> List[ReceiptData]:
+    db = SessionLocal()
+    try:
+        return save_receipts(db, user_id, receipts)
+    finally:
+        db.close()
+
+
+async def run_job(job: OCRJob, spooled_files: List[SpooledFile]) -> None:
+    job.status = "running"
+    try:
+        receipts, _ = await process_receipts(spooled_files, job)
+        job.results = await run_in_threadpool(_save_with_new_session, job.user_id, receipts)
+        job.status = "completed" if receipts or not job.errors else "failed"
+    except Exception as e:
+        logger.error(f"OCR job {job.job_id} failed: {e}")
+        job.errors.append({"filename": "", "error": str(e)})
+        job.status = "failed"
+    finally:
+        job.finished_at = datetime.utcnow()
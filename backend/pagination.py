@@ -0,0 +1,32 @@
+import json
+import base64
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    """Opaque keyset cursor for lists ordered by (timestamp, id) descending."""
+    payload = json.dumps({"d": sort_value.isoformat(), "i": row_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(payload["d"]), int(payload["i"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_date_range(date_from: Optional[str], date_to: Optional[str]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """Inclusive start and exclusive end for ISO date filters; a plain date in date_to includes the whole day."""
+    try:
+        start = datetime.fromisoformat(date_from) if date_from else None
+        end = datetime.fromisoformat(date_to) if date_to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date_from and date_to must be ISO dates")
+    if end is not None:
+        end += timedelta(days=1) if len(date_to) == 10 else timedelta(microseconds=1)
+    return start, end
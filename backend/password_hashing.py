@@ -0,0 +1,121 @@
+import os
+import time
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+PASSWORD_HASH_NICE = 10
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Bounds the wait: a queued login waits at most about MAX_QUEUE / WORKERS hash times
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", str(PASSWORD_HASH_WORKERS * 8)))
+
+
+def _lower_thread_priority() -> None:
+    # Linux applies nice values per thread: the event loop then wins the CPU whenever it has work
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PASSWORD_HASH_NICE)
+    except (AttributeError, OSError):
+        pass
+
+
+class PasswordHashingBusy(Exception):
+    """Raised instead of queueing when the hashing pool's queue is full."""
+
+
+class PasswordHasher:
+    """Runs Argon2 hashing and verification in a dedicated, bounded thread pool.
+
+    argon2-cffi releases the GIL while hashing, so the pool threads use
+    real cores while the event loop and the shared request threadpool stay
+    free. At most `max_workers` hashes run at once and `max_queue` more may
+    wait; past that, calls fail straight away with PasswordHashingBusy
+    rather than making every login wait longer.
+    """
+
+    def __init__(self, context: CryptContext, max_workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self._wait_seconds = 0.0
+        self._hash_seconds = 0.0
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="argon2",
+                initializer=_lower_thread_priority
+            )
+        return self._pool
+
+    def _timed(self, submitted_at: float, func, *args):
+        started_at = time.perf_counter()
+        with self._lock:
+            self._running += 1
+        try:
+            return func(*args)
+        finally:
+            finished_at = time.perf_counter()
+            with self._lock:
+                self._running -= 1
+                self._wait_seconds += started_at - submitted_at
+                self._hash_seconds += finished_at - started_at
+
+    def _finished(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+
+    async def _run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                if self.rejected % 100 == 1:
+                    logger.warning(f"Password hashing pool full ({self._pending} pending), {self.rejected} calls rejected so far")
+                raise PasswordHashingBusy()
+            self._pending += 1
+            self.peak_queued = max(self.peak_queued, self._pending - self.max_workers)
+        # Counted down when the hash finishes, even if the awaiting request has gone away
+        future = self._get_pool().submit(self._timed, time.perf_counter(), func, *args)
+        future.add_done_callback(self._finished)
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password, hashed_password)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "peak_queued": self.peak_queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self._wait_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+                "avg_hash_ms": round(self._hash_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        logger.info(f"Password hashing pool stats: {self.stats()}")
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
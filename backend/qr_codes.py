@@ -0,0 +1,53 @@
+import base64
+import hashlib
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+import qrcode.image.svg
+
+QR_CACHE_SIZE = 512
+
+QR_MEDIA_TYPES = {
+    "svg": "image/svg+xml",
+    "png": "image/png",
+}
+
+
+def _make_qr(data: str, box_size: int) -> qrcode.QRCode:
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=box_size,
+        border=4
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qr(data: str, fmt: str = "svg") -> bytes:
+    """Render a QR code as a single-path SVG or a PNG.
+
+    Results are memoised, so the same verification URL is only ever
+    encoded once per process.
+    """
+    if fmt == "svg":
+        img = _make_qr(data, box_size=10).make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    elif fmt == "png":
+        img = _make_qr(data, box_size=10).make_image(fill_color="black", back_color="white")
+    else:
+        raise ValueError(f"Unsupported QR format: {fmt}")
+
+    buffer = BytesIO()
+    img.save(buffer)
+    return buffer.getvalue()
+
+
+def render_qr_base64(data: str) -> str:
+    return base64.b64encode(render_qr(data, "png")).decode('utf-8')
+
+
+def qr_etag(data: str, fmt: str) -> str:
+    return '"' + hashlib.sha256(f"{fmt}|{data}".encode("utf-8")).hexdigest()[:32] + '"'
@@ -5,8 +5,8 @@ from typing import List, Optional
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta 
 
-from database import get_db, User, Reminder
-from auth import get_current_user
+from database import get_db, Reminder
+from auth import UserPrincipal, get_current_principal
 
 router = APIRouter(prefix="/reminders", tags=["reminders"])
 
@@ -121,7 +121,7 @@ def calculate_days_until(due_date: datetime) -> int:
 @router.get("/tax-deadlines", response_model=List[TaxDeadlineResponse])
 async def get_tax_deadlines(
     months_ahead: int = 6,
-    current_user: User = Depends(get_current_user)
+    current_user: UserPrincipal = Depends(get_current_principal)
 ):
     deadlines = SpanishTaxDeadlines.get_all_upcoming(months_ahead=months_ahead)
 
@@ -143,7 +143,7 @@ async def get_tax_deadlines(
 async def get_reminders(
     include_completed: bool = False,
     include_removed: bool = False,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     query = db.query(Reminder).filter(Reminder.user_id == current_user.id)
@@ -180,7 +180,7 @@ async def get_all_deadlines(
     months_ahead: int = 6,
     include_completed: bool = False,
     include_removed: bool = False,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     tax_deadlines = SpanishTaxDeadlines.get_all_upcoming(months_ahead=months_ahead)
@@ -234,7 +234,7 @@ async def get_all_deadlines(
 @router.post("/", response_model=ReminderResponse)
 async def create_reminder(
     reminder: ReminderCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     db_reminder = Reminder(
@@ -271,7 +271,7 @@ async def create_reminder(
 async def update_reminder(
     reminder_id: int,
     update: ReminderUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     reminder = db.query(Reminder).filter(
@@ -308,7 +308,7 @@ async def update_reminder(
 @router.delete("/{reminder_id}")
 async def delete_reminder(
     reminder_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     reminder = db.query(Reminder).filter(
@@ -328,7 +328,7 @@ async def delete_reminder(
 @router.post("/{reminder_id}/complete")
 async def mark_reminder_complete(
     reminder_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     reminder = db.query(Reminder).filter(
@@ -348,7 +348,7 @@ async def mark_reminder_complete(
 @router.post("/{reminder_id}/uncomplete")
 async def mark_reminder_uncomplete(
     reminder_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     reminder = db.query(Reminder).filter(
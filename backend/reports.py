@@ -20,7 +20,7 @@ from verifactu import (
 )
 from verifactu_events import VerifactuEventService
 
-from database import get_db, User, Transaction, Report, ReportRecord, Invoice
+from database import get_db, unit_of_work, User, Transaction, Report, ReportRecord, Invoice, INVOICE_STATUS_CANCELLED
 from auth import get_current_user
 
 logging.basicConfig(level=logging.INFO)
@@ -514,7 +514,8 @@ async def wizard_step_two(
         Invoice.user_id == current_user.id,
         Invoice.invoice_date >= start_datetime,
         Invoice.invoice_date <= end_datetime,
-        Invoice.is_deleted == False
+        Invoice.is_deleted == False,
+        Invoice.status != INVOICE_STATUS_CANCELLED
     ).all()
     
     income = sum(Decimal(str(inv.total)) for inv in invoices)
@@ -623,25 +624,25 @@ async def wizard_step_three(
     client_ip = request.client.host if request.client else None
     user_agent = request.headers.get("user-agent", "")[:255]
     
-    VerifactuEventService.log_report_event(
-        db=db,
-        user_id=current_user.id,
-        report_id=report.id,
-        event_type=VerifactuEventType.HASH_GENERATED,
-        hash_after=hash_result.hash_value,
-        hash_before=previous_hash,
-        ip_address=client_ip,
-        user_agent=user_agent,
-        event_data={
-            "hash_input": hash_result.hash_input,
-            "algorithm": "SHA-256",
-            "qr_generated": True
-        }
-    )
-    
-    report.verifactu_hash = hash_result.hash_value
-    report.status = ReportStatus.PENDING.value
-    db.commit()
+    with unit_of_work(db):
+        VerifactuEventService.log_report_event(
+            db=db,
+            user_id=current_user.id,
+            report_id=report.id,
+            event_type=VerifactuEventType.HASH_GENERATED,
+            hash_after=hash_result.hash_value,
+            hash_before=previous_hash,
+            ip_address=client_ip,
+            user_agent=user_agent,
+            event_data={
+                "hash_input": hash_result.hash_input,
+                "algorithm": "SHA-256",
+                "qr_generated": True
+            }
+        )
+        
+        report.verifactu_hash = hash_result.hash_value
+        report.status = ReportStatus.PENDING.value
     
     verifactu_record = VerifactuRecord(
         record_id=str(uuid.uuid4()),
@@ -718,53 +719,52 @@ async def submit_report(
         str(uuid.uuid4())
     )
     
-    db_record = ReportRecord(
-        user_id=current_user.id,
-        report_id=report.id,
-        record_type="submission",
-        hash_chain=report.verifactu_hash,
-        xml_content=xml_result.xml_content,
-        created_at=datetime.utcnow()
-    )
-    db.add(db_record)
-    
-    report.status = ReportStatus.SUBMITTED.value
-    report.submit_date = datetime.now().date()
-    report.xml_submission = xml_result.xml_content
-    
-    client_ip = request.client.host if request.client else None
-    user_agent = request.headers.get("user-agent", "")[:255]
-    
-    VerifactuEventService.log_report_event(
-        db=db,
-        user_id=current_user.id,
-        report_id=report.id,
-        event_type=VerifactuEventType.REPORT_CREATED,
-        hash_after=hash_result.hash_value,
-        ip_address=client_ip,
-        user_agent=user_agent,
-        event_data={
-            "report_type": report.report_type,
-            "period": report.period,
-            "total_tax": str(report.total_tax)
-        }
-    )
-    
-    VerifactuEventService.log_report_event(
-        db=db,
-        user_id=current_user.id,
-        report_id=report.id,
-        event_type=VerifactuEventType.REPORT_SUBMITTED,
-        hash_after=hash_result.hash_value,
-        ip_address=client_ip,
-        user_agent=user_agent,
-        event_data={
-            "xml_generated": True,
-            "submission_timestamp": datetime.utcnow().isoformat()
-        }
-    )
-    
-    db.commit()
+    with unit_of_work(db):
+        db_record = ReportRecord(
+            user_id=current_user.id,
+            report_id=report.id,
+            record_type="submission",
+            hash_chain=report.verifactu_hash,
+            xml_content=xml_result.xml_content,
+            created_at=datetime.utcnow()
+        )
+        db.add(db_record)
+        
+        report.status = ReportStatus.SUBMITTED.value
+        report.submit_date = datetime.now().date()
+        report.xml_submission = xml_result.xml_content
+        
+        client_ip = request.client.host if request.client else None
+        user_agent = request.headers.get("user-agent", "")[:255]
+        
+        VerifactuEventService.log_report_event(
+            db=db,
+            user_id=current_user.id,
+            report_id=report.id,
+            event_type=VerifactuEventType.REPORT_CREATED,
+            hash_after=hash_result.hash_value,
+            ip_address=client_ip,
+            user_agent=user_agent,
+            event_data={
+                "report_type": report.report_type,
+                "period": report.period,
+                "total_tax": str(report.total_tax)
+            }
+        )
+        
+        VerifactuEventService.log_report_event(
+            db=db,
+            user_id=current_user.id,
+            report_id=report.id,
+            event_type=VerifactuEventType.REPORT_SUBMITTED,
+            hash_after=hash_result.hash_value,
+            ip_address=client_ip,
+            user_agent=user_agent,
+            event_data={
+                "xml_generated": True,
+                "submission_timestamp": datetime.utcnow().isoformat()
+            }
+        )
     
     background_tasks.add_task(send_to_aeat, report.id, xml_result.xml_content)
     
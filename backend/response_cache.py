@@ -0,0 +1,216 @@
+import os
+import re
+import time
+import zlib
+import threading
+import unicodedata
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "2000"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", str(24 * 3600)))
+CHAT_CACHE_THRESHOLD = float(os.getenv("CHAT_CACHE_THRESHOLD", "0.9"))
+EMBEDDING_DIM = 1024
+
+STOPWORDS = frozenset({
+    "a", "an", "the", "is", "are", "do", "does", "i", "my", "me", "to", "of", "for", "in", "on",
+    "and", "or", "it", "please",
+    "el", "la", "los", "las", "un", "una", "de", "del", "en", "y", "o", "mi", "es", "se", "para", "por",
+})
+
+# Question words, modals and negations decide what is being asked even when every other word is shared:
+# "When do I file modelo 303?" and "How do I file modelo 303?" need different answers
+INTENT_WORDS = frozenset({
+    "what", "when", "where", "which", "who", "why", "how", "can", "could", "should", "must", "may", "need",
+    "not", "no", "never", "t", "cannot",
+    "que", "cuando", "donde", "cual", "cuales", "quien", "cuanto", "cuanta", "cuantos", "cuantas", "como",
+    "porque", "puedo", "puede", "debo", "debe", "tengo", "hay", "nunca", "ni", "sin",
+})
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, strip accents and punctuation, and collapse whitespace."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(_TOKEN.findall(text))
+
+
+def question_intent(normalized: str) -> Tuple[str, ...]:
+    return tuple(sorted(set(normalized.split()) & INTENT_WORDS))
+
+
+def _bucket(feature: str) -> int:
+    return zlib.crc32(feature.encode("utf-8")) % EMBEDDING_DIM
+
+
+def embed_question(normalized: str) -> np.ndarray:
+    """Unit-length hashed bag of words, word bigrams and character trigrams.
+
+    A local stand-in for a sentence embedding: rephrasings that share most
+    of their words and spellings land close together, while a different
+    modelo number or expense type moves the vector well away.
+    """
+    words = [word for word in normalized.split() if word not in STOPWORDS] or normalized.split()
+    features = [(word, 1.0) for word in words]
+    features += [(f"{first} {second}", 1.0) for first, second in zip(words, words[1:])]
+    for word in words:
+        padded = f"<{word}>"
+        features += [(padded[i:i + 3], 0.3) for i in range(len(padded) - 2)]
+
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    if features:
+        buckets, weights = zip(*((_bucket(feature), weight) for feature, weight in features))
+        np.add.at(vector, list(buckets), weights)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@dataclass
+class _Entry:
+    profile: Hashable
+    normalized: str
+    vector: np.ndarray
+    response: dict
+    tokens: int
+    expires_at: float
+
+
+@dataclass
+class CachedResponse:
+    response: dict
+    tokens_saved: int
+    similarity: float
+
+
+class ChatResponseCache:
+    """In-process semantic cache of chat answers, partitioned by user profile.
+
+    Lookups try the exact normalized question first and then a cosine
+    search over the question vectors stored under the same profile and
+    question intent (question words, modals and negations), so two
+    questions that differ only in those never share an answer. Entries
+    expire after `ttl` seconds and the least recently used are evicted
+    beyond `maxsize`.
+    """
+
+    def __init__(self, maxsize: int = CHAT_CACHE_SIZE, ttl: float = CHAT_CACHE_TTL, threshold: float = CHAT_CACHE_THRESHOLD):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._exact: Dict[Tuple[Hashable, str], int] = {}
+        # Per-profile (entry ids, stacked vectors), rebuilt lazily after a change to that profile
+        self._matrices: Dict[Hashable, Tuple[List[int], np.ndarray]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        self._exact.pop((entry.profile, entry.normalized), None)
+        self._matrices.pop(entry.profile, None)
+
+    def _matrix(self, profile: Hashable) -> Tuple[List[int], np.ndarray]:
+        if profile not in self._matrices:
+            ids = [entry_id for entry_id, entry in self._entries.items() if entry.profile == profile]
+            vectors = np.stack([self._entries[entry_id].vector for entry_id in ids]) if ids else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+            self._matrices[profile] = (ids, vectors)
+        return self._matrices[profile]
+
+    def _search(self, profile: Hashable, normalized: str) -> Tuple[Optional[int], float]:
+        entry_id = self._exact.get((profile, normalized))
+        if entry_id is not None:
+            return entry_id, 1.0
+
+        ids, vectors = self._matrix(profile)
+        if not ids:
+            return None, 0.0
+        scores = vectors @ embed_question(normalized)
+        best = int(np.argmax(scores))
+        return ids[best], float(scores[best])
+
+    def lookup(self, profile: Hashable, question: str) -> Optional[CachedResponse]:
+        normalized = normalize_question(question)
+        profile = (profile, question_intent(normalized))
+        with self._lock:
+            entry_id, similarity = self._search(profile, normalized)
+            entry = self._entries.get(entry_id) if entry_id is not None else None
+
+            if entry and entry.expires_at < time.monotonic():
+                self._remove(entry_id)
+                entry = None
+
+            if entry is None or similarity < self.threshold:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            self.tokens_saved += entry.tokens
+            return CachedResponse(response=dict(entry.response), tokens_saved=entry.tokens, similarity=similarity)
+
+    def store(self, profile: Hashable, question: str, response: dict, tokens: Optional[int]) -> None:
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        profile = (profile, question_intent(normalized))
+        entry = _Entry(
+            profile=profile,
+            normalized=normalized,
+            vector=embed_question(normalized),
+            response=dict(response),
+            tokens=tokens or 0,
+            expires_at=time.monotonic() + self.ttl,
+        )
+        with self._lock:
+            existing = self._exact.get((profile, normalized))
+            if existing is not None:
+                self._remove(existing)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._exact[(profile, normalized)] = entry_id
+            self._matrices.pop(profile, None)
+
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._exact.clear()
+            self._matrices.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+_response_cache: Optional[ChatResponseCache] = None
+
+
+def get_chat_response_cache() -> ChatResponseCache:
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ChatResponseCache()
+    return _response_cache
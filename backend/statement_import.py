@@ -0,0 +1,502 @@
+import codecs
+import csv
+import hashlib
+import os
+import re
+import unicodedata
+import tempfile
+import logging
+from collections import OrderedDict, Counter
+from dataclasses import dataclass, replace
+from datetime import datetime, date
+from io import BytesIO
+from typing import Optional, List, Dict, Any, Iterator, Iterable, Callable, Union
+
+import pandas as pd
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from database import Transaction
+from financials_cache import mark_financials_dirty
+from bank_profiles import HeaderCandidate, StatementProfile, normalize_header, match_profile, learn_profile
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+ENCODING_SAMPLE_SIZE = 64 * 1024
+DECODE_FALLBACK = 'statement_cp1252_fallback'
+IMPORT_BATCH_SIZE = 2000
+FINGERPRINT_DATE_WINDOW = 62
+HEADER_SCAN_ROWS = 20
+
+CSV_DELIMITERS = [',', ';', '\t', '|']
+
+CSV_ENCODINGS = ['utf-8', 'latin-1', 'iso-8859-1', 'cp1252']
+DATE_FORMATS = ['%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d/%m/%y']
+
+DATE_PATTERNS = ['fecha', 'date', 'fecha operación', 'fecha valor', 'f. valor', 'fecha op']
+AMOUNT_PATTERNS = ['importe', 'amount', 'cantidad', 'euros', 'importe (€)', 'importe eur']
+DESC_PATTERNS = ['concepto', 'description', 'descripción', 'movimiento', 'detalle', 'observaciones']
+
+StatementSource = Union[str, BytesIO]
+
+
+class StatementImportError(Exception):
+    pass
+
+
+@dataclass
+class ColumnMapping:
+    date_col: str
+    amount_col: str
+    desc_col: Optional[str] = None
+    positional: bool = False
+
+
+@dataclass
+class ImportProgress:
+    rows_read: int = 0
+    transactions_created: int = 0
+    duplicates_skipped: int = 0
+    batches_committed: int = 0
+    profile: Optional[str] = None
+
+
+async def spool_upload(file, chunk_size: int = SPOOL_CHUNK_SIZE) -> str:
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as spool:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            spool.write(chunk)
+        return spool.name
+
+
+def _decode_as_cp1252(error: UnicodeDecodeError):
+    # A streamed file's encoding is chosen from its first bytes; stray bytes further on that
+    # do not decode in it (typically a cp1252 line in a UTF-8 export) are read as cp1252
+    return error.object[error.start:error.end].decode('cp1252', errors='replace'), error.end
+
+
+codecs.register_error(DECODE_FALLBACK, _decode_as_cp1252)
+
+
+def _read_prefix(source: StatementSource, size: int) -> bytes:
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read(size)
+    position = source.tell()
+    sample = source.read(size)
+    source.seek(position)
+    return sample
+
+
+def detect_encoding(source: StatementSource, sample_size: Optional[int] = ENCODING_SAMPLE_SIZE) -> str:
+    """First of CSV_ENCODINGS that decodes the first `sample_size` bytes, or the whole source if None."""
+    sample = _read_prefix(source, sample_size if sample_size is not None else -1)
+    for encoding in CSV_ENCODINGS:
+        try:
+            # final=False tolerates a multi-byte character cut off at the end of a sample
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=sample_size is None)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    raise StatementImportError("Could not decode CSV file")
+
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    df.columns = [str(col).lower().strip() for col in df.columns]
+    return df
+
+
+def detect_columns(columns: List[str]) -> ColumnMapping:
+    date_col = None
+    amount_col = None
+    desc_col = None
+
+    for col in columns:
+        col_lower = col.lower()
+        if not date_col and any(p in col_lower for p in DATE_PATTERNS):
+            date_col = col
+        if not amount_col and any(p in col_lower for p in AMOUNT_PATTERNS):
+            amount_col = col
+        if not desc_col and any(p in col_lower for p in DESC_PATTERNS):
+            desc_col = col
+
+    if not date_col or not amount_col:
+        if len(columns) >= 2:
+            return ColumnMapping(
+                date_col=columns[0],
+                amount_col=columns[1],
+                desc_col=columns[2] if len(columns) > 2 else None,
+                positional=True
+            )
+        else:
+            raise StatementImportError(
+                "Could not identify date and amount columns. Please ensure your file has headers like 'Fecha', 'Importe', 'Concepto'."
+            )
+
+    return ColumnMapping(date_col=date_col, amount_col=amount_col, desc_col=desc_col)
+
+
+def parse_date(value) -> Optional[datetime]:
+    if isinstance(value, str):
+        for fmt in DATE_FORMATS:
+            try:
+                return datetime.strptime(value.strip(), fmt)
+            except ValueError:
+                continue
+        return pd.to_datetime(value, dayfirst=True).to_pydatetime()
+    if hasattr(value, 'to_pydatetime'):
+        return value.to_pydatetime()
+    if isinstance(value, datetime):
+        return value
+    return None
+
+
+def parse_amount(value) -> float:
+    if isinstance(value, str):
+        amount_str = re.sub(r'[€$\s]', '', value)
+        if ',' in amount_str and '.' in amount_str:
+            amount_str = amount_str.replace('.', '').replace(',', '.')
+        elif ',' in amount_str:
+            amount_str = amount_str.replace(',', '.')
+        return float(amount_str)
+    return float(value)
+
+
+def row_to_transaction(row: Dict[str, Any], mapping: ColumnMapping, user_id: int) -> Optional[Dict[str, Any]]:
+    date_val = row.get(mapping.date_col)
+    if pd.isna(date_val):
+        return None
+
+    amount_val = row.get(mapping.amount_col)
+    if pd.isna(amount_val):
+        return None
+
+    amount = parse_amount(amount_val)
+    if amount == 0:
+        return None
+
+    description = "Bank transaction"
+    if mapping.desc_col and not pd.isna(row.get(mapping.desc_col)):
+        description = str(row[mapping.desc_col])[:500]
+
+    return {
+        "user_id": user_id,
+        "date": parse_date(date_val),
+        "amount": abs(amount),
+        "type": "income" if amount > 0 else "expense",
+        "description": description,
+        "provider": "manual_upload",
+    }
+
+
+def normalize_description(description: Optional[str]) -> str:
+    text = unicodedata.normalize('NFKD', description or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', text).strip().casefold()
+
+
+def row_fingerprint(
+    user_id: int,
+    txn_date: datetime,
+    amount: float,
+    txn_type: str,
+    description: Optional[str],
+    account: Optional[str] = None,
+    occurrence: int = 0
+) -> str:
+    signed_amount = -abs(amount) if txn_type == "expense" else abs(amount)
+    key = "|".join([
+        str(user_id),
+        txn_date.date().isoformat() if isinstance(txn_date, datetime) else str(txn_date),
+        f"{signed_amount:.2f}",
+        normalize_description(description),
+        (account or "").strip().upper(),
+        str(occurrence),
+    ])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class FingerprintTracker:
+    """Numbers identical rows within one statement so genuine repeats (two
+    equal card payments on the same day) keep distinct fingerprints.
+
+    Statements are exported in date order, so only the most recent dates are
+    remembered to keep memory flat on very large files.
+    """
+
+    def __init__(self, user_id: int, account: Optional[str] = None, date_window: int = FINGERPRINT_DATE_WINDOW):
+        self.user_id = user_id
+        self.account = account
+        self.date_window = date_window
+        self._seen: "OrderedDict[date, Counter]" = OrderedDict()
+
+    def assign(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        base = row_fingerprint(
+            self.user_id, row["date"], row["amount"], row["type"], row["description"], self.account
+        )
+        day = row["date"].date()
+        seen = self._seen.get(day)
+        if seen is None:
+            seen = self._seen[day] = Counter()
+            if len(self._seen) > self.date_window:
+                self._seen.popitem(last=False)
+        occurrence = seen[base]
+        seen[base] += 1
+
+        row["fingerprint"] = base if occurrence == 0 else row_fingerprint(
+            self.user_id, row["date"], row["amount"], row["type"], row["description"], self.account, occurrence
+        )
+        return row
+
+
+def insert_new_transactions(db: Session, rows: List[Dict[str, Any]], batch_size: int = IMPORT_BATCH_SIZE) -> int:
+    """Insert rows whose fingerprint is not stored yet and return how many were new."""
+    inserted = 0
+    for start in range(0, len(rows), batch_size):
+        stmt = pg_insert(Transaction).values(rows[start:start + batch_size]).on_conflict_do_nothing(
+            index_elements=[Transaction.fingerprint],
+            index_where=Transaction.fingerprint.isnot(None)
+        ).returning(Transaction.id)
+        inserted += len(db.execute(stmt).fetchall())
+    return inserted
+
+
+def read_header_candidates(source: StatementSource, filename: str, encoding: Optional[str] = None) -> List[HeaderCandidate]:
+    filename = filename.lower()
+    candidates = []
+
+    if filename.endswith('.csv'):
+        sample = _read_prefix(source, ENCODING_SAMPLE_SIZE).decode(encoding or 'utf-8', errors='ignore')
+        lines = sample.splitlines()[:HEADER_SCAN_ROWS]
+        for row, line in enumerate(lines):
+            for delimiter in CSV_DELIMITERS:
+                if delimiter not in line:
+                    continue
+                columns = next(csv.reader([line], delimiter=delimiter), [])
+                candidates.append(HeaderCandidate(row, delimiter, tuple(normalize_header(c) for c in columns)))
+    elif filename.endswith('.xlsx'):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            for row, values in enumerate(workbook.active.iter_rows(max_row=HEADER_SCAN_ROWS, values_only=True)):
+                candidates.append(HeaderCandidate(row, None, tuple(normalize_header(c) for c in values)))
+        finally:
+            workbook.close()
+        if not isinstance(source, str):
+            source.seek(0)
+
+    return candidates
+
+
+def infer_date_format(values: Iterable) -> Optional[str]:
+    for value in values:
+        if not isinstance(value, str) or not value.strip():
+            continue
+        for fmt in DATE_FORMATS:
+            try:
+                datetime.strptime(value.strip(), fmt)
+                return fmt
+            except ValueError:
+                continue
+        return None
+    return None
+
+
+def infer_decimal(values: Iterable) -> str:
+    for value in values:
+        if isinstance(value, str) and re.search(r',\d{1,2}\s*(€)?\s*$', value.strip()):
+            return ','
+    return '.'
+
+
+def _csv_read_args(encoding: str, profile: Optional[StatementProfile]) -> Dict[str, Any]:
+    kwargs = {"encoding": encoding, "encoding_errors": DECODE_FALLBACK}
+    if profile:
+        used = set(profile.used_columns)
+        kwargs.update(
+            sep=profile.delimiter or ',',
+            skiprows=profile.header_row,
+            decimal=profile.decimal,
+            thousands=profile.thousands,
+            usecols=lambda col: normalize_header(col) in used,
+        )
+    return kwargs
+
+
+def _iter_csv_chunks(
+    source: StatementSource,
+    chunk_size: Optional[int],
+    encoding: str,
+    profile: Optional[StatementProfile] = None
+) -> Iterator[pd.DataFrame]:
+    kwargs = _csv_read_args(encoding, profile)
+    if chunk_size is None:
+        yield pd.read_csv(source, **kwargs)
+        return
+    with pd.read_csv(source, chunksize=chunk_size, **kwargs) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def _iter_xlsx_chunks(source: StatementSource, chunk_size: int, header_row: int = 0) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(min_row=header_row + 1, values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(col) if col is not None else f"column_{i}" for i, col in enumerate(header)]
+
+        batch = []
+        for row in rows:
+            if all(cell is None for cell in row):
+                continue
+            batch.append(row[:len(columns)])
+            if len(batch) >= chunk_size:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+def iter_statement_chunks(
+    source: StatementSource,
+    filename: str,
+    chunk_size: Optional[int] = None,
+    encoding: Optional[str] = None,
+    profile: Optional[StatementProfile] = None
+) -> Iterator[pd.DataFrame]:
+    filename = filename.lower()
+    header_row = profile.header_row if profile else 0
+
+    if filename.endswith('.csv'):
+        chunks = _iter_csv_chunks(source, chunk_size, encoding or detect_encoding(source), profile)
+    elif filename.endswith('.xlsx') and chunk_size is not None:
+        chunks = _iter_xlsx_chunks(source, chunk_size, header_row)
+    elif filename.endswith(('.xlsx', '.xls')):
+        # Legacy .xls has no streaming reader; it is loaded in one piece
+        chunks = iter([pd.read_excel(source, header=header_row)])
+    else:
+        raise StatementImportError("Unsupported file type. Please upload CSV or Excel (.xlsx, .xls)")
+
+    for chunk in chunks:
+        chunk = normalize_columns(chunk)
+        if profile and profile.date_format and chunk[profile.date_col].dtype == object:
+            values = chunk[profile.date_col]
+            parsed = pd.to_datetime(values, format=profile.date_format, errors='coerce')
+            # Values the profile's format does not fit are left for parse_date to infer, not dropped
+            chunk[profile.date_col] = parsed.astype(object).where(parsed.notna(), values)
+        yield chunk
+
+
+def import_statement(
+    db: Session,
+    user_id: int,
+    source: StatementSource,
+    filename: str,
+    batch_size: Optional[int] = None,
+    on_progress: Optional[Callable[[ImportProgress], None]] = None,
+    account: Optional[str] = None
+) -> ImportProgress:
+    """Parse a bank statement and insert its rows, committing once per batch.
+
+    With batch_size=None the whole file is parsed in memory and committed once;
+    otherwise rows are read and committed batch_size at a time. Rows already
+    imported from an earlier upload are skipped by fingerprint. Known bank
+    layouts are read with fixed parser arguments; unknown ones fall back to
+    column detection and are learned once they import successfully.
+    """
+    progress = ImportProgress()
+    tracker = FingerprintTracker(user_id, account)
+
+    encoding = None
+    if filename.lower().endswith('.csv'):
+        # In-memory imports check the whole buffer; streamed ones only a prefix
+        encoding = detect_encoding(source, ENCODING_SAMPLE_SIZE if batch_size else None)
+    candidates = read_header_candidates(source, filename, encoding)
+    profile = match_profile(db, user_id, candidates)
+    if profile:
+        progress.profile = profile.bank_name
+
+    mapping = None
+    learned = None
+
+    for chunk in iter_statement_chunks(source, filename, batch_size, encoding, profile):
+        if mapping is None:
+            if profile:
+                mapping = ColumnMapping(profile.date_col, profile.amount_col, profile.desc_col)
+            else:
+                mapping = detect_columns(list(chunk.columns))
+                header = next((c for c in candidates if c.row == 0 and c.delimiter in (',', None)), None)
+                if not mapping.positional and header:
+                    learned = StatementProfile(
+                        bank_name="Learned",
+                        columns=header.columns,
+                        date_col=mapping.date_col,
+                        amount_col=mapping.amount_col,
+                        desc_col=mapping.desc_col,
+                        date_format=infer_date_format(chunk[mapping.date_col].head(50)),
+                        decimal=infer_decimal(chunk[mapping.amount_col].head(50)),
+                        thousands=None,
+                        delimiter=',' if filename.lower().endswith('.csv') else None,
+                        header_row=0,
+                    )
+                    if learned.decimal == ',':
+                        learned = replace(learned, thousands='.')
+
+        rows = []
+        for idx, record in enumerate(chunk.to_dict('records'), start=progress.rows_read):
+            try:
+                transaction = row_to_transaction(record, mapping, user_id)
+            except Exception as e:
+                logger.warning(f"Skipping row {idx}: {e}")
+                continue
+            if transaction is None:
+                continue
+            if transaction["date"] is None:
+                # Dated at import time, which differs on every upload, so such rows cannot be matched
+                transaction.update(date=datetime.now(), fingerprint=None)
+                rows.append(transaction)
+            else:
+                rows.append(tracker.assign(transaction))
+        progress.rows_read += len(chunk)
+
+        if rows:
+            inserted = insert_new_transactions(db, rows)
+            mark_financials_dirty(db, user_id)
+            db.commit()
+            progress.transactions_created += inserted
+            progress.duplicates_skipped += len(rows) - inserted
+            progress.batches_committed += 1
+
+        if on_progress:
+            on_progress(progress)
+
+    if progress.rows_read == 0:
+        raise StatementImportError("The uploaded file is empty")
+
+    if learned and progress.transactions_created + progress.duplicates_skipped > 0:
+        learn_profile(db, user_id, learned)
+
+    return progress
+
+
+def log_import_progress(user_id: int) -> Callable[[ImportProgress], None]:
+    def report(progress: ImportProgress) -> None:
+        logger.info(
+            f"Statement import for user {user_id}: {progress.rows_read} rows read, "
+            f"{progress.transactions_created} new, {progress.duplicates_skipped} already imported, "
+            f"{progress.batches_committed} batches"
+        )
+    return report
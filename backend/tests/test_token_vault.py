@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import BankAccount
+from token_vault import TokenVault
+
+TOKEN = "access-sandbox-1234"
+
+
+@pytest.fixture
+def no_key(monkeypatch):
+    monkeypatch.delenv("PLAID_TOKEN_ENCRYPTION_KEY", raising=False)
+
+
+@pytest.fixture
+def key(monkeypatch):
+    monkeypatch.setenv("PLAID_TOKEN_ENCRYPTION_KEY", Fernet.generate_key().decode())
+
+
+def test_without_key_new_tokens_stay_plaintext(no_key):
+    account = BankAccount()
+    TokenVault().store_token(account, TOKEN, sealed=TokenVault().seal(TOKEN))
+
+    assert account.access_token == TOKEN
+    assert account.access_token_encrypted is None
+    assert account.access_token_key is None
+    assert "PLAID_TOKEN_ENCRYPTION_KEY" not in os.environ
+    # A restarted process still reads the token
+    assert TokenVault().get_token(account) == TOKEN
+
+
+def test_without_key_legacy_tokens_are_not_sealed(no_key):
+    account = BankAccount(access_token=TOKEN)
+
+    assert TokenVault().get_token(account) == TOKEN
+    assert account.access_token == TOKEN
+    assert account.access_token_encrypted is None
+
+
+def test_with_key_tokens_are_sealed_and_survive_restart(key):
+    account = BankAccount()
+    TokenVault().store_token(account, TOKEN)
+
+    assert account.access_token is None
+    assert account.access_token_encrypted and account.access_token_key
+    assert TokenVault().get_token(account) == TOKEN
+
+
+def test_with_key_legacy_tokens_are_sealed_on_first_use(key):
+    account = BankAccount(access_token=TOKEN)
+
+    assert TokenVault().get_token(account) == TOKEN
+    assert account.access_token is None
+    assert TokenVault().get_token(account) == TOKEN
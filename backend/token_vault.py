@@ -0,0 +1,144 @@
+import os
+import base64
+import hashlib
+import logging
+from typing import Optional, Tuple, Dict, Iterable
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.backends import default_backend
+from starlette.concurrency import run_in_threadpool
+
+from database import BankAccount
+from ttl_cache import TTLCache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+TOKEN_CACHE_SIZE = 2048
+TOKEN_CACHE_TTL = 300
+
+
+class TokenVaultError(Exception):
+    pass
+
+
+class TokenVault:
+    """Envelope encryption for Plaid access tokens.
+
+    Every token is encrypted with its own Fernet data key, and the data key is
+    wrapped with a key-encryption key derived once per process. Opening a token
+    therefore costs two AES operations instead of a PBKDF2 run, and decrypted
+    tokens are kept in a short-lived in-process cache.
+
+    Without PLAID_TOKEN_ENCRYPTION_KEY nothing is sealed: a generated key
+    would die with the process and take every token sealed with it along,
+    so tokens are kept in the plaintext column until a key is configured.
+    """
+
+    def __init__(self, cache_size: int = TOKEN_CACHE_SIZE, cache_ttl: float = TOKEN_CACHE_TTL):
+        self.has_master_key = bool(os.getenv('PLAID_TOKEN_ENCRYPTION_KEY'))
+        self._kek = Fernet(self._get_master_key())
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def _get_master_key(self) -> bytes:
+        key = os.getenv('PLAID_TOKEN_ENCRYPTION_KEY')
+        if not key:
+            logger.warning("PLAID_TOKEN_ENCRYPTION_KEY not set! Plaid access tokens are stored unencrypted (NOT FOR PRODUCTION)")
+            return Fernet.generate_key()
+
+        try:
+            Fernet(key.encode())
+            return key.encode()
+        except Exception:
+            kdf = PBKDF2HMAC(
+                algorithm=hashes.SHA256(),
+                length=32,
+                salt=b'plaid_token_kek_v1',
+                iterations=100000,
+                backend=default_backend()
+            )
+            return base64.urlsafe_b64encode(kdf.derive(key.encode()))
+
+    @staticmethod
+    def _cache_key(ciphertext: bytes) -> bytes:
+        return hashlib.sha256(ciphertext).digest()
+
+    def seal(self, token: str) -> Tuple[bytes, bytes]:
+        data_key = Fernet.generate_key()
+        ciphertext = Fernet(data_key).encrypt(token.encode())
+        wrapped_key = self._kek.encrypt(data_key)
+        self._cache.set(self._cache_key(ciphertext), token)
+        return ciphertext, wrapped_key
+
+    def unseal(self, ciphertext: bytes, wrapped_key: bytes) -> str:
+        cache_key = self._cache_key(ciphertext)
+        token = self._cache.get(cache_key)
+        if token is not None:
+            return token
+
+        try:
+            data_key = self._kek.decrypt(bytes(wrapped_key))
+            token = Fernet(data_key).decrypt(bytes(ciphertext)).decode()
+        except InvalidToken:
+            raise TokenVaultError("Failed to decrypt access token")
+
+        self._cache.set(cache_key, token)
+        return token
+
+    def store_token(self, account: BankAccount, token: str, sealed: Optional[Tuple[bytes, bytes]] = None) -> None:
+        if not self.has_master_key:
+            account.access_token = token
+            account.access_token_encrypted = account.access_token_key = None
+            return
+        account.access_token_encrypted, account.access_token_key = sealed or self.seal(token)
+        account.access_token = None
+
+    def get_token(self, account: BankAccount) -> Optional[str]:
+        if account.access_token_encrypted and account.access_token_key:
+            return self.unseal(account.access_token_encrypted, account.access_token_key)
+
+        if account.access_token:
+            # Token stored before encryption was introduced (or while no key was set): seal it on first use
+            token = account.access_token
+            if self.has_master_key:
+                self.store_token(account, token)
+            return token
+
+        return None
+
+    def get_tokens(self, accounts: Iterable[BankAccount]) -> Dict[int, Optional[str]]:
+        """Open the tokens of many accounts at once.
+
+        Accounts linked through the same Plaid item share one ciphertext, so
+        each distinct token is decrypted only once.
+        """
+        tokens = {}
+        for account in accounts:
+            try:
+                tokens[account.id] = self.get_token(account)
+            except TokenVaultError as e:
+                logger.error(f"Could not open access token for bank account {account.id}: {e}")
+                tokens[account.id] = None
+        return tokens
+
+    async def get_tokens_async(self, accounts: Iterable[BankAccount]) -> Dict[int, Optional[str]]:
+        return await run_in_threadpool(self.get_tokens, list(accounts))
+
+    def forget(self, account: BankAccount) -> None:
+        if account.access_token_encrypted:
+            self._cache.pop(self._cache_key(account.access_token_encrypted))
+
+    def cache_stats(self) -> dict:
+        return self._cache.stats()
+
+
+_token_vault = None
+
+def get_token_vault() -> TokenVault:
+    global _token_vault
+    if _token_vault is None:
+        _token_vault = TokenVault()
+    return _token_vault
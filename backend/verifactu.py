@@ -1,13 +1,12 @@
 import hashlib
-import base64
-import qrcode
-from io import BytesIO
 from datetime import datetime, date, timezone
 from decimal import Decimal
 from typing import Optional, Dict, Any
 from pydantic import BaseModel, Field
 from enum import Enum
 
+from qr_codes import render_qr_base64
+
 
 class VerifactuRecordType(str, Enum):
     INVOICE_COMPLETE = "F1"     # Factura completa (requires recipient)
@@ -92,12 +91,7 @@ class VerifactuService:
     NS_SUMINISTRO_INFO = "https://www2.agenciatributaria.gob.es/static_files/common/internet/dep/aplicaciones/es/aeat/tike/cont/ws/SuministroInformacion.xsd"
     
     @staticmethod
-    def generate_hash(
-        data: VerifactuRecordData,
-        previous_hash: Optional[str] = None
-    ) -> VerifactuHashResult:
-        prev = previous_hash or ""
-        
+    def _generation_timestamp() -> tuple[datetime, str]:
         try:
             from zoneinfo import ZoneInfo
             spain_tz = ZoneInfo("Europe/Madrid")
@@ -106,9 +100,18 @@ class VerifactuService:
             offset_formatted = f"{offset[:3]}:{offset[3:]}" 
             fecha_hora = timestamp.strftime(f"%Y-%m-%dT%H:%M:%S{offset_formatted}")
         except ImportError:
-            import time
             timestamp = datetime.now()
             fecha_hora = timestamp.strftime("%Y-%m-%dT%H:%M:%S+01:00")
+        return timestamp, fecha_hora
+    
+    @staticmethod
+    def generate_hash(
+        data: VerifactuRecordData,
+        previous_hash: Optional[str] = None
+    ) -> VerifactuHashResult:
+        prev = previous_hash or ""
+        
+        timestamp, fecha_hora = VerifactuService._generation_timestamp()
         
         hash_input = "&".join([
             f"IDEmisorFactura={data.nif.upper().strip()}",
@@ -131,11 +134,39 @@ class VerifactuService:
         )
     
     @staticmethod
-    def generate_qr_code(
+    def generate_cancellation_hash(
+        nif: str,
+        document_number: str,
+        document_date: date,
+        previous_hash: Optional[str] = None
+    ) -> VerifactuHashResult:
+        """Huella of a RegistroAnulacion, which is chained like any other record."""
+        prev = previous_hash or ""
+        
+        timestamp, fecha_hora = VerifactuService._generation_timestamp()
+        
+        hash_input = "&".join([
+            f"IDEmisorFacturaAnulada={nif.upper().strip()}",
+            f"NumSerieFacturaAnulada={document_number.strip()}",
+            f"FechaExpedicionFacturaAnulada={document_date.strftime('%d-%m-%Y')}",
+            f"Huella={prev}",
+            f"FechaHoraHusoGenRegistro={fecha_hora}"
+        ])
+        
+        hash_value = hashlib.sha256(hash_input.encode('utf-8')).hexdigest().upper()
+        
+        return VerifactuHashResult(
+            hash_value=hash_value,
+            previous_hash=prev if prev else None,
+            hash_input=hash_input,
+            timestamp=timestamp
+        )
+    
+    @staticmethod
+    def build_verification_url(
         data: VerifactuRecordData,
-        hash_value: str,
         is_sandbox: bool = True
-    ) -> VerifactuQRResult:
+    ) -> tuple[str, Dict[str, str]]:
         base_url = VerifactuService.QR_URL_SANDBOX if is_sandbox else VerifactuService.QR_URL_PRODUCTION
         
         qr_params = {
@@ -146,25 +177,18 @@ class VerifactuService:
         }
         
         params_str = "&".join(f"{k}={v}" for k, v in qr_params.items())
-        verification_url = f"{base_url}?{params_str}"
-        
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_M,
-            box_size=10,
-            border=4
-        )
-        qr.add_data(verification_url)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-        qr_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        return f"{base_url}?{params_str}", qr_params
+    
+    @staticmethod
+    def generate_qr_code(
+        data: VerifactuRecordData,
+        hash_value: str,
+        is_sandbox: bool = True
+    ) -> VerifactuQRResult:
+        verification_url, qr_params = VerifactuService.build_verification_url(data, is_sandbox)
         
         return VerifactuQRResult(
-            qr_base64=qr_base64,
+            qr_base64=render_qr_base64(verification_url),
             verification_url=verification_url,
             qr_params=qr_params
         )
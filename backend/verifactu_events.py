@@ -11,7 +11,7 @@ import json
 import logging
 
 from database import (
-    get_db, User, Invoice, InvoiceVerifactuEvent, 
+    get_db, in_unit_of_work, User, Invoice, InvoiceVerifactuEvent, InvoiceCancellation,
     VerifactuEvent, Report, ReportRecord
 )
 from auth import get_current_user
@@ -103,8 +103,7 @@ class VerifactuEventService:
     }
     
     @staticmethod
-    def log_invoice_event(
-        db: Session,
+    def invoice_event_values(
         user_id: int,
         invoice_id: int,
         event_type: VerifactuEventType,
@@ -114,10 +113,11 @@ class VerifactuEventService:
         user_agent: Optional[str] = None,
         event_data: Optional[Dict[str, Any]] = None,
         description: Optional[str] = None
-    ) -> InvoiceVerifactuEvent:
+    ) -> Dict[str, Any]:
+        """Column values for an invoice event, shared by single and bulk inserts."""
         event_type_value = event_type.value if isinstance(event_type, VerifactuEventType) else event_type
         
-        event = InvoiceVerifactuEvent(
+        return dict(
             user_id=user_id,
             invoice_id=invoice_id,
             event_type=event_type_value,
@@ -129,12 +129,31 @@ class VerifactuEventService:
             user_agent=user_agent[:500] if user_agent else None,
             event_data=event_data or {}
         )
+    
+    @staticmethod
+    def log_invoice_event(
+        db: Session,
+        user_id: int,
+        invoice_id: int,
+        event_type: VerifactuEventType,
+        hash_after: str,
+        hash_before: Optional[str] = None,
+        ip_address: Optional[str] = None,
+        user_agent: Optional[str] = None,
+        event_data: Optional[Dict[str, Any]] = None,
+        description: Optional[str] = None
+    ) -> InvoiceVerifactuEvent:
+        event = InvoiceVerifactuEvent(**VerifactuEventService.invoice_event_values(
+            user_id, invoice_id, event_type, hash_after, hash_before,
+            ip_address, user_agent, event_data, description
+        ))
         
         db.add(event)
-        db.commit()
-        db.refresh(event)
+        if not in_unit_of_work(db):
+            db.commit()
+            db.refresh(event)
         
-        logger.info(f"VeriFactu event logged: {event_type_value} for invoice {invoice_id}")
+        logger.info(f"VeriFactu event logged: {event.event_type} for invoice {invoice_id}")
         
         return event
     
@@ -165,8 +184,9 @@ class VerifactuEventService:
         )
         
         db.add(event)
-        db.commit()
-        db.refresh(event)
+        if not in_unit_of_work(db):
+            db.commit()
+            db.refresh(event)
         
         logger.info(f"VeriFactu event logged: {event_type_value} for report {report_id}")
         
@@ -195,8 +215,9 @@ class VerifactuEventService:
         )
         
         db.add(event)
-        db.commit()
-        db.refresh(event)
+        if not in_unit_of_work(db):
+            db.commit()
+            db.refresh(event)
         
         return event
     
@@ -207,20 +228,18 @@ class VerifactuEventService:
         entity_type: str = "invoice"
     ) -> tuple[bool, Optional[str]]:
         if entity_type == "invoice":
-            events = db.query(InvoiceVerifactuEvent).filter(
-                InvoiceVerifactuEvent.user_id == user_id
-            ).order_by(InvoiceVerifactuEvent.created_at.asc()).all()
-        else:
-            events = db.query(VerifactuEvent).filter(
-                VerifactuEvent.user_id == user_id
-            ).order_by(VerifactuEvent.created_at.asc()).all()
+            return VerifactuEventService._verify_invoice_chain(db, user_id)
+        
+        events = db.query(VerifactuEvent).filter(
+            VerifactuEvent.user_id == user_id
+        ).order_by(VerifactuEvent.created_at.asc()).all()
         
         if not events:
             return True, None
         
         chains = {}
         for event in events:
-            key = getattr(event, 'invoice_id', None) or getattr(event, 'report_id', None) or 'system'
+            key = event.report_id or 'system'
             if key not in chains:
                 chains[key] = []
             chains[key].append(event)
@@ -235,6 +254,38 @@ class VerifactuEventService:
         
         return True, None
     
+    @staticmethod
+    def _verify_invoice_chain(db: Session, user_id: int) -> tuple[bool, Optional[str]]:
+        """Walk the invoice chain itself: altas and cancellations in the order they were chained.
+        
+        Cancelled invoices keep their rows, so every link can be checked directly.
+        """
+        links = [
+            (row.created_at, f"invoice {row.invoice_number}", row.verifactu_hash, row.previous_hash)
+            for row in db.query(
+                Invoice.created_at, Invoice.invoice_number, Invoice.verifactu_hash, Invoice.previous_hash
+            ).filter(
+                Invoice.user_id == user_id,
+                Invoice.verifactu_hash.isnot(None)
+            )
+        ]
+        links.extend(
+            (row.created_at, f"cancellation of invoice {row.invoice_number}", row.hash_value, row.previous_hash)
+            for row in db.query(
+                InvoiceCancellation.created_at, Invoice.invoice_number,
+                InvoiceCancellation.hash_value, InvoiceCancellation.previous_hash
+            ).join(Invoice, Invoice.id == InvoiceCancellation.invoice_id).filter(
+                InvoiceCancellation.user_id == user_id
+            )
+        )
+        links.sort(key=lambda link: link[0])
+        
+        for prev_link, curr_link in zip(links, links[1:]):
+            if curr_link[3] != prev_link[2]:
+                return False, f"Chain break at {curr_link[1]}: previous hash does not match {prev_link[1]}"
+        
+        return True, None
+    
     @staticmethod
     def get_events_for_export(
         db: Session,
@@ -243,7 +294,11 @@ class VerifactuEventService:
         date_to: date
     ) -> List[Dict[str, Any]]:
 
-        invoice_events = db.query(InvoiceVerifactuEvent).filter(
+        invoice_events = db.query(
+            InvoiceVerifactuEvent, Invoice.invoice_number, Invoice.invoice_date
+        ).outerjoin(
+            Invoice, Invoice.id == InvoiceVerifactuEvent.invoice_id
+        ).filter(
             and_(
                 InvoiceVerifactuEvent.user_id == user_id,
                 func.date(InvoiceVerifactuEvent.created_at) >= date_from,
@@ -261,16 +316,15 @@ class VerifactuEventService:
         
         export_records = []
         
-        for event in invoice_events:
-            invoice = db.query(Invoice).filter(Invoice.id == event.invoice_id).first()
+        for event, invoice_number, invoice_date in invoice_events:
             export_records.append({
                 "registro_id": f"INV-EVT-{event.id}",
                 "tipo_registro": "FACTURA",
                 "tipo_evento": event.event_type,
                 "codigo_evento": event.event_code,
                 "descripcion": event.description,
-                "numero_factura": invoice.invoice_number if invoice else None,
-                "fecha_factura": invoice.invoice_date.isoformat() if invoice else None,
+                "numero_factura": invoice_number,
+                "fecha_factura": invoice_date.isoformat() if invoice_date else None,
                 "huella_anterior": event.hash_before,
                 "huella_posterior": event.hash_after,
                 "fecha_evento": event.created_at.isoformat(),
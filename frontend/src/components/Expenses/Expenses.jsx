@@ -33,6 +33,7 @@ import {
   ParsedCount,
   ExpensesListCard,
   ExpensesListTitle,
+  LoadMoreButton,
   FiltersCardStyled,
   SummaryCardStyled,
 } from './Expenses.styles';
@@ -48,7 +49,10 @@ const Expenses = () => {
 
   const [user, setUser] = useState({ firstName: '', fullName: '' });
   const [expenses, setExpenses] = useState([]);
+  const [summary, setSummary] = useState({ count: 0, total_amount: 0 });
+  const [nextCursor, setNextCursor] = useState(null);
   const [isLoading, setIsLoading] = useState(true);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [isUploading, setIsUploading] = useState(false);
   const [isDragging, setIsDragging] = useState(false);
   const [parsedFiles, setParsedFiles] = useState(0);
@@ -62,16 +66,32 @@ const Expenses = () => {
   const loadData = useCallback(async () => {
     setIsLoading(true);
     try {
-      const [profileData, expensesData] = await Promise.all([getProfile(), getExpenses()]);
+      const [profileData, expensesData] = await Promise.all([getProfile(), getExpenses(appliedFilters)]);
       const nameParts = (profileData.full_name || '').split(' ');
       setUser({ firstName: nameParts[0] || 'User', fullName: profileData.full_name || 'User' });
       setExpenses(expensesData.expenses || []);
+      setSummary(expensesData.summary || { count: 0, total_amount: 0 });
+      setNextCursor(expensesData.next_cursor || null);
     } catch (err) {
       console.error('Failed to load data:', err);
     } finally {
       setIsLoading(false);
     }
-  }, []);
+  }, [appliedFilters]);
+
+  const handleLoadMore = async () => {
+    if (!nextCursor) return;
+    setIsLoadingMore(true);
+    try {
+      const expensesData = await getExpenses({ ...appliedFilters, cursor: nextCursor });
+      setExpenses((prev) => [...prev, ...(expensesData.expenses || [])]);
+      setNextCursor(expensesData.next_cursor || null);
+    } catch (err) {
+      console.error('Failed to load more expenses:', err);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
 
   useEffect(() => {
     loadData();
@@ -161,15 +181,9 @@ const Expenses = () => {
   };
   const formatAmount = (amount) => `€${parseFloat(amount).toLocaleString('es-ES', { minimumFractionDigits: 2 })}`;
 
-  const filteredExpenses = expenses.filter((expense) => {
-    if (appliedFilters.type && expense.type?.toLowerCase() !== appliedFilters.type) return false;
-    if (appliedFilters.dateFrom && new Date(expense.date) < new Date(appliedFilters.dateFrom)) return false;
-    if (appliedFilters.dateTo && new Date(expense.date) > new Date(appliedFilters.dateTo)) return false;
-    return true;
-  });
-
-  const totalExpenses = filteredExpenses.reduce((sum, exp) => sum + parseFloat(exp.amount || 0), 0);
-  const expenseCount = filteredExpenses.length;
+  // Filters are applied by the API and the totals cover every matching expense, not only the loaded pages
+  const totalExpenses = summary.total_amount;
+  const expenseCount = summary.count;
   const estimatedDeductible = totalExpenses * 0.21;
 
   const columns = [
@@ -242,7 +256,7 @@ const Expenses = () => {
             <ExpensesListTitle>Expenses List</ExpensesListTitle>
             <DataTable
               columns={columns}
-              data={filteredExpenses}
+              data={expenses}
               loading={isLoading}
               loadingText="Loading expenses..."
               emptyText="No expenses found. Upload your first expense or add one manually!"
@@ -257,6 +271,11 @@ const Expenses = () => {
                 </>
               )}
             />
+            {nextCursor && !isLoading && (
+              <LoadMoreButton onClick={handleLoadMore} disabled={isLoadingMore}>
+                {isLoadingMore ? 'Loading...' : 'Load more'}
+              </LoadMoreButton>
+            )}
           </ExpensesListCard>
         </ContentGrid>
       </MainContent>
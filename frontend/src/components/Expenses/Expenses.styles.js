@@ -214,3 +214,8 @@ export const ExpensesListTitle = styled.h2`
   margin: 0 0 1rem;
   text-align: center;
 `;
+
+export const LoadMoreButton = styled(BrowseButton)`
+  display: block;
+  margin: 1.5rem auto 0;
+`;
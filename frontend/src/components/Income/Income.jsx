@@ -35,6 +35,7 @@ import {
   IncomeListTitle,
   FiltersCardStyled,
   SummaryCardStyled,
+  LoadMoreButton,
 } from './Income.styles';
 
 const Income = () => {
@@ -43,7 +44,10 @@ const Income = () => {
 
   const [user, setUser] = useState({ firstName: '', fullName: '' });
   const [invoices, setInvoices] = useState([]);
+  const [summary, setSummary] = useState({ count: 0, total_amount: 0 });
+  const [nextCursor, setNextCursor] = useState(null);
   const [isLoading, setIsLoading] = useState(true);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [isUploading, setIsUploading] = useState(false);
   const [isDragging, setIsDragging] = useState(false);
   const [parsedFiles, setParsedFiles] = useState(0);
@@ -56,17 +60,32 @@ const Income = () => {
   const loadData = useCallback(async () => {
     setIsLoading(true);
     try {
-      const profile = await getProfile();
+      const [profile, invoicesData] = await Promise.all([getProfile(), getInvoices(appliedFilters)]);
       const [firstName = ''] = (profile.full_name || '').split(' ');
       setUser({ firstName, fullName: profile.full_name || '' });
-      const invoicesData = await getInvoices();
-      setInvoices(invoicesData);
+      setInvoices(invoicesData.invoices);
+      setSummary(invoicesData.summary || { count: 0, total_amount: 0 });
+      setNextCursor(invoicesData.nextCursor);
     } catch (error) {
       console.error('Failed to load data:', error);
     } finally {
       setIsLoading(false);
     }
-  }, []);
+  }, [appliedFilters]);
+
+  const handleLoadMore = async () => {
+    if (!nextCursor) return;
+    setIsLoadingMore(true);
+    try {
+      const invoicesData = await getInvoices({ ...appliedFilters, cursor: nextCursor });
+      setInvoices((prev) => [...prev, ...invoicesData.invoices]);
+      setNextCursor(invoicesData.nextCursor);
+    } catch (error) {
+      console.error('Failed to load more invoices:', error);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
 
   useEffect(() => {
     loadData();
@@ -74,12 +93,12 @@ const Income = () => {
 
   const handleDragOver = useCallback((e) => { e.preventDefault(); setIsDragging(true); }, []);
   const handleDragLeave = useCallback((e) => { e.preventDefault(); setIsDragging(false); }, []);
-  const handleDrop = useCallback(async (e) => {
+  const handleDrop = async (e) => {
     e.preventDefault();
     setIsDragging(false);
     const files = Array.from(e.dataTransfer.files);
     await handleFilesUpload(files);
-  }, []);
+  };
 
   const handleFileSelect = async (e) => {
     const files = Array.from(e.target.files || []);
@@ -100,8 +119,7 @@ const Income = () => {
     try {
       const results = await uploadIncome(validFiles);
       setParsedFiles((prev) => prev + results.length);
-      const updatedInvoices = await getInvoices();
-      setInvoices(updatedInvoices);
+      await loadData();
     } catch (error) {
       console.error('Upload failed:', error);
       alert(error.response?.data?.detail || 'Failed to upload files');
@@ -132,8 +150,8 @@ const Income = () => {
     setIsDeleting(true);
     try {
       await deleteInvoice(deleteModal.invoiceId);
-      setInvoices((prev) => prev.filter((inv) => inv.id !== deleteModal.invoiceId));
       setDeleteModal({ isOpen: false, invoiceId: null, invoiceName: '' });
+      await loadData();
     } catch (error) {
       console.error('Failed to delete invoice:', error);
       alert('Failed to delete invoice');
@@ -171,14 +189,9 @@ const Income = () => {
   };
   const formatAmount = (amount) => `€${parseFloat(amount).toLocaleString('es-ES', { minimumFractionDigits: 2 })}`;
 
-  const filteredInvoices = invoices.filter((invoice) => {
-    if (appliedFilters.dateFrom && new Date(invoice.invoice_date) < new Date(appliedFilters.dateFrom)) return false;
-    if (appliedFilters.dateTo && new Date(invoice.invoice_date) > new Date(appliedFilters.dateTo)) return false;
-    return true;
-  });
-
-  const totalIncome = filteredInvoices.reduce((sum, inv) => sum + parseFloat(inv.total || 0), 0);
-  const invoiceCount = filteredInvoices.length;
+  // Filters are applied by the API and the totals cover every matching invoice, not only the loaded pages
+  const totalIncome = summary.total_amount;
+  const invoiceCount = summary.count;
   const estimatedIVA = totalIncome * 0.21;
 
   const columns = [
@@ -249,7 +262,7 @@ const Income = () => {
             <IncomeListTitle>Income List</IncomeListTitle>
             <DataTable
               columns={columns}
-              data={filteredInvoices}
+              data={invoices}
               loading={isLoading}
               loadingText="Loading invoices..."
               emptyText="No invoices found. Create your first invoice or upload existing ones!"
@@ -264,6 +277,11 @@ const Income = () => {
                 </>
               )}
             />
+            {nextCursor && !isLoading && (
+              <LoadMoreButton onClick={handleLoadMore} disabled={isLoadingMore}>
+                {isLoadingMore ? 'Loading...' : 'Load more'}
+              </LoadMoreButton>
+            )}
           </IncomeListCard>
         </ContentGrid>
       </MainContent>
@@ -215,3 +215,7 @@ export const IncomeListTitle = styled.h2`
   text-align: center;
 `;
 
+export const LoadMoreButton = styled(BrowseButton)`
+  display: block;
+  margin: 1.5rem auto 0;
+`;
@@ -295,9 +295,23 @@ export const createInvoice = async (invoiceData) => {
   return response.data;
 };
 
-export const getInvoices = async (limit = 50, offset = 0) => {
-  const response = await api.get('/invoices/', { params: { limit, offset } });
-  return response.data;
+export const getInvoices = async (filters = {}) => {
+  const params = {};
+  if (filters.dateFrom) params.date_from = filters.dateFrom;
+  if (filters.dateTo) params.date_to = filters.dateTo;
+  if (filters.status) params.status = filters.status;
+  if (filters.cursor) params.cursor = filters.cursor;
+  if (filters.limit) params.limit = filters.limit;
+
+  const response = await api.get('/invoices/', { params });
+  const totalCount = response.headers['x-total-count'];
+  return {
+    invoices: response.data,
+    nextCursor: response.headers['x-next-cursor'] || null,
+    summary: totalCount == null
+      ? null
+      : { count: Number(totalCount), total_amount: Number(response.headers['x-total-amount'] || 0) },
+  };
 };
 
 export const getInvoice = async (invoiceId) => {
@@ -358,6 +372,12 @@ export const getExpenses = async (filters = {}) => {
   if (filters.dateFrom) params.date_from = filters.dateFrom;
   if (filters.dateTo) params.date_to = filters.dateTo;
   if (filters.type) params.type = filters.type;
+  if (filters.category) params.category = filters.category;
+  if (filters.minAmount != null) params.min_amount = filters.minAmount;
+  if (filters.maxAmount != null) params.max_amount = filters.maxAmount;
+  if (filters.search) params.q = filters.search;
+  if (filters.cursor) params.cursor = filters.cursor;
+  if (filters.limit) params.limit = filters.limit;
 
   try {
     const response = await api.get('/expenses/', { params });